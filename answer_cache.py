@@ -0,0 +1,201 @@
+import os
+import re
+import time
+import threading
+
+import numpy as np
+import pandas as pd
+
+from bm25 import tokenize
+from embeddings import embedding_model_name
+from knowledge_base import file_sha256
+from partitions import detect_property_types, detect_rental_type
+from retrievers import normalize_rows
+
+# Cosine similarity a new query needs with a cached one to reuse its answer, by the cached
+# answer's route (text-embedding-ada-002 scores: unrelated questions already reach about 0.7)
+ANSWER_THRESHOLDS = {"information_retrieval": 0.93, "property_data_analysis": 0.96, "general_support": 0.95}
+# Most answers held at once (least recently used are evicted first) and seconds each stays valid
+ANSWER_CACHE_SIZE = 1000
+ANSWER_TTL = 24 * 3600
+# Property database columns naming places; a cached answer is only reused for a query naming the same places
+PLACE_COLUMNS = ["town", "street_name", "nearest_mrt_name", "nearest_school_name"]
+# Words of place names that are also street types or everyday words ("view", "park" and "hill" stay)
+_PLACE_FILLER = {
+    "ave", "avenue", "st", "street", "rd", "road", "dr", "drive", "lane", "ln", "cres", "crescent", "close",
+    "link", "walk", "way", "mrt", "lrt", "station", "school", "primary", "secondary", "high", "girl", "boy",
+    "centre", "center", "new", "upper", "lower", "north", "south", "east", "west", "good", "place",
+}
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+def place_terms(csv_path):
+    """Terms of the place names in the property database (towns, streets, MRT stations, schools)"""
+    data = pd.read_csv(csv_path, usecols=lambda column: column in PLACE_COLUMNS)
+    terms = set()
+    for column in data.columns:
+        for name in data[column].dropna().unique():
+            terms.update(tokenize(str(name)))
+    return set(term for term in terms if not term.isdigit() and term not in _PLACE_FILLER)
+
+
+class FileVersion:
+    """Content hash of a file, recomputed only when its size or modification time changes"""
+
+    def __init__(self, path):
+        self.path = path
+        self._stat = None
+        self._digest = None
+
+    def current(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != self._stat:
+            self._digest = file_sha256(self.path)
+            self._stat = (stat.st_size, stat.st_mtime_ns)
+        return self._digest
+
+
+class AnswerCache:
+    """Final answers to earlier queries, reused for new queries that paraphrase them.
+
+    A query matches a cached one when the cosine similarity of their embeddings
+    reaches the threshold of the cached answer's route, both were asked for the
+    same tenant (or none), and both name the same key terms: numbers, property
+    and rental types, and places from the property database (`places`, which
+    may be a function so the database is only read on the first query). The key terms keep
+    "rent in Bishan" from reusing the answer to "rent in Bedok", which embeddings
+    alone place very close. Each answer carries the version of the data it was
+    computed from (the knowledge base version for information retrieval, the
+    property database hash for data analysis) and is dropped as soon as
+    lookup() is given another one. Answers also expire after `ttl` seconds.
+    """
+
+    def __init__(self, thresholds=None, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_TTL, places=None):
+        self.thresholds = {**ANSWER_THRESHOLDS, **(thresholds or {})}
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Place terms, or a function returning them that is called on first use (e.g. reading the property database)
+        self._places = places if callable(places) else set(places or ())
+        self.entries = []
+        self.vectors = None
+        self.model = None
+        self.lookups = 0
+        self.hits = {}
+        self.saved_seconds = 0.0
+        self.invalidated = 0
+        self.expired = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._places_lock = threading.Lock()
+
+    @property
+    def places(self):
+        if callable(self._places):
+            with self._places_lock:
+                if callable(self._places):
+                    self._places = set(self._places())
+        return self._places
+
+    def key_terms(self, query):
+        """Numbers, property and rental types and places a query names; a cached answer needs the same ones"""
+        terms = set(_NUMBER_RE.findall(query))
+        terms.update(f"pt_{name}" for name in detect_property_types(query))
+        rental_type = detect_rental_type(query)
+        if rental_type:
+            terms.add(f"rt_{rental_type}")
+        terms.update(term for term in tokenize(query) if term in self.places)
+        return terms
+
+    def threshold(self, route):
+        return self.thresholds.get(route, self.thresholds["general_support"])
+
+    def _keep(self, keep):
+        positions = [i for i, entry in enumerate(self.entries) if keep(entry)]
+        dropped = len(self.entries) - len(positions)
+        if dropped:
+            self.entries = [self.entries[i] for i in positions]
+            self.vectors = self.vectors[positions]
+        return dropped
+
+    def _prune(self, model, versions):
+        if model != self.model:
+            # Vectors of another embedding model (e.g. a refitted local one) cannot be compared
+            self.invalidated += len(self.entries)
+            self.entries, self.vectors, self.model = [], None, model
+        self.invalidated += self._keep(lambda entry: versions.get(entry["route"], entry["version"]) == entry["version"])
+        if self.ttl is not None:
+            now = time.time()
+            self.expired += self._keep(lambda entry: now - entry["created"] <= self.ttl)
+
+    def lookup(self, query, embeddings, tenant=None, versions=None):
+        """Cached answer of the closest matching earlier query (with its route, sources and similarity), or None.
+
+        `versions` maps each route to the current version of its data; answers
+        computed on another version are dropped first.
+        """
+        start = time.perf_counter()
+        model = getattr(embeddings, "model_name", None) or embedding_model_name(embeddings)
+        query_vector = normalize_rows([embeddings.embed_query(query)])[0]
+        terms = self.key_terms(query)
+        with self._lock:
+            self.lookups += 1
+            self._prune(model, versions or {})
+            if not self.entries:
+                return None
+            scores = self.vectors @ query_vector
+            for i in np.argsort(-scores):
+                if scores[i] < min(self.thresholds.values()):
+                    break
+                entry = self.entries[i]
+                if scores[i] >= self.threshold(entry["route"]) and entry["tenant"] == tenant and entry["terms"] == terms:
+                    entry["last_used"] = time.time()
+                    self.hits[entry["route"]] = self.hits.get(entry["route"], 0) + 1
+                    self.saved_seconds += max(0.0, entry["seconds"] - (time.perf_counter() - start))
+                    return {**entry, "similarity": float(scores[i])}
+        return None
+
+    def add(self, query, embeddings, route, answer, sources=None, seconds=0.0, tenant=None, version=None):
+        """Cache the answer to a query; `seconds` is how long it took to produce, `version` that of its data"""
+        model = getattr(embeddings, "model_name", None) or embedding_model_name(embeddings)
+        query_vector = normalize_rows([embeddings.embed_query(query)])[0]
+        now = time.time()
+        entry = {
+            "query": query,
+            "route": route,
+            "answer": answer,
+            "sources": sources or [],
+            "seconds": seconds,
+            "tenant": tenant,
+            "version": version,
+            "terms": self.key_terms(query),
+            "created": now,
+            "last_used": now,
+        }
+        with self._lock:
+            if model != self.model:
+                self._prune(model, {})
+            self.entries.append(entry)
+            self.vectors = query_vector[None, :] if self.vectors is None else np.vstack([self.vectors, query_vector])
+            if len(self.entries) > self.max_entries:
+                oldest = min(self.entries, key=lambda cached: cached["last_used"])
+                self._keep(lambda cached: cached is not oldest)
+                self.evictions += 1
+
+    def stats(self):
+        """Hit rate by route and the answering time saved since this cache was created"""
+        with self._lock:
+            hits = sum(self.hits.values())
+            return {
+                "entries": len(self.entries),
+                "lookups": self.lookups,
+                "hits": hits,
+                "hit_rate": hits / self.lookups if self.lookups else 0.0,
+                "hits_by_route": dict(self.hits),
+                "saved_seconds": self.saved_seconds,
+                "invalidated": self.invalidated,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
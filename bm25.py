@@ -0,0 +1,135 @@
+import os
+import re
+import json
+import math
+from collections import Counter
+
+# Inverted index file stored inside the Chroma DB directory
+BM25_INDEX_FILE = "bm25_index.json"
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:[-/'][a-z0-9]+)*")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "has", "have",
+    "how", "i", "if", "in", "is", "it", "its", "me", "my", "of", "on", "or", "shall", "that", "the",
+    "their", "there", "this", "to", "was", "what", "when", "which", "who", "will", "with", "you", "your",
+}
+
+
+def _stem(word):
+    # Light plural stripping so "pets" matches "pet" and "repairs" matches "repair"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords; hyphenated terms also index their parts.
+
+    "air-con" yields "air-con", "aircon", "air" and "con", so it matches both
+    "aircon" and "air-conditioning" in the clause text.
+    """
+    tokens = []
+    for word in _WORD_RE.findall(text.lower()):
+        word = word.replace("'s", "")
+        parts = re.split(r"[-/']", word)
+        if len(parts) > 1:
+            tokens.append(word)
+            tokens.append("".join(parts))
+        tokens.extend(parts)
+    return [_stem(token) for token in tokens if token and token not in STOPWORDS]
+
+
+class BM25Index:
+    """Incrementally updatable inverted index scored with Okapi BM25.
+
+    Postings map each term to {chunk_id: term frequency}. Chunks are added and
+    removed by ID alongside the vector store, and the index is saved as JSON
+    next to it.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+        self._doc_terms = None
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def _forward_index(self):
+        # Chunk -> terms, rebuilt lazily from the postings when chunks need removing
+        if self._doc_terms is None:
+            self._doc_terms = {}
+            for term, postings in self.postings.items():
+                for chunk_id in postings:
+                    self._doc_terms.setdefault(chunk_id, []).append(term)
+        return self._doc_terms
+
+    def add(self, ids, texts):
+        """Index chunks, replacing any existing entries with the same IDs"""
+        self.remove([chunk_id for chunk_id in ids if chunk_id in self.doc_lengths])
+        forward = self._forward_index()
+        for chunk_id, text in zip(ids, texts):
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[chunk_id] = tf
+            forward[chunk_id] = list(counts)
+            length = sum(counts.values())
+            self.doc_lengths[chunk_id] = length
+            self.total_length += length
+
+    def remove(self, ids):
+        """Drop chunks from the index"""
+        forward = self._forward_index()
+        for chunk_id in ids:
+            if chunk_id not in self.doc_lengths:
+                continue
+            for term in forward.pop(chunk_id, []):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self.postings[term]
+            self.total_length -= self.doc_lengths.pop(chunk_id)
+
+    def search(self, query, k=10, allowed_ids=None):
+        """Top-k (chunk_id, score) pairs for a query, optionally restricted to allowed_ids"""
+        n_docs = len(self.doc_lengths)
+        if not n_docs:
+            return []
+        avg_length = self.total_length / n_docs
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                if allowed_ids is not None and chunk_id not in allowed_ids:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self, path):
+        """Write the index atomically"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "doc_lengths": self.doc_lengths, "postings": self.postings}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved index, or return an empty one if none exists"""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(data["k1"], data["b"])
+        index.postings = data["postings"]
+        index.doc_lengths = data["doc_lengths"]
+        index.total_length = sum(index.doc_lengths.values())
+        return index
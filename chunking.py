@@ -0,0 +1,139 @@
+import re
+
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# "1. RENT", "2. The Tenant hereby agrees with the Landlord as follows:"
+SECTION_RE = re.compile(r"^\s*(\d{1,2})\.\s+(\S.*?)\s*$")
+# "(a) RENT", "(ab) COMPLIANCE WITH MANAGEMENT CORPORATION" - sub-clause headings are upper case
+SUBCLAUSE_RE = re.compile(r"^\s*\(([a-z]{1,2})\)\s+([A-Z][A-Z0-9 ,/&'().\-]*?)\s*$")
+# Bare page numbers printed at the top of each page
+PAGE_NUMBER_RE = re.compile(r"^\s*\d{1,3}\s*$")
+
+
+def _clause_blocks(pages):
+    """Group the lines of a document's pages into clause blocks.
+
+    Returns a list of dicts with the block's lines, start page, section title
+    and sub-clause heading (None for section-level text and the preamble).
+    """
+    blocks = []
+    current = {"lines": [], "page": None, "section": None, "heading": None}
+    section = None
+    for page in pages:
+        for line in page.page_content.splitlines():
+            if not line.strip() or PAGE_NUMBER_RE.match(line):
+                continue
+            section_match = SECTION_RE.match(line)
+            subclause_match = SUBCLAUSE_RE.match(line)
+            if section_match or subclause_match:
+                if current["lines"]:
+                    blocks.append(current)
+                if section_match:
+                    section = f"{section_match.group(1)}. {section_match.group(2)}"
+                    heading = None
+                else:
+                    heading = f"({subclause_match.group(1)}) {' '.join(subclause_match.group(2).split())}"
+                current = {"lines": [], "page": page.metadata.get("page"), "section": section, "heading": heading}
+            if current["page"] is None:
+                current["page"] = page.metadata.get("page")
+            current["lines"].append(line.rstrip())
+    if current["lines"]:
+        blocks.append(current)
+    return blocks
+
+
+def record_blocks(records):
+    """Clause blocks of a document given as structured records instead of pages.
+
+    Each record ({"section", "heading", "text", ...} as written by
+    tenancy_agreement_generator) becomes one block laid out as _clause_blocks
+    reads it from a PDF: the section title before the first record of a section,
+    then the heading, then the text.
+    """
+    blocks = []
+    section = None
+    for record in records:
+        lines = []
+        if record.get("section") and record["section"] != section:
+            lines.append(record["section"])
+        section = record.get("section")
+        heading = " ".join(record["heading"].split()) if record.get("heading") else None
+        if heading:
+            lines.append(heading)
+        lines.extend(line.rstrip() for line in record["text"].splitlines() if line.strip())
+        blocks.append({"lines": lines, "page": None, "section": section, "heading": heading})
+    return blocks
+
+
+def records_text(records):
+    """Plain text of a document given as clause records, as its PDF would read"""
+    return "\n".join(line for block in record_blocks(records) for line in block["lines"])
+
+
+class ClauseTextSplitter:
+    """Split tenancy agreements into one chunk per numbered clause.
+
+    Section ("2. The Tenant hereby agrees ...") and sub-clause ("(d) DEFECT FREE
+    PERIOD") headings start new chunks, and each chunk records its section and
+    heading in metadata. Blocks shorter than min_chunk_size (e.g. a section title
+    directly followed by its first sub-clause) are merged into the next block.
+    Only clauses longer than chunk_size are split further, with chunk_overlap
+    characters of overlap and the heading repeated on every part.
+    """
+
+    def __init__(self, chunk_size=1500, chunk_overlap=150, min_chunk_size=80):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.min_chunk_size = min_chunk_size
+        self._oversize_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+        )
+
+    def split_documents(self, pages):
+        """Split the pages of one PDF into clause chunks"""
+        if not pages:
+            return []
+        base_metadata = {key: value for key, value in pages[0].metadata.items() if key not in ("page", "page_label")}
+        return self._split_blocks(_clause_blocks(pages), base_metadata, pages[-1].metadata.get("page"))
+
+    def split_records(self, records, metadata=None):
+        """Split one document's clause records into clause chunks (no page numbers are recorded)"""
+        return self._split_blocks(record_blocks(records), metadata or {})
+
+    def _split_blocks(self, blocks, base_metadata, last_page=None):
+        chunks = []
+        carry = ""
+        for block in blocks:
+            text = "\n".join(block["lines"]).strip()
+            if carry:
+                text = f"{carry}\n{text}"
+                carry = ""
+            if len(text) < self.min_chunk_size and block["heading"] is None:
+                carry = text
+                continue
+
+            metadata = dict(base_metadata)
+            if block["page"] is not None:
+                metadata["page"] = block["page"]
+            if block["section"]:
+                metadata["section"] = block["section"]
+            if block["heading"]:
+                metadata["heading"] = block["heading"]
+
+            if len(text) <= self.chunk_size:
+                chunks.append(Document(page_content=text, metadata=metadata))
+                continue
+            # Oversized clause: split with overlap, keeping the heading on every part
+            parts = self._oversize_splitter.split_text(text)
+            for i, part in enumerate(parts):
+                if i and block["heading"]:
+                    part = f"{block['heading']} (cont.)\n{part}"
+                chunks.append(Document(page_content=part, metadata={**metadata, "part": i}))
+
+        if carry:
+            metadata = dict(base_metadata) if last_page is None else {**base_metadata, "page": last_page}
+            chunks.append(Document(page_content=carry, metadata=metadata))
+        return chunks
@@ -0,0 +1,174 @@
+import os
+import re
+import json
+
+from langchain_core.documents import Document
+
+from bm25 import STOPWORDS
+from partitions import detect_property_types, detect_rental_type
+
+# Clause heading index file stored inside the Chroma DB directory
+CLAUSE_INDEX_FILE = "clause_index.json"
+
+# Other ways tenants name a clause, mapped to the headings (without their "(x)"
+# label) used in the agreements and clause documents
+CLAUSE_SYNONYMS = {
+    "late payment interest": ["INTEREST FOR RENT ARREARS"],
+    "late payment": ["INTEREST FOR RENT ARREARS"],
+    "late rent": ["INTEREST FOR RENT ARREARS"],
+    "rent arrears": ["INTEREST FOR RENT ARREARS"],
+    "deposit": ["SECURITY DEPOSIT"],
+    "bulbs": ["REPLACEMENT OF BULBS"],
+    "light bulbs": ["REPLACEMENT OF BULBS"],
+    "replace bulbs": ["REPLACEMENT OF BULBS"],
+    "aircon servicing": ["SERVICE OF AIRCON"],
+    "servicing of aircon": ["SERVICE OF AIRCON"],
+    "servicing aircon": ["SERVICE OF AIRCON"],
+    "aircon maintenance": ["MAINTENANCE OF AIRCON"],
+    "pets": ["PETS", "NO KEEPING OF PETS"],
+    "keep pets": ["PETS", "NO KEEPING OF PETS"],
+    "sublet": ["ASSIGNMENT/SUBLETTING", "NO ASSIGNMENT/SUBLETTING"],
+    "subletting": ["ASSIGNMENT/SUBLETTING", "NO ASSIGNMENT/SUBLETTING"],
+    "en bloc": ["ENBLOC RE-DEVELOPMENT"],
+    "enbloc": ["ENBLOC RE-DEVELOPMENT"],
+    "redevelopment": ["ENBLOC RE-DEVELOPMENT", "LAND ACQUISITION / RE-DEVELOPMENT CLAUSE"],
+    "collective sale": ["ENBLOC RE-DEVELOPMENT"],
+    "early termination": ["DIPLOMATIC CLAUSE"],
+    "break clause": ["DIPLOMATIC CLAUSE"],
+    "renew lease": ["OPTION TO RENEW"],
+    "renewal": ["OPTION TO RENEW"],
+    "stamp duty": ["STAMPING"],
+    "smoking": ["NO SMOKING"],
+    "cooking": ["NO COOKING"],
+    "cook": ["NO COOKING"],
+    "property tax": ["PAYMENT OF PROPERTY TAX"],
+    "agent commission": ["REIMBURSEMENT OF PRO-RATA COMMISSION"],
+    "defects": ["DEFECT FREE PERIOD"],
+}
+
+# "(d) DEFECT FREE PERIOD" -> "DEFECT FREE PERIOD"
+_LABEL_RE = re.compile(r"^\s*\([a-z]{1,2}\)\s*", re.IGNORECASE)
+# Hyphenated words are joined: "air-con" -> "aircon", "RE-DEVELOPMENT" -> "redevelopment"
+_WORD_RE = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+
+def clause_terms(text):
+    """Lowercase words of a heading or query without stopwords, single letters and plural endings"""
+    terms = []
+    for word in _WORD_RE.findall(text.lower()):
+        word = word.replace("-", "")
+        if word in STOPWORDS or (len(word) == 1 and not word.isdigit()):
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def heading_key(heading):
+    """Normalized form of a clause heading, e.g. "(b) INTEREST FOR RENT ARREARS" -> "interest rent arrear" """
+    return " ".join(clause_terms(_LABEL_RE.sub("", heading)))
+
+
+def _matches_partitions(metadata, property_types, rental_type):
+    property_types = [name for name in property_types if name != "standard"]
+    if property_types and not any(metadata.get(f"pt_{name}") for name in property_types + ["standard"]):
+        return False
+    return not rental_type or metadata.get(f"rt_{rental_type}", True)
+
+
+class ClauseIndex:
+    """Stored chunks of each named clause, keyed by normalized heading and synonyms.
+
+    Chunks the clause splitter tagged with a sub-clause heading ("(d) DEFECT FREE
+    PERIOD") are indexed under the heading's normalized words ("defect free
+    period") and under every synonym in CLAUSE_SYNONYMS pointing to it ("late
+    payment interest"). One-word headings such as "(k) STAMPING" are only matched
+    as "stamping clause" unless a synonym lists them, so a passing "rent" does not
+    count as naming a clause. A lookup probes the query's word n-grams against
+    the keys, longest first, which takes microseconds and needs no embedding.
+    """
+
+    def __init__(self, clauses=None, chunk_count=0):
+        # Heading key -> [{"id", "text", "metadata"}] in store order
+        self.clauses = clauses or {}
+        self.chunk_count = chunk_count
+        self.phrases = {}
+        for key in self.clauses:
+            if len(key.split()) > 1:
+                self._add_phrase(key, key)
+            self._add_phrase(f"{key} clause", key)
+        for phrase, headings in CLAUSE_SYNONYMS.items():
+            for heading in headings:
+                if heading_key(heading) in self.clauses:
+                    self._add_phrase(" ".join(clause_terms(phrase)), heading_key(heading))
+        self.max_terms = max((len(phrase.split()) for phrase in self.phrases), default=0)
+
+    def __len__(self):
+        return len(self.clauses)
+
+    def _add_phrase(self, phrase, key):
+        keys = self.phrases.setdefault(phrase, [])
+        if key not in keys:
+            keys.append(key)
+
+    @classmethod
+    def from_chunks(cls, ids, texts, metadatas, chunk_count=None):
+        """Index the chunks that carry a sub-clause heading"""
+        clauses = {}
+        for chunk_id, text, metadata in zip(ids, texts, metadatas):
+            heading = (metadata or {}).get("heading")
+            if heading and heading_key(heading):
+                clauses.setdefault(heading_key(heading), []).append(
+                    {"id": chunk_id, "text": text, "metadata": metadata})
+        return cls(clauses, len(ids) if chunk_count is None else chunk_count)
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"chunk_count": self.chunk_count, "clauses": self.clauses}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["clauses"], data["chunk_count"])
+
+    def match(self, query):
+        """Heading keys of the clauses a query names, in the order they appear"""
+        terms = clause_terms(query)
+        matched = []
+        i = 0
+        while i < len(terms):
+            for n in range(min(self.max_terms, len(terms) - i), 0, -1):
+                keys = self.phrases.get(" ".join(terms[i:i + n]))
+                if keys:
+                    matched.extend(key for key in keys if key not in matched)
+                    i += n
+                    break
+            else:
+                i += 1
+        return matched
+
+    def lookup(self, query, k=3):
+        """Chunks of the clauses a query names (at most k per clause), or [] if it names none.
+
+        Chunks from documents outside the property and rental types the query
+        mentions are dropped, as in partitioned search, unless that leaves none.
+        """
+        property_types, rental_type = detect_property_types(query), detect_rental_type(query)
+        docs = []
+        for key in self.match(query):
+            entries = self.clauses[key]
+            in_partition = [entry for entry in entries
+                            if _matches_partitions(entry["metadata"], property_types, rental_type)]
+            # Clauses specific to a named property type come before the standard ones
+            in_partition.sort(key=lambda entry: not any(entry["metadata"].get(f"pt_{name}")
+                                                        for name in property_types if name != "standard"))
+            for entry in (in_partition or entries)[:k]:
+                docs.append(Document(page_content=entry["text"],
+                                     metadata={**entry["metadata"], "id": entry["id"], "clause": key}))
+        return docs
@@ -0,0 +1,181 @@
+import re
+import threading
+from collections import deque
+from typing import Any, List
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from bm25 import tokenize
+from embeddings import count_tokens
+
+# Chat model the packed context is sent to; its tiktoken encoding counts the tokens
+LLM_MODEL = "gpt-4o-mini"
+# Most context tokens a ContextPacker hands to the "stuff" chain for one query. Three whole clause
+# chunks (the unpacked top-3) cost about 750-1100 tokens, so this keeps under half of them
+PACK_TOKEN_BUDGET = 350
+# Budget the bot packs its context to; None sends the top-3 chunks whole. Packing is off by default:
+# on the QA pairs it lowered R@5 (chroma 0.684 -> 0.632) for the tokens it saved
+CONTEXT_TOKEN_BUDGET = None
+# Chunks scoring below the best retrieved chunk by more than this share of the spread between
+# the best and the worst retrieved score are left out, whatever the embedding's score range.
+# None leaves k to the budget alone: on the QA pairs every cutoff tried lost answer coverage
+SCORE_CUTOFF = None
+# Candidates retrieved per query before packing; the cutoff and budget decide how many are kept
+PACK_FETCH_K = 5
+# Chunks up to this many tokens are passed whole, longer ones are trimmed to the sentences the query touches
+TRIM_MIN_TOKENS = 80
+# Queries whose packing figures are kept for summary()
+PACK_HISTORY = 1000
+
+# Sentence ends, including the "; (ii)" breaks of enumerated clause text
+_SENTENCE_RE = re.compile(r"(?<=[.;?!])\s+")
+
+
+def split_sentences(text):
+    """Sentences of a chunk with its line wrapping undone; a heading line stays with the first sentence"""
+    return [sentence for sentence in _SENTENCE_RE.split(" ".join(text.split())) if sentence]
+
+
+def trim_to_query(text, query_terms):
+    """Keep the first sentence and those sharing a distinctive term with the query, in their original order.
+
+    Terms found in more than half of the chunk's sentences ("tenant", "premises")
+    do not pick sentences. Returns the text unchanged when no sentence matches,
+    since the chunk was then retrieved for its meaning rather than its wording.
+    """
+    sentences = split_sentences(text)
+    if len(sentences) < 3 or not query_terms:
+        return text
+    sentence_terms = [set(tokenize(sentence)) & query_terms for sentence in sentences]
+    counts = {}
+    for terms in sentence_terms:
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+    distinctive = set(term for term, count in counts.items() if count <= len(sentences) / 2)
+    keep = [i for i, terms in enumerate(sentence_terms) if terms & distinctive]
+    if not keep:
+        return text
+    kept, previous = [], 0
+    for i in [0] + [i for i in keep if i]:
+        # "..." marks where sentences were left out
+        kept.append(sentences[i] if i <= previous + 1 else f"... {sentences[i]}")
+        previous = i
+    if keep[-1] < len(sentences) - 1:
+        kept.append("...")
+    return " ".join(kept)
+
+
+def fit_to_budget(text, budget, model=LLM_MODEL):
+    """Leading sentences of a text that fit in `budget` tokens (at least the first, cut by characters)"""
+    kept, used = [], 0
+    for sentence in split_sentences(text):
+        tokens = count_tokens(sentence, model)
+        if used + tokens > budget:
+            break
+        kept.append(sentence)
+        used += tokens
+    if not kept:
+        # A first sentence longer than the budget is cut at about 4 characters per token
+        return text[:budget * 4]
+    return " ".join(kept)
+
+
+class ContextPacker:
+    """Choose and trim retrieved chunks so the "stuff" prompt stays within a token budget.
+
+    Chunks whose score falls below the best one by more than score_cutoff of the
+    spread between the best and worst retrieved scores are dropped, so a query
+    with one clearly relevant clause sends one chunk and a broad question sends
+    several (an adaptive k). Chunks longer than TRIM_MIN_TOKENS keep only
+    their first sentence and the sentences sharing a distinctive term with the
+    query. Chunks are then taken best first while they fit in token_budget
+    tokens, counted with the chat model's tiktoken encoding. Chunks without a
+    score (e.g. from the clause index) always pass the cutoff.
+
+    Every packed query is recorded against the first `baseline_k` chunks as
+    they were retrieved, i.e. the prompt the chain would have stuffed
+    without packing, so the tokens saved can be reported per query.
+    """
+
+    def __init__(self, token_budget=PACK_TOKEN_BUDGET, score_cutoff=SCORE_CUTOFF, trim=True, model=LLM_MODEL):
+        self.token_budget = token_budget
+        self.score_cutoff = score_cutoff
+        self.trim = trim
+        self.model = model
+        self.history = deque(maxlen=PACK_HISTORY)
+        self._lock = threading.Lock()
+
+    def pack(self, query, docs, baseline_k=3):
+        """Packed Documents for one query's retrieved chunks, best first; returns (docs, stats)"""
+        scores = [doc.metadata["score"] for doc in docs if doc.metadata.get("score") is not None]
+        cutoff = None
+        if scores and self.score_cutoff is not None:
+            cutoff = max(scores) - self.score_cutoff * (max(scores) - min(scores))
+        query_terms = set(tokenize(query))
+
+        packed, used = [], 0
+        for doc in docs:
+            score = doc.metadata.get("score")
+            if cutoff is not None and score is not None and score < cutoff:
+                continue
+            text = doc.page_content
+            if self.trim and count_tokens(text, self.model) > TRIM_MIN_TOKENS:
+                text = trim_to_query(text, query_terms)
+            tokens = count_tokens(text, self.model)
+            if used + tokens > self.token_budget:
+                if packed:
+                    # A later, shorter chunk may still fit
+                    continue
+                text = fit_to_budget(text, self.token_budget, self.model)
+                tokens = count_tokens(text, self.model)
+            packed.append(Document(page_content=text, metadata={**doc.metadata, "context_tokens": tokens}))
+            used += tokens
+
+        baseline = sum(count_tokens(doc.page_content, self.model) for doc in docs[:baseline_k])
+        stats = {
+            "query": query,
+            "retrieved": len(docs),
+            "chunks": len(packed),
+            "baseline_tokens": baseline,
+            "tokens": used,
+            "tokens_saved": baseline - used,
+        }
+        with self._lock:
+            self.history.append(stats)
+        return packed, stats
+
+    def summary(self):
+        """Totals over the recorded queries: chunks and context tokens per query, and tokens saved"""
+        with self._lock:
+            history = list(self.history)
+        if not history:
+            return {"queries": 0}
+        baseline = sum(stats["baseline_tokens"] for stats in history)
+        saved = sum(stats["tokens_saved"] for stats in history)
+        return {
+            "queries": len(history),
+            "chunks_per_query": sum(stats["chunks"] for stats in history) / len(history),
+            "tokens_per_query": sum(stats["tokens"] for stats in history) / len(history),
+            "saved_per_query": saved / len(history),
+            "saved_ratio": saved / baseline if baseline else 0.0,
+        }
+
+
+class PackedRetriever(BaseRetriever):
+    """Retriever whose results are packed by a ContextPacker before they reach the chain.
+
+    `retriever` should fetch more chunks than the chain used to receive
+    (PACK_FETCH_K), leaving the score cutoff and token budget to decide how many
+    are kept; `k` is the unpacked chunk count the savings are measured against.
+    """
+
+    retriever: Any
+    packer: Any
+    k: int = 3
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        docs, stats = self.packer.pack(query, self.retriever.invoke(query), self.k)
+        print(f"✂️ Context: {stats['chunks']} of {stats['retrieved']} chunks, {stats['tokens']} tokens "
+              f"({stats['tokens_saved']} saved against top-{self.k})")
+        return docs
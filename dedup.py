@@ -0,0 +1,182 @@
+import os
+import re
+import json
+import hashlib
+
+import numpy as np
+
+# Near-duplicate index stored inside the Chroma DB directory
+DEDUP_INDEX_FILE = "dedup_index.json"
+
+_WORD_RE = re.compile(r"\w+")
+# Mersenne prime for the (a * x + b) mod p permutations; 32-bit a, b and x keep a * x + b inside uint64
+_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingles(text, size=3):
+    """Set of lowercase word n-grams"""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    """Exact Jaccard similarity of two sets"""
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class NearDuplicateIndex:
+    """MinHash signatures with LSH banding for collapsing near-duplicate chunks.
+
+    Each stored (canonical) chunk keeps a MinHash signature; a new chunk whose
+    estimated Jaccard similarity to a canonical chunk reaches `threshold` becomes
+    one of its members instead of being stored and embedded again. Candidates are
+    found through LSH buckets (`bands` bands of num_perm / bands rows), so adding
+    a chunk does not compare it with every canonical chunk.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, bands=32, shingle_size=3, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+        self.signatures = {}
+        self.members = {}
+        self.canonical_of = {}
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def config(self):
+        return {"threshold": self.threshold, "num_perm": self.num_perm, "bands": self.bands,
+                "shingle_size": self.shingle_size, "seed": self.seed}
+
+    def signature(self, text):
+        """MinHash signature of a text's word shingles"""
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+             for s in shingles(text, self.shingle_size)],
+            dtype=np.uint64,
+        )
+        permuted = (np.outer(hashes, self._a) + self._b) % _PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        rows = self.num_perm // self.bands
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+
+    def _index(self, canonical_id, signature):
+        self.signatures[canonical_id] = signature
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, set()).add(canonical_id)
+
+    def _unindex(self, canonical_id):
+        signature = self.signatures.pop(canonical_id)
+        for key in self._band_keys(signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(canonical_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def find(self, signature):
+        """Most similar canonical chunk at or above the threshold, or None"""
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        best, best_similarity = None, self.threshold
+        for canonical_id in sorted(candidates):
+            similarity = float(np.mean(self.signatures[canonical_id] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = canonical_id, similarity
+        return best
+
+    def assign(self, chunk_id, text, reference):
+        """Register a chunk; returns (canonical_id, is_new) where is_new means it must be stored.
+
+        `reference` is a dict such as {"source": ..., "page": ...} recorded as one of
+        the canonical chunk's source references.
+        """
+        if chunk_id in self.canonical_of:
+            return self.canonical_of[chunk_id], False
+        signature = self.signature(text)
+        canonical_id = self.find(signature)
+        is_new = canonical_id is None
+        if is_new:
+            canonical_id = chunk_id
+            self._index(canonical_id, signature)
+            self.members[canonical_id] = []
+        self.members[canonical_id].append({"id": chunk_id, **reference})
+        self.canonical_of[chunk_id] = canonical_id
+        return canonical_id, is_new
+
+    def release(self, chunk_ids):
+        """Unregister chunks; returns (canonical IDs left without members, canonical IDs whose sources changed)"""
+        emptied, changed = set(), set()
+        for chunk_id in chunk_ids:
+            canonical_id = self.canonical_of.pop(chunk_id, None)
+            if canonical_id is None:
+                continue
+            members = [member for member in self.members[canonical_id] if member["id"] != chunk_id]
+            if members:
+                self.members[canonical_id] = members
+                changed.add(canonical_id)
+            else:
+                del self.members[canonical_id]
+                self._unindex(canonical_id)
+                emptied.add(canonical_id)
+        return sorted(emptied), sorted(changed - emptied)
+
+    def retain(self, chunk_ids):
+        """Release every chunk not in chunk_ids (e.g. left behind by an interrupted sync)"""
+        keep = set(chunk_ids)
+        return self.release([chunk_id for chunk_id in self.canonical_of if chunk_id not in keep])
+
+    def references(self, canonical_id):
+        """Source references (id, source, page) of every chunk collapsed into a canonical chunk"""
+        return list(self.members.get(canonical_id, []))
+
+    def stats(self):
+        chunks = len(self.canonical_of)
+        canonical = len(self.signatures)
+        return {"chunks": chunks, "canonical": canonical,
+                "dedup_ratio": chunks / canonical if canonical else 1.0}
+
+    def save(self, path):
+        """Write the index atomically"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "config": self.config(),
+                "signatures": {cid: signature.tolist() for cid, signature in self.signatures.items()},
+                "members": self.members,
+            }, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, **config):
+        """Load a saved index, or return an empty one if none exists or its settings differ from config"""
+        index = cls(**config)
+        if not os.path.exists(path):
+            return index
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data["config"] != index.config():
+            print("🔧 Deduplication settings changed, starting a new near-duplicate index")
+            return index
+        for canonical_id, signature in data["signatures"].items():
+            index._index(canonical_id, np.asarray(signature, dtype=np.uint32))
+        index.members = data["members"]
+        index.canonical_of = {
+            member["id"]: canonical_id for canonical_id, members in index.members.items() for member in members
+        }
+        return index
@@ -0,0 +1,127 @@
+import re
+import time
+import argparse
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from bm25 import BM25Index, tokenize
+from embeddings import CachedEmbeddings, LocalEmbeddings, normalize_text
+from knowledge_base import folder_chunk_texts
+from retrieval_benchmark import latency_summary
+from retrievers import normalize_rows, top_k
+
+# Suppress warnings
+warnings.filterwarnings('ignore')
+
+PDF_FOLDERS = ["property_data_generator"]
+QA_PATH = "question_answer_pair/qa_pair_for_testing_v2.csv"
+BACKENDS = ["openai", "local", "bm25"]
+_SOURCES_RE = re.compile(r"Sources?:.*", re.IGNORECASE | re.DOTALL)
+
+
+def load_qa_pairs(qa_path=QA_PATH):
+    """(question, answer) pairs answerable from the documents (refusals such as "Sorry, ..." are left out)"""
+    data = pd.read_csv(qa_path, encoding="ISO-8859-1").dropna(subset=["template_qn", "template_ans"])
+    return [(question, _SOURCES_RE.sub("", answer)) for question, answer in zip(data["template_qn"], data["template_ans"])
+            if not answer.strip().lower().startswith("sorry")]
+
+
+def answer_coverage(answer, retrieved_texts):
+    """Share of the answer's (stemmed, stopword-free) terms found in the retrieved chunks"""
+    answer_terms = set(tokenize(answer))
+    if not answer_terms:
+        return 1.0
+    found = set(term for text in retrieved_texts for term in tokenize(text))
+    return len(answer_terms & found) / len(answer_terms)
+
+
+def rank_with_embeddings(embeddings, texts, questions, k, query_embeddings=None):
+    """Top-k chunk positions per question by cosine similarity; returns (rankings, query latencies)"""
+    matrix = normalize_rows(embeddings.embed_documents(texts))
+    query_embeddings = query_embeddings or embeddings
+    rankings, latencies = [], []
+    for question in questions:
+        start = time.perf_counter()
+        query_vector = query_embeddings.embed_query(question)
+        latencies.append(time.perf_counter() - start)
+        indices, _ = top_k(normalize_rows([query_vector]) @ matrix.T, k)
+        rankings.append(list(indices[0]))
+    return rankings, latencies
+
+
+def rank_with_bm25(texts, questions, k):
+    """Top-k chunk positions per question by BM25 keyword score"""
+    index = BM25Index()
+    index.add([str(i) for i in range(len(texts))], texts)
+    rankings, latencies = [], []
+    for question in questions:
+        start = time.perf_counter()
+        rankings.append([int(i) for i, _ in index.search(question, k)])
+        latencies.append(time.perf_counter() - start)
+    return rankings, latencies
+
+
+def embedding_quality_report(texts, qa_pairs, backends=BACKENDS, k=3):
+    """Retrieval quality of each backend on the QA pairs, compared with the first backend.
+
+    answer_coverage is the share of each reference answer's terms present in the
+    top-k chunks (higher means the chunks the LLM sees support the answer);
+    overlap is the share of the first backend's top-k chunks also returned. Query
+    latency covers embedding the question, without any cache.
+    """
+    questions = [question for question, _ in qa_pairs]
+    rows, reference = [], None
+    for backend in backends:
+        start = time.perf_counter()
+        if backend == "bm25":
+            rankings, latencies = rank_with_bm25(texts, questions, k)
+        elif backend == "local":
+            embeddings = LocalEmbeddings().fit(texts)
+            rankings, latencies = rank_with_embeddings(embeddings, texts, questions, k)
+        elif backend == "openai":
+            from langchain_openai import OpenAIEmbeddings
+
+            # Chunks go through the embedding cache; questions are timed against the API
+            cached = CachedEmbeddings(OpenAIEmbeddings())
+            rankings, latencies = rank_with_embeddings(cached, texts, questions, k, query_embeddings=cached.embeddings)
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+        seconds = time.perf_counter() - start
+
+        reference = reference or rankings
+        rows.append({
+            "backend": backend,
+            "answer_coverage": float(np.mean([
+                answer_coverage(answer, [texts[i] for i in ranking]) for (_, answer), ranking in zip(qa_pairs, rankings)
+            ])),
+            "overlap": float(np.mean([len(set(a) & set(b)) / k for a, b in zip(rankings, reference)])),
+            "seconds": seconds,
+            **latency_summary(latencies),
+        })
+    return rows
+
+
+def print_quality_rows(rows, k=3):
+    print(f"{'backend':<9}{f'coverage@{k}':>13}{f'overlap@{k} vs ' + rows[0]['backend']:>20}"
+          f"{'query p50 ms':>14}{'p95 ms':>9}{'total s':>9}")
+    for row in rows:
+        print(f"{row['backend']:<9}{row['answer_coverage']:>13.3f}{row['overlap']:>20.3f}"
+              f"{row['p50_ms']:>14.3f}{row['p95_ms']:>9.3f}{row['seconds']:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare retrieval quality of the embedding backends on the QA pairs")
+    parser.add_argument("--folders", nargs="+", default=PDF_FOLDERS, help="PDF folders making up the corpus")
+    parser.add_argument("--qa", default=QA_PATH, help="QA pair CSV with template_qn / template_ans columns")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS,
+                        help="backends to compare; overlap is measured against the first")
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    # Identical chunks (the same clause in many agreements) are searched once
+    texts = list({normalize_text(text): text for folder in args.folders for text in folder_chunk_texts(folder)}.values())
+    qa_pairs = load_qa_pairs(args.qa)
+    print(f"📊 {len(texts)} distinct chunks, {len(qa_pairs)} answerable questions, k={args.k}")
+    print_quality_rows(embedding_quality_report(texts, qa_pairs, args.backends, args.k), args.k)
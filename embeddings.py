@@ -0,0 +1,457 @@
+import os
+import re
+import time
+import random
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import concurrent.futures
+
+import numpy as np
+import openai
+import tiktoken
+from langchain_core.embeddings import Embeddings
+
+from knowledge_base import CACHE_DIR
+
+# SQLite file holding every embedding computed so far, shared by all KB builds
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite3")
+
+# Default model of OpenAIEmbeddings, used when building through the scheduler
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+# "openai" or "local" (offline TF-IDF/SVD embeddings fitted on the knowledge base)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+
+_encodings = {}
+
+
+def normalize_text(text):
+    """Normalize text for cache keys so whitespace and unicode variants share an entry"""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def count_tokens(text, model=DEFAULT_EMBEDDING_MODEL):
+    """Count tokens with tiktoken, falling back to a 4 characters per token estimate"""
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except Exception:
+            try:
+                _encodings[model] = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                # No encoding available offline
+                _encodings[model] = None
+    encoding = _encodings[model]
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def hash_embedding(text, dim=1536):
+    """Deterministic pseudo-random unit vector for a text, used by offline stand-ins"""
+    seed = int(hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()[:16], 16)
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def run_coroutine_sync(coroutine):
+    """Run a coroutine to completion whether or not an event loop is already running"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # No event loop running, safe to use asyncio.run
+        return asyncio.run(coroutine)
+    # We're in an event loop, run it on a separate thread
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def embedding_model_name(embeddings):
+    """Best-effort name of the model behind an embeddings object"""
+    return getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that keeps every vector in a local SQLite cache.
+
+    Entries are keyed by model name plus normalized text, so re-chunking,
+    rebuilding the vector store or embedding the same clause from another
+    agreement only pays for text that has never been embedded before.
+    """
+
+    def __init__(self, embeddings, cache_path=EMBEDDING_CACHE_PATH, model_name=None):
+        self.embeddings = embeddings
+        self.model_name = model_name or embedding_model_name(embeddings)
+        self.cache_path = cache_path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def cache_key(self, text):
+        """Cache key for a text under this wrapper's model"""
+        return hashlib.sha256(f"{self.model_name}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def lookup(self, texts):
+        """Return cached vectors for texts, with None where the cache has no entry"""
+        keys = [self.cache_key(text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update({key: np.frombuffer(vector, dtype=np.float32).tolist() for key, vector in rows})
+        return [found.get(key) for key in keys]
+
+    def store(self, texts, vectors):
+        """Add computed vectors to the cache"""
+        rows = [
+            (self.cache_key(text), self.model_name, len(vector), np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def embed_documents(self, texts):
+        vectors = self.lookup(texts)
+
+        # Embed each missing text once, even if it appears several times in the batch
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(normalize_text(texts[i]), []).append(i)
+        self.hits += len(texts) - sum(len(positions) for positions in missing.values())
+        self.misses += len(missing)
+
+        if missing:
+            miss_texts = [texts[positions[0]] for positions in missing.values()]
+            new_vectors = self.embeddings.embed_documents(miss_texts)
+            self.store(miss_texts, new_vectors)
+            for positions, vector in zip(missing.values(), new_vectors):
+                for i in positions:
+                    vectors[i] = list(vector)
+
+        return vectors
+
+    def embed_query(self, text):
+        vector = self.lookup([text])[0]
+        if vector is not None:
+            self.hits += 1
+            return vector
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self.store([text], [vector])
+        return list(vector)
+
+    def stats(self):
+        """Hit and miss counts since this wrapper was created"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class _AdaptiveLimiter:
+    """Async concurrency limit that halves on rate limits and creeps back up on success"""
+
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.active = 0
+        self._successes = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def on_rate_limit(self):
+        self.limit = max(1, self.limit // 2)
+        self._successes = 0
+
+    def on_success(self):
+        self._successes += 1
+        if self.limit < self.max_limit and self._successes >= self.limit:
+            self.limit += 1
+            self._successes = 0
+
+
+def _retry_after(error):
+    """Seconds requested by a Retry-After header, if the error carries one"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingScheduler:
+    """Async, rate-limit-aware batch embedder for knowledge base builds.
+
+    Texts are packed into token-bounded batches and sent over a bounded number of
+    concurrent requests to any OpenAI-compatible endpoint (set base_url to point it
+    at a local stand-in). A 429 halves the allowed concurrency and backs off,
+    honouring Retry-After; successful batches slowly raise it again. Each finished
+    batch is written to the embedding cache straight away, which is the checkpoint
+    an interrupted build resumes from.
+    """
+
+    def __init__(self, model=DEFAULT_EMBEDDING_MODEL, api_key=None, base_url=None, cache=None,
+                 max_batch_tokens=20000, max_batch_size=256, max_concurrency=4,
+                 max_retries=6, request_timeout=30):
+        self.model = model
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.cache = cache
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+        self.last_run = {}
+
+    def make_batches(self, items):
+        """Pack (index, text) pairs into batches bounded by token count and batch size"""
+        batches = []
+        current, current_tokens = [], 0
+        for i, text in items:
+            n_tokens = count_tokens(text, self.model)
+            if current and (current_tokens + n_tokens > self.max_batch_tokens or len(current) >= self.max_batch_size):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append((i, text, n_tokens))
+            current_tokens += n_tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _embed_batch(self, client, batch, limiter, run):
+        attempt = 0
+        while True:
+            async with limiter:
+                try:
+                    response = await client.embeddings.create(
+                        model=self.model,
+                        input=[text for _, text, _ in batch],
+                        encoding_format="float",
+                    )
+                except (openai.RateLimitError, openai.APITimeoutError,
+                        openai.APIConnectionError, openai.InternalServerError) as e:
+                    error = e
+                else:
+                    limiter.on_success()
+                    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+            attempt += 1
+            if attempt > self.max_retries:
+                raise error
+            if isinstance(error, openai.RateLimitError):
+                run["rate_limited"] += 1
+                limiter.on_rate_limit()
+            run["retries"] += 1
+            delay = _retry_after(error) or min(60.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+            await asyncio.sleep(delay)
+
+    async def aembed(self, texts):
+        """Embed texts, reusing cached vectors and checkpointing each finished batch"""
+        texts = list(texts)
+        vectors = self.cache.lookup(texts) if self.cache is not None else [None] * len(texts)
+
+        # Send each distinct missing text once
+        positions = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                positions.setdefault(normalize_text(texts[i]), []).append(i)
+        pending = [(group[0], texts[group[0]]) for group in positions.values()]
+        if self.cache is not None:
+            self.cache.hits += len(texts) - sum(len(group) for group in positions.values())
+            self.cache.misses += len(pending)
+
+        batches = self.make_batches(pending)
+        run = {"chunks": 0, "tokens": 0, "batches": len(batches), "rate_limited": 0, "retries": 0}
+        start = time.perf_counter()
+
+        async def embed_and_checkpoint(batch):
+            result = await self._embed_batch(client, batch, limiter, run)
+            batch_texts = [text for _, text, _ in batch]
+            if self.cache is not None:
+                self.cache.store(batch_texts, result)
+            for text, vector in zip(batch_texts, result):
+                for i in positions[normalize_text(text)]:
+                    vectors[i] = list(vector)
+            run["chunks"] += len(batch)
+            run["tokens"] += sum(n_tokens for _, _, n_tokens in batch)
+
+        if batches:
+            limiter = _AdaptiveLimiter(self.max_concurrency)
+            client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                        max_retries=0, timeout=self.request_timeout)
+            tasks = [asyncio.ensure_future(embed_and_checkpoint(batch)) for batch in batches]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await client.close()
+
+        elapsed = time.perf_counter() - start
+        run["seconds"] = elapsed
+        run["chunks_per_sec"] = run["chunks"] / elapsed if elapsed > 0 else 0.0
+        run["tokens_per_sec"] = run["tokens"] / elapsed if elapsed > 0 else 0.0
+        self.last_run = run
+        if batches:
+            print(f"⚡ Embedded {run['chunks']} chunks ({run['tokens']} tokens) in {elapsed:.1f}s: "
+                  f"{run['chunks_per_sec']:.1f} chunks/s, {run['tokens_per_sec']:.0f} tokens/s, "
+                  f"{run['rate_limited']} rate limited")
+        return vectors
+
+    def embed(self, texts):
+        """Synchronous wrapper around aembed"""
+        return run_coroutine_sync(self.aembed(texts))
+
+
+class ScheduledEmbeddings(Embeddings):
+    """LangChain Embeddings adapter that sends document batches through an EmbeddingScheduler"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.model = scheduler.model
+
+    def embed_documents(self, texts):
+        return self.scheduler.embed(texts)
+
+    def embed_query(self, text):
+        return self.scheduler.embed([text])[0]
+
+    async def aembed_documents(self, texts):
+        return await self.scheduler.aembed(texts)
+
+    async def aembed_query(self, text):
+        return (await self.scheduler.aembed([text]))[0]
+
+
+# Fitted local embedding model, stored next to the Chroma collection it embedded
+LOCAL_EMBEDDINGS_FILE = "local_embeddings.npz"
+_TERM_RE = re.compile(r"[a-z0-9]+")
+
+
+class LocalEmbeddings(Embeddings):
+    """Offline embeddings: hashed word and bigram TF-IDF projected with a truncated SVD.
+
+    Terms are hashed into n_features buckets, so there is no vocabulary to build
+    and nothing to download. `fit` learns IDF weights and an SVD projection
+    (latent semantic analysis) from the knowledge base chunks, which maps texts
+    using related terms close together. Vectors are only comparable with vectors
+    from the same fitted model, which `model` identifies.
+    """
+
+    def __init__(self, dim=256, n_features=2**14, max_fit_texts=2000, seed=0):
+        self.dim = dim
+        self.n_features = n_features
+        self.max_fit_texts = max_fit_texts
+        self.seed = seed
+        self.idf = None
+        self.components = None
+
+    @property
+    def model(self):
+        """Name of the fitted model, changing whenever a refit gives different weights"""
+        if self.components is None:
+            raise ValueError("LocalEmbeddings must be fitted (or loaded) before use")
+        digest = hashlib.sha256(self.idf.tobytes() + self.components.tobytes()).hexdigest()[:12]
+        return f"local-tfidf-svd-{self.components.shape[0]}-{digest}"
+
+    def _term_buckets(self, text):
+        words = _TERM_RE.findall(normalize_text(text).lower())
+        terms = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        return np.array(
+            [int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little") % self.n_features
+             for term in terms],
+            dtype=np.int64,
+        )
+
+    def _term_frequencies(self, texts):
+        matrix = np.zeros((len(texts), self.n_features), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets, counts = np.unique(self._term_buckets(text), return_counts=True)
+            matrix[row, buckets] = 1 + np.log(counts)
+        return matrix
+
+    @staticmethod
+    def _normalize(matrix):
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        return matrix
+
+    def term_matrix(self, texts):
+        """L2-normalized TF-IDF rows (sublinear TF) over the hashed terms"""
+        return self._normalize(self._term_frequencies(texts) * self.idf)
+
+    def fit(self, texts):
+        """Learn IDF weights and the SVD projection from corpus texts; returns self"""
+        unique = sorted({normalize_text(text) for text in texts if text.strip()})
+        if not unique:
+            raise ValueError("LocalEmbeddings needs at least one text to fit on")
+        if len(unique) > self.max_fit_texts:
+            rng = np.random.default_rng(self.seed)
+            unique = [unique[i] for i in sorted(rng.choice(len(unique), self.max_fit_texts, replace=False))]
+        matrix = self._term_frequencies(unique)
+        document_frequency = np.count_nonzero(matrix, axis=0)
+        self.idf = (np.log((1 + len(unique)) / (1 + document_frequency)) + 1).astype(np.float32)
+        matrix *= self.idf
+        _, _, vt = np.linalg.svd(self._normalize(matrix), full_matrices=False)
+        self.components = vt[:self.dim].astype(np.float32)
+        return self
+
+    def embed_documents(self, texts, batch_size=256):
+        if self.components is None:
+            raise ValueError("LocalEmbeddings must be fitted (or loaded) before use")
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            reduced = self.term_matrix(texts[start:start + batch_size]) @ self.components.T
+            vectors.extend(self._normalize(reduced).tolist())
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def save(self, path):
+        """Write the fitted model atomically"""
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, idf=self.idf, components=self.components,
+                 config=np.array([self.dim, self.n_features, self.max_fit_texts, self.seed]))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a model written by save"""
+        with np.load(path) as data:
+            dim, n_features, max_fit_texts, seed = (int(value) for value in data["config"])
+            embeddings = cls(dim, n_features, max_fit_texts, seed)
+            embeddings.idf = data["idf"]
+            embeddings.components = data["components"]
+        return embeddings
@@ -0,0 +1,128 @@
+import os
+import time
+import argparse
+import warnings
+
+import pandas as pd
+
+from bm25 import BM25Index
+from dedup import NearDuplicateIndex, jaccard, shingles
+from embeddings import count_tokens
+from knowledge_base import (
+    TEXT_CACHE_DIR, chunking_params, extract_pdf_pages, file_sha256, list_pdf_files, make_chunk_ids, split_pages
+)
+
+# Suppress warnings
+warnings.filterwarnings('ignore')
+
+PDF_FOLDERS = ["property_data_generator", "examples"]
+QA_PATH = "question_answer_pair/qa_pair_for_testing_v2.csv"
+
+
+def load_corpus(folders=PDF_FOLDERS):
+    """Extract the pages of every PDF in the given folders"""
+    pdf_files = [path for folder in folders for path in list_pdf_files(folder).values() if path.endswith(".pdf")]
+    file_hashes = {pdf_file: file_sha256(pdf_file) for pdf_file in pdf_files}
+    return extract_pdf_pages(pdf_files, file_hashes, TEXT_CACHE_DIR)
+
+
+def load_questions(qa_path=QA_PATH):
+    """Test questions from the QA pair CSV"""
+    return pd.read_csv(qa_path, encoding="ISO-8859-1")["template_qn"].dropna().tolist()
+
+
+def chunking_report(pages_by_file, questions, splitters=("recursive", "clause"), k=3):
+    """Chunk count, embedding tokens and retrieved prompt tokens per answer for each splitter.
+
+    Prompt tokens are estimated offline: the top-k chunks for each question are
+    picked by BM25 over that splitter's chunks, so no embedding API is needed.
+    """
+    rows = []
+    for splitter in splitters:
+        params = chunking_params(splitter)
+        chunks = [chunk for pages in pages_by_file.values() for chunk in split_pages(pages, params)]
+        tokens = [count_tokens(chunk.page_content) for chunk in chunks]
+        index = BM25Index()
+        index.add([str(i) for i in range(len(chunks))], [chunk.page_content for chunk in chunks])
+        prompt_tokens = [sum(tokens[int(i)] for i, _ in index.search(question, k)) for question in questions]
+        rows.append({
+            "splitter": splitter,
+            "chunks": len(chunks),
+            "embedding_tokens": sum(tokens),
+            "tokens_per_chunk": sum(tokens) / max(len(chunks), 1),
+            "prompt_tokens_per_answer": sum(prompt_tokens) / max(len(prompt_tokens), 1),
+        })
+    return rows
+
+
+def print_chunking_report(rows):
+    print(f"{'splitter':<11}{'chunks':>8}{'embed tok':>11}{'tok/chunk':>11}{'prompt tok':>12}")
+    for row in rows:
+        print(f"{row['splitter']:<11}{row['chunks']:>8}{row['embedding_tokens']:>11}"
+              f"{row['tokens_per_chunk']:>11.0f}{row['prompt_tokens_per_answer']:>12.0f}")
+    base, new = rows[0], rows[-1]
+    for key in ("chunks", "embedding_tokens", "prompt_tokens_per_answer"):
+        change = (new[key] - base[key]) / base[key] * 100 if base[key] else 0.0
+        print(f"📉 {key}: {base['splitter']} {base[key]:.0f} -> {new['splitter']} {new[key]:.0f} ({change:+.1f}%)")
+
+
+def dedup_report(pages_by_file, thresholds=(0.95, 0.9, 0.8, 0.7), splitter=None):
+    """Chunks collapsed by MinHash/LSH dedup at each threshold, in knowledge base sync order.
+
+    min_jaccard is the lowest exact shingle Jaccard similarity between a collapsed
+    chunk and its canonical chunk, a check on the MinHash estimate.
+    """
+    chunks = []
+    for pdf_file in sorted(pages_by_file, key=lambda path: (os.path.basename(path), path)):
+        docs = split_pages(pages_by_file[pdf_file], chunking_params(splitter))
+        for doc, chunk_id in zip(docs, make_chunk_ids(os.path.basename(pdf_file), docs)):
+            chunks.append((chunk_id, pdf_file, doc))
+    texts = {chunk_id: doc.page_content for chunk_id, _, doc in chunks}
+
+    rows = []
+    for threshold in thresholds:
+        index = NearDuplicateIndex(threshold=threshold)
+        start = time.perf_counter()
+        kept_tokens, total_tokens, min_jaccard = 0, 0, 1.0
+        for chunk_id, pdf_file, doc in chunks:
+            canonical_id, is_new = index.assign(chunk_id, doc.page_content, {"source": pdf_file})
+            tokens = count_tokens(doc.page_content)
+            total_tokens += tokens
+            if is_new:
+                kept_tokens += tokens
+            else:
+                similarity = jaccard(shingles(texts[canonical_id]), shingles(doc.page_content))
+                min_jaccard = min(min_jaccard, similarity)
+        stats = index.stats()
+        rows.append({
+            "threshold": threshold,
+            **stats,
+            "embedding_tokens": kept_tokens,
+            "tokens_saved": 1 - kept_tokens / total_tokens if total_tokens else 0.0,
+            "min_jaccard": min_jaccard,
+            "seconds": time.perf_counter() - start,
+        })
+    return rows
+
+
+def print_dedup_report(rows):
+    print(f"{'threshold':>10}{'chunks':>8}{'stored':>8}{'ratio':>8}{'embed tok':>11}{'saved':>8}{'min J':>7}{'secs':>7}")
+    for row in rows:
+        print(f"{row['threshold']:>10.2f}{row['chunks']:>8}{row['canonical']:>8}{row['dedup_ratio']:>7.2f}x"
+              f"{row['embedding_tokens']:>11}{row['tokens_saved']:>8.1%}{row['min_jaccard']:>7.2f}{row['seconds']:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the cost of knowledge base ingestion choices")
+    parser.add_argument("report", choices=["chunking", "dedup"])
+    parser.add_argument("--folders", nargs="+", default=PDF_FOLDERS, help="PDF folders making up the corpus")
+    parser.add_argument("--qa", default=QA_PATH, help="QA pair CSV whose questions estimate prompt size")
+    parser.add_argument("--k", type=int, default=3, help="chunks retrieved per answer")
+    args = parser.parse_args()
+
+    pages_by_file = load_corpus(args.folders)
+    print(f"📊 {len(pages_by_file)} PDFs, {sum(len(pages) for pages in pages_by_file.values())} pages")
+    if args.report == "chunking":
+        print_chunking_report(chunking_report(pages_by_file, load_questions(args.qa), k=args.k))
+    elif args.report == "dedup":
+        print_dedup_report(dedup_report(pages_by_file))
@@ -0,0 +1,383 @@
+import os
+import json
+import time
+import shutil
+import socket
+import argparse
+import warnings
+
+from bm25 import BM25_INDEX_FILE
+from clauses import CLAUSE_INDEX_FILE
+from dedup import DEDUP_INDEX_FILE
+from embeddings import (
+    EMBEDDING_BACKEND, LOCAL_EMBEDDINGS_FILE, CachedEmbeddings, EmbeddingScheduler, LocalEmbeddings,
+    ScheduledEmbeddings, embedding_model_name
+)
+from knowledge_base import (
+    DB_PATH, MANIFEST_NAME, TENANT_INDEX_DIR, add_embedded_chunks, chunking_params, folder_chunk_texts,
+    load_manifest, manifest_matches, sync_knowledge_base
+)
+from retrievers import NUMPY_INDEX_DIR, QUANTIZED_INDEX_DIR, RETRIEVER_BACKEND, SECTION_INDEX_DIR
+
+# Suppress warnings
+warnings.filterwarnings('ignore')
+
+# Each build of the knowledge base lives in DB_PATH/versions/<version>; the CURRENT
+# file names the live one and is replaced atomically when a build succeeds
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+# Marker written into a version once it has been published
+PUBLISHED_FILE = "PUBLISHED"
+# Marker naming the process building a version, removed when it is published
+BUILDING_FILE = "BUILDING"
+# Seconds after which an unpublished build is collected even if its builder cannot be checked
+# (another host, or a reused process ID); far longer than any build takes
+BUILD_TIMEOUT = 24 * 3600
+# Published versions kept on disk (the live one and the one before it, which
+# running bots may still be reading until they notice the switch)
+KEEP_VERSIONS = 2
+# Files stored next to the Chroma collection that belong to the same build
+SIDECAR_FILES = [MANIFEST_NAME, BM25_INDEX_FILE, DEDUP_INDEX_FILE, TENANT_INDEX_DIR, LOCAL_EMBEDDINGS_FILE,
+                 CLAUSE_INDEX_FILE]
+# Search indexes derived from a version's vectors, never copied into a new build
+# (their reuse check covers chunk IDs only, and a new build may re-embed the same chunks)
+DERIVED_INDEXES = [NUMPY_INDEX_DIR, QUANTIZED_INDEX_DIR + "_*", SECTION_INDEX_DIR]
+# Retriever backends with derived indexes; the configured one's are built into a version before
+# it is published, so bots never write into the live version (other backends build theirs on first use)
+PREBUILT_BACKENDS = ["numpy", "hierarchical", "quantized"]
+
+
+def version_path(version, root=DB_PATH):
+    return os.path.join(root, VERSIONS_DIR, version)
+
+
+def current_version(root=DB_PATH):
+    """Name of the live version, or None if nothing has been published yet"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return version if version and os.path.isdir(version_path(version, root)) else None
+
+
+def current_version_path(root=DB_PATH):
+    """Directory of the live version, or None"""
+    version = current_version(root)
+    return version_path(version, root) if version else None
+
+
+def list_versions(root=DB_PATH):
+    """All version directories, oldest first (names sort by creation time)"""
+    versions_dir = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(versions_dir):
+        return []
+    return sorted(name for name in os.listdir(versions_dir) if os.path.isdir(os.path.join(versions_dir, name)))
+
+
+def new_version(root=DB_PATH, base=None):
+    """Create the directory for a new build, seeded with a copy of `base` so syncing it stays incremental.
+
+    The directory is marked as being built by this process until it is
+    published, so gc_versions() leaves it alone while the build runs.
+    """
+    # UTC, so names keep sorting by creation time across daylight saving changes
+    now = time.time_ns()
+    version = time.strftime("%Y%m%d-%H%M%S-", time.gmtime(now // 10**9)) + f"{now % 10**9:09d}"
+    path = version_path(version, root)
+    os.makedirs(path)
+    with open(os.path.join(path, BUILDING_FILE), "w", encoding="utf-8") as f:
+        json.dump({"pid": os.getpid(), "host": socket.gethostname(), "started": time.time()}, f)
+    if base:
+        shutil.copytree(base, path, dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns(PUBLISHED_FILE, BUILDING_FILE, *DERIVED_INDEXES))
+    return version, path
+
+
+def discard_version(version, root=DB_PATH):
+    """Delete an unpublished (failed or redundant) build"""
+    shutil.rmtree(version_path(version, root), ignore_errors=True)
+
+
+def publish_version(version, root=DB_PATH):
+    """Make a finished build the live version by atomically replacing the CURRENT pointer"""
+    path = version_path(version, root)
+    building = os.path.join(path, BUILDING_FILE)
+    if not os.path.exists(building):
+        raise RuntimeError(f"Version {version} is not an unpublished build (was it garbage collected?)")
+    open(os.path.join(path, PUBLISHED_FILE), "w").close()
+    os.remove(building)
+    pointer = os.path.join(root, CURRENT_FILE)
+    tmp_path = pointer + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, pointer)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def build_in_progress(path, timeout=BUILD_TIMEOUT):
+    """Whether an unpublished version directory may still be being built.
+
+    True while its builder process is alive (checked on the same host only)
+    and for `timeout` seconds after the build started. A directory without a
+    marker counts from its modification time, since new_version() creates it
+    just before writing the marker.
+    """
+    marker = os.path.join(path, BUILDING_FILE)
+    try:
+        with open(marker, "r", encoding="utf-8") as f:
+            build = json.load(f)
+    except (FileNotFoundError, ValueError):
+        try:
+            return time.time() - os.path.getmtime(path) < timeout
+        except FileNotFoundError:
+            return False
+    if time.time() - build.get("started", 0) >= timeout:
+        return False
+    if build.get("host") == socket.gethostname():
+        return _process_alive(build.get("pid", 0))
+    return True
+
+
+def gc_versions(root=DB_PATH, keep=KEEP_VERSIONS, build_timeout=BUILD_TIMEOUT):
+    """Delete versions older than the live one, keeping `keep` published versions in total.
+
+    Unpublished directories older than the live version are left over from
+    interrupted builds unless build_in_progress() says they are still being
+    built (e.g. `kb_versions.py build` started before a bot published its own
+    build); those are left for a later collection.
+    """
+    live = current_version(root)
+    if live is None:
+        return []
+    older = [version for version in list_versions(root) if version < live]
+    published = [version for version in older
+                 if os.path.exists(os.path.join(version_path(version, root), PUBLISHED_FILE))]
+    kept = published[-(keep - 1):] if keep > 1 else []
+    removed = [version for version in older if version not in kept and (
+        version in published or not build_in_progress(version_path(version, root), build_timeout))]
+    for version in removed:
+        shutil.rmtree(version_path(version, root), ignore_errors=True)
+    return removed
+
+
+def build_derived_indexes(vectorstore, retriever_backend=RETRIEVER_BACKEND):
+    """Build the search indexes a retriever backend derives from an unpublished version's collection, if any"""
+    from retrievers import build_retriever
+
+    if retriever_backend in PREBUILT_BACKENDS:
+        build_retriever(vectorstore, retriever_backend)
+
+
+def directory_size(path, exclude=()):
+    """Total size in bytes of the files under path, leaving out the top-level entries named in `exclude`"""
+    total = 0
+    for folder, folders, files in os.walk(path):
+        if folder == path:
+            folders[:] = [name for name in folders if name not in exclude]
+            files = [name for name in files if name not in exclude]
+        total += sum(os.path.getsize(os.path.join(folder, file)) for file in files)
+    return total
+
+
+def compact(root=DB_PATH, source=None, batch_size=1000, retriever_backend=RETRIEVER_BACKEND):
+    """Rewrite a collection into a new live version without its duplicate chunks.
+
+    Chunks with the same text, source and page as an earlier one are dropped, the
+    stored embeddings are reused (no embedding calls) and the rewrite also frees
+    space left behind by deleted entries. `source` defaults to the live version; a
+    pre-versioning store (e.g. DB_PATH itself) can be given to migrate it.
+    """
+    from langchain_community.vectorstores import Chroma
+    from langchain_core.documents import Document
+
+    source = source or current_version_path(root)
+    if source is None:
+        raise ValueError(f"No knowledge base version to compact in {root}")
+    data = Chroma(persist_directory=source).get(include=["embeddings", "documents", "metadatas"])
+    # Measured before the new version exists, since a pre-versioning source holds the versions themselves
+    bytes_before = directory_size(source, exclude=(VERSIONS_DIR, CURRENT_FILE))
+
+    seen = set()
+    keep = []
+    for position, (text, metadata) in enumerate(zip(data["documents"], data["metadatas"])):
+        metadata = metadata or {}
+        key = (text, metadata.get("source"), metadata.get("page"))
+        if key not in seen:
+            seen.add(key)
+            keep.append(position)
+
+    version, path = new_version(root)
+    try:
+        for name in SIDECAR_FILES:
+            sidecar = os.path.join(source, name)
+            if os.path.isdir(sidecar):
+                shutil.copytree(sidecar, os.path.join(path, name))
+            elif os.path.exists(sidecar):
+                shutil.copy2(sidecar, os.path.join(path, name))
+        add_embedded_chunks(
+            Chroma(persist_directory=path),
+            [data["ids"][i] for i in keep],
+            [Document(page_content=data["documents"][i], metadata=data["metadatas"][i] or {}) for i in keep],
+            [data["embeddings"][i] for i in keep],
+            batch_size,
+        )
+        build_derived_indexes(Chroma(persist_directory=path), retriever_backend)
+    except Exception:
+        discard_version(version, root)
+        raise
+    publish_version(version, root)
+    gc_versions(root)
+
+    if load_manifest(path) is None:
+        print("⚠️ The compacted store has no ingestion manifest; the next sync will rebuild it from the PDFs")
+    return {
+        "version": version,
+        "chunks_before": len(data["ids"]),
+        "chunks_after": len(keep),
+        "bytes_before": bytes_before,
+        "bytes_after": directory_size(path),
+    }
+
+
+def embedding_model_id(embeddings):
+    """Name of the model a knowledge base is embedded with, as recorded in its manifest"""
+    return getattr(embeddings, "model_name", None) or embedding_model_name(embeddings)
+
+
+def load_and_process_pdf(pdf_path, embeddings=None, fast_start=True, embedding_backend="openai", root=DB_PATH,
+                         retriever_backend=RETRIEVER_BACKEND):
+    """Load PDFs and sync them into a new version of the persisted Chroma DB"""
+    from langchain_community.vectorstores import Chroma
+    from langchain_openai import OpenAIEmbeddings
+
+    # Knowledge base
+    # Only new, changed or deleted PDFs in the folder touch the vector store;
+    # unchanged files are skipped using the ingestion manifest
+    live_path = current_version_path(root)
+    if embedding_backend == "local":
+        # Offline embeddings fitted on the folder's chunks; each version stores its own model.
+        # Without one in the live version (e.g. it was built with OpenAI) the store must be rebuilt
+        live_model = os.path.join(live_path, LOCAL_EMBEDDINGS_FILE) if live_path else None
+        embeddings = LocalEmbeddings.load(live_model) if live_model and os.path.exists(live_model) else None
+    elif embeddings is None:
+        embeddings = CachedEmbeddings(OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY")))
+    # The manifest records the embedding model, so a store embedded with another model never matches
+    params = chunking_params(embedding_model=embedding_model_id(embeddings)) if embeddings is not None else None
+
+    # Fast start: attach to the live version as-is when the manifest
+    # shows it already matches the PDF folder
+    if fast_start and live_path and params and manifest_matches(pdf_path, live_path, params):
+        print(f"⚡ Knowledge base is up to date, attached to: {live_path}")
+        return Chroma(persist_directory=live_path, embedding_function=embeddings)
+
+    if embedding_backend == "local":
+        # Refitting on an unchanged folder gives the same model, so the sync stays incremental
+        embeddings = LocalEmbeddings().fit(folder_chunk_texts(pdf_path))
+        params = chunking_params(embedding_model=embedding_model_id(embeddings))
+        print(f"🧮 Fitted local embeddings {embeddings.model}")
+
+    # Bulk embedding for the build goes through the async batch scheduler, which
+    # checkpoints every finished batch into the same cache used for queries
+    build_embeddings = None
+    if isinstance(embeddings, CachedEmbeddings) and isinstance(embeddings.embeddings, OpenAIEmbeddings):
+        build_embeddings = ScheduledEmbeddings(EmbeddingScheduler(
+            model=embeddings.model_name,
+            api_key=os.getenv("OPENAI_API_KEY"),
+            cache=embeddings,
+        ))
+
+    # The build syncs a copy of the live version in a side directory; readers keep
+    # using the live version until the build succeeds and the pointer is switched.
+    # A live version embedded with another model starts a fresh collection instead,
+    # since its vectors (and their dimension) cannot be reused
+    live_manifest = load_manifest(live_path) if live_path else None
+    same_model = live_manifest and live_manifest["chunking"].get("embedding_model") == params["embedding_model"]
+    version, db_path = new_version(root, base=live_path if same_model else None)
+    print(f"🔍 Syncing vector embeddings into version {version}...")
+    try:
+        vectorstore_pdf = Chroma(persist_directory=db_path, embedding_function=embeddings)
+        stats = sync_knowledge_base(pdf_path, vectorstore_pdf, db_path, params=params, embeddings=build_embeddings)
+        if isinstance(embeddings, LocalEmbeddings):
+            embeddings.save(os.path.join(db_path, LOCAL_EMBEDDINGS_FILE))
+    except Exception:
+        discard_version(version, root)
+        raise
+    print(f"📝 Files added: {stats['added']}, updated: {stats['updated']}, "
+          f"removed: {stats['removed']}, unchanged: {stats['unchanged']}")
+    print(f"📝 Chunks embedded: {stats['chunks_added']}, chunks removed: {stats['chunks_removed']}")
+    if stats.get("leases"):
+        print(f"🏠 Tenant agreements indexed by reference number: {stats['leases']}")
+    if "dedup_ratio" in stats:
+        print(f"🧬 Near-duplicates collapsed: {stats['chunks_deduplicated']} this sync; "
+              f"{stats['chunks']} chunks stored as {stats['canonical']} (dedup ratio {stats['dedup_ratio']:.2f}x)")
+    if isinstance(embeddings, CachedEmbeddings):
+        cache_stats = embeddings.stats()
+        print(f"🧠 Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+
+    if live_path and not (stats["added"] or stats["updated"] or stats["removed"]):
+        discard_version(version, root)
+        print(f"⚡ No changes, keeping live version: {live_path}")
+        return Chroma(persist_directory=live_path, embedding_function=embeddings)
+
+    try:
+        build_derived_indexes(vectorstore_pdf, retriever_backend)
+    except Exception:
+        discard_version(version, root)
+        raise
+    publish_version(version, root)
+    removed = gc_versions(root)
+    print(f"💾 Vector database version {version} is live: {db_path}"
+          + (f" ({len(removed)} old version(s) removed)" if removed else ""))
+
+    return vectorstore_pdf
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage versioned knowledge base builds")
+    parser.add_argument("command", choices=["status", "build", "gc", "compact"])
+    parser.add_argument("--root", default=DB_PATH, help="knowledge base root directory")
+    parser.add_argument("--pdf-folder", default="property_data_generator", help="PDF folder to build from")
+    parser.add_argument("--source", help="store to compact (defaults to the live version)")
+    parser.add_argument("--keep", type=int, default=KEEP_VERSIONS, help="published versions to keep")
+    parser.add_argument("--embedding-backend", default=EMBEDDING_BACKEND, choices=["openai", "local"],
+                        help="embeddings to build with (defaults to EMBEDDING_BACKEND, as the bot does)")
+    parser.add_argument("--retriever-backend", default=RETRIEVER_BACKEND,
+                        help="retriever whose indexes to build in (defaults to RETRIEVER_BACKEND, as the bot does)")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        live = current_version(args.root)
+        for version in list_versions(args.root):
+            path = version_path(version, args.root)
+            if version == live:
+                state = "live"
+            elif os.path.exists(os.path.join(path, PUBLISHED_FILE)):
+                state = "published"
+            else:
+                state = "building" if build_in_progress(path) else "unpublished"
+            print(f"{version}  {state:<12}{directory_size(path) / 2**20:>8.1f} MB")
+        if live is None:
+            print("No live version")
+    elif args.command == "build":
+        # Running bots using the same embedding backend switch over on their next query
+        load_and_process_pdf(args.pdf_folder, fast_start=False, embedding_backend=args.embedding_backend,
+                             root=args.root, retriever_backend=args.retriever_backend)
+    elif args.command == "gc":
+        removed = gc_versions(args.root, args.keep)
+        print(f"🗑️ Removed {len(removed)} old version(s)")
+    elif args.command == "compact":
+        stats = compact(args.root, args.source, retriever_backend=args.retriever_backend)
+        print(f"🧹 Compacted into version {stats['version']}: {stats['chunks_before']} -> {stats['chunks_after']} chunks, "
+              f"{stats['bytes_before'] / 2**20:.1f} -> {stats['bytes_after'] / 2**20:.1f} MB")
@@ -0,0 +1,623 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import PyPDFLoader
+
+from bm25 import BM25_INDEX_FILE, BM25Index
+from chunking import ClauseTextSplitter, records_text
+from clauses import CLAUSE_INDEX_FILE, ClauseIndex
+from dedup import DEDUP_INDEX_FILE, NearDuplicateIndex
+from partitions import (
+    document_partitions, document_tenant_key, partition_metadata, record_partitions, record_tenant_key
+)
+from pipeline import format_stage_stats, run_pipeline
+
+# Location of the persisted Chroma DB and the ingestion manifest stored inside it
+DB_PATH = "./pdf_knowledge_base"
+MANIFEST_NAME = "kb_manifest.json"
+# Tenants' own agreements are kept out of the shared collection, one small index per reference number
+TENANT_INDEX_DIR = "tenant_index"
+
+# Clause records written by tenancy_agreement_generator, ingested without parsing a PDF
+RECORDS_SUFFIX = ".clauses.json"
+
+# Extracted page text cache, kept outside the DB so it survives rebuilds
+CACHE_DIR = "./.kb_cache"
+TEXT_CACHE_DIR = os.path.join(CACHE_DIR, "extracted_text")
+
+# Chunking parameters, recorded in the manifest so a change triggers re-chunking.
+# "clause" emits one chunk per numbered clause (overlap only for oversized clauses);
+# "recursive" is the original fixed-size splitter.
+CHUNKER = "clause"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+CLAUSE_MAX_SIZE = 1500
+CLAUSE_OVERLAP = 150
+# Chunks at least this similar (estimated Jaccard over word shingles) to a stored
+# chunk are collapsed into it as an extra source reference; None disables dedup
+DEDUP_THRESHOLD = 0.8
+
+# Streaming build: files waiting between pipeline stages, chunks per embedding
+# request and files committed between manifest checkpoints
+PIPELINE_QUEUE_SIZE = 4
+EMBED_BATCH_SIZE = 1000
+CHECKPOINT_FILES = 50
+
+
+def file_sha256(path):
+    """Hash a file's contents in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunking_params(splitter=None, dedup_threshold=DEDUP_THRESHOLD, embedding_model=None):
+    """Return the chunking parameters used for the knowledge base"""
+    splitter = splitter or CHUNKER
+    if splitter == "clause":
+        params = {"splitter": "clause", "chunk_size": CLAUSE_MAX_SIZE, "chunk_overlap": CLAUSE_OVERLAP}
+    else:
+        params = {
+            "splitter": "recursive",
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+        }
+    params["dedup_threshold"] = dedup_threshold
+    # Chunks carry pt_*/rt_* property and rental type flags for partition-filtered search
+    params["partition_tags"] = True
+    # Generated agreements are stored per tenant under TENANT_INDEX_DIR
+    params["tenant_index"] = True
+    # Vectors from another embedding model (e.g. a refitted local model) cannot be mixed in
+    if embedding_model:
+        params["embedding_model"] = embedding_model
+    return params
+
+
+def load_manifest(db_path=DB_PATH):
+    """Load the ingestion manifest, or None if the store has never been synced"""
+    manifest_path = os.path.join(db_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, db_path=DB_PATH):
+    """Write the manifest atomically so an interrupted sync never leaves it half written"""
+    os.makedirs(db_path, exist_ok=True)
+    manifest_path = os.path.join(db_path, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def is_records_file(path):
+    return path.endswith(RECORDS_SUFFIX)
+
+
+def list_pdf_files(pdf_folder):
+    """Map each PDF and clause records file name in the folder to its path.
+
+    An agreement whose clause records sit next to its PDF is ingested from the
+    records alone (tenancy_agreement_7.clauses.json replaces tenancy_agreement_7.pdf).
+    """
+    files = sorted(os.listdir(pdf_folder))
+    with_records = set(file[:-len(RECORDS_SUFFIX)] for file in files if is_records_file(file))
+    return {
+        file: os.path.join(pdf_folder, file)
+        for file in files
+        if is_records_file(file) or (file.endswith(".pdf") and file[:-len(".pdf")] not in with_records)
+    }
+
+
+def load_clause_records(path):
+    """Clause records of one agreement, as tenancy_agreement_generator writes them"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _extract_pdf(pdf_file):
+    """Parse one PDF into page records (runs in a worker process)"""
+    pages = PyPDFLoader(pdf_file).load()
+    return [{"page_content": page.page_content, "metadata": page.metadata} for page in pages]
+
+
+def _pages_to_documents(records, pdf_file):
+    return [
+        Document(page_content=record["page_content"], metadata={**record["metadata"], "source": pdf_file})
+        for record in records
+    ]
+
+
+def _read_page_cache(cache_path):
+    with open(cache_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_page_cache(cache_path, records):
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(records, f)
+    os.replace(tmp_path, cache_path)
+
+
+def iter_pdf_pages(pdf_files, file_hashes, cache_dir=TEXT_CACHE_DIR, max_workers=None, prefetch=None):
+    """Yield (pdf_file, page Documents) in order, parsing cache misses ahead across a process pool.
+
+    Page text is cached on disk keyed by file hash, so the same PDF is never parsed
+    twice. At most `prefetch` files (twice the worker count by default) are parsed
+    ahead of the consumer, so memory stays flat however many files there are.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    pdf_files = list(pdf_files)
+    cache_paths = {pdf_file: os.path.join(cache_dir, f"{file_hashes[pdf_file]}.json") for pdf_file in pdf_files}
+    misses = set(pdf_file for pdf_file in pdf_files if not os.path.exists(cache_paths[pdf_file]))
+    if misses:
+        print(f"📄 Parsing {len(misses)} PDF(s) ({len(pdf_files) - len(misses)} cached)")
+    max_workers = max_workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=max_workers) if len(misses) > 1 else None
+    prefetch = prefetch or 2 * max_workers
+    remaining = iter(pdf_files)
+    in_flight = deque()
+    try:
+        while True:
+            while len(in_flight) < prefetch:
+                pdf_file = next(remaining, None)
+                if pdf_file is None:
+                    break
+                future = executor.submit(_extract_pdf, pdf_file) if executor and pdf_file in misses else None
+                in_flight.append((pdf_file, future))
+            if not in_flight:
+                return
+            pdf_file, future = in_flight.popleft()
+            if pdf_file not in misses:
+                records = _read_page_cache(cache_paths[pdf_file])
+            else:
+                records = future.result() if future else _extract_pdf(pdf_file)
+                _write_page_cache(cache_paths[pdf_file], records)
+            yield pdf_file, _pages_to_documents(records, pdf_file)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+
+def extract_pdf_pages(pdf_files, file_hashes, cache_dir=TEXT_CACHE_DIR, max_workers=None):
+    """Extract the pages of many PDFs; returns a dict mapping each PDF path to its page Documents"""
+    return dict(iter_pdf_pages(pdf_files, file_hashes, cache_dir, max_workers))
+
+
+def iter_documents(files, file_hashes, cache_dir=TEXT_CACHE_DIR, max_workers=None):
+    """Yield (file, content) in order: page Documents for a PDF, the record list for a clause records file.
+
+    Records are read as they are; only the PDFs go through iter_pdf_pages.
+    """
+    files = list(files)
+    pdf_pages = iter_pdf_pages([file for file in files if not is_records_file(file)], file_hashes, cache_dir,
+                               max_workers)
+    try:
+        for file in files:
+            yield (file, load_clause_records(file)) if is_records_file(file) else next(pdf_pages)
+    finally:
+        pdf_pages.close()
+
+
+def folder_chunk_texts(pdf_folder, params=None):
+    """Text of every chunk the documents in a folder split into (parsing PDFs through the text cache)"""
+    params = params or chunking_params()
+    files = list(list_pdf_files(pdf_folder).values())
+    file_hashes = {file: file_sha256(file) for file in files}
+    return [doc.page_content for file, content in iter_documents(files, file_hashes)
+            for doc in split_file(file, content, params)[0]]
+
+
+def split_pages(pages, params):
+    """Split loaded PDF pages into chunks using the given chunking parameters"""
+    if params["splitter"] == "clause":
+        text_splitter = ClauseTextSplitter(chunk_size=params["chunk_size"], chunk_overlap=params["chunk_overlap"])
+        return text_splitter.split_documents(pages)
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=params["chunk_size"],
+        chunk_overlap=params["chunk_overlap"],
+        length_function=len,
+    )
+    return text_splitter.split_documents(pages)
+
+
+def split_records(records, params, source):
+    """Split one document's clause records into chunks, without a PDF in between"""
+    if params["splitter"] == "clause":
+        text_splitter = ClauseTextSplitter(chunk_size=params["chunk_size"], chunk_overlap=params["chunk_overlap"])
+        return text_splitter.split_records(records, {"source": source})
+    return split_pages([Document(page_content=records_text(records), metadata={"source": source, "page": 0})], params)
+
+
+def split_file(file, content, params):
+    """Chunks, partitions and tenant key of a file's content as yielded by iter_documents"""
+    if is_records_file(file):
+        return split_records(content, params, file), record_partitions(content), record_tenant_key(content)
+    return split_pages(content, params), document_partitions(content), document_tenant_key(content)
+
+
+def make_chunk_ids(file, docs):
+    """Content-addressed chunk IDs, so an unchanged chunk keeps its ID when its file is edited"""
+    ids = []
+    seen = {}
+    for doc in docs:
+        key = f"{file}\x00{doc.metadata.get('page', '')}\x00{doc.page_content}"
+        chunk_id = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        # Identical chunks within one file still need distinct IDs
+        seen[chunk_id] = seen.get(chunk_id, -1) + 1
+        ids.append(f"{chunk_id}-{seen[chunk_id]}" if seen[chunk_id] else chunk_id)
+    return ids
+
+
+def _manifest_entry(pdf_file, file_hash, chunk_ids, tenant=None):
+    stat = os.stat(pdf_file)
+    entry = {"sha256": file_hash, "size": stat.st_size, "mtime": stat.st_mtime, "chunk_ids": chunk_ids}
+    if tenant:
+        entry["tenant_key"] = tenant
+    return entry
+
+
+def manifest_matches(pdf_folder, db_path=DB_PATH, params=None):
+    """Check whether the persisted store already reflects every PDF in the folder.
+
+    Files whose size and modification time match the manifest are trusted without
+    hashing, so the check costs a directory listing and a few stat calls.
+    """
+    manifest = load_manifest(db_path)
+    if manifest is None or manifest.get("chunking") != (params or chunking_params()):
+        return False
+    pdf_files = list_pdf_files(pdf_folder)
+    if set(pdf_files) != set(manifest["files"]):
+        return False
+    for file, pdf_file in pdf_files.items():
+        entry = manifest["files"][file]
+        stat = os.stat(pdf_file)
+        if entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+            continue
+        if entry["sha256"] != file_sha256(pdf_file):
+            return False
+    return True
+
+
+def tenant_index_path(db_path, key):
+    """Directory of the vector index holding one tenant's agreement"""
+    return os.path.join(db_path, TENANT_INDEX_DIR, re.sub(r"[^A-Za-z0-9]+", "_", key))
+
+
+def _write_tenant_index(db_path, key, ids, docs, vectors):
+    from retrievers import NumpyVectorIndex
+
+    NumpyVectorIndex.build(tenant_index_path(db_path, key), ids, [doc.page_content for doc in docs],
+                           [doc.metadata for doc in docs], vectors)
+
+
+def _delete_chunks(vectorstore, ids):
+    if ids:
+        vectorstore.delete(ids=ids)
+
+
+def add_embedded_chunks(vectorstore, ids, docs, vectors, batch_size=1000):
+    """Upsert chunks whose embeddings were computed up front into the Chroma collection"""
+    for start in range(0, len(ids), batch_size):
+        end = start + batch_size
+        vectorstore._collection.upsert(
+            ids=ids[start:end],
+            embeddings=[list(vector) for vector in vectors[start:end]],
+            metadatas=[doc.metadata or None for doc in docs[start:end]],
+            documents=[doc.page_content for doc in docs[start:end]],
+        )
+
+
+def load_dedup_index(db_path=DB_PATH, threshold=DEDUP_THRESHOLD):
+    """Load the near-duplicate index stored with the vector store"""
+    return NearDuplicateIndex.load(os.path.join(db_path, DEDUP_INDEX_FILE), threshold=threshold)
+
+
+def _source_metadata(metadata, references):
+    """Record the source files and partitions of every chunk collapsed into a canonical chunk"""
+    sources = list(dict.fromkeys(reference["source"] for reference in references))
+    # "source" follows the first remaining reference once the original file is removed
+    return {**metadata, **partition_metadata(references),
+            "source": sources[0], "sources": "; ".join(sources), "duplicates": len(references) - 1}
+
+
+def _update_sources(vectorstore, dedup, canonical_ids):
+    """Refresh the source references of stored canonical chunks whose members changed"""
+    if not canonical_ids:
+        return
+    data = vectorstore.get(ids=sorted(canonical_ids), include=["metadatas"])
+    if data["ids"]:
+        vectorstore._collection.update(
+            ids=data["ids"],
+            metadatas=[
+                _source_metadata(metadata or {}, dedup.references(chunk_id))
+                for chunk_id, metadata in zip(data["ids"], data["metadatas"])
+            ],
+        )
+
+
+def _remove_chunks(vectorstore, bm25, dedup, ids, touched):
+    """Remove chunks from the store and keyword index; returns the IDs actually deleted.
+
+    With deduplication, a canonical chunk is only deleted once none of the chunks
+    collapsed into it remain; otherwise its source references are refreshed later.
+    """
+    if dedup is not None:
+        ids, changed = dedup.release(ids)
+        touched.update(changed)
+    _delete_chunks(vectorstore, ids)
+    bm25.remove(ids)
+    return ids
+
+
+def _remove_entry_chunks(vectorstore, db_path, bm25, dedup, entry, ids, touched):
+    """Remove chunks of one manifest entry from the shared store or its tenant index"""
+    if entry.get("tenant_key"):
+        if ids:
+            shutil.rmtree(tenant_index_path(db_path, entry["tenant_key"]), ignore_errors=True)
+        return ids
+    return _remove_chunks(vectorstore, bm25, dedup, ids, touched)
+
+
+def load_bm25_index(vectorstore, db_path=DB_PATH):
+    """Load the BM25 index stored with the vector store, rebuilding it if it is missing or out of date"""
+    index = BM25Index.load(os.path.join(db_path, BM25_INDEX_FILE))
+    count = vectorstore._collection.count()
+    if len(index) != count:
+        print(f"🔧 Rebuilding BM25 index over {count} chunks")
+        data = vectorstore.get(include=["documents"])
+        index = BM25Index()
+        index.add(data["ids"], data["documents"])
+        index.save(os.path.join(db_path, BM25_INDEX_FILE))
+    return index
+
+
+def build_clause_index(vectorstore, db_path=DB_PATH):
+    """Rebuild the named-clause index from the chunks in the vector store and save it next to them"""
+    count = vectorstore._collection.count()
+    metadatas = vectorstore.get(include=["metadatas"])
+    ids = [chunk_id for chunk_id, metadata in zip(metadatas["ids"], metadatas["metadatas"])
+           if metadata and metadata.get("heading")]
+    data = vectorstore.get(ids=ids, include=["documents", "metadatas"]) if ids else {
+        "ids": [], "documents": [], "metadatas": []}
+    index = ClauseIndex.from_chunks(data["ids"], data["documents"], data["metadatas"], chunk_count=count)
+    index.save(os.path.join(db_path, CLAUSE_INDEX_FILE))
+    return index
+
+
+def load_clause_index(vectorstore, db_path=DB_PATH):
+    """Load the clause index stored with the vector store, rebuilding it if it is missing or out of date"""
+    index = ClauseIndex.load(os.path.join(db_path, CLAUSE_INDEX_FILE))
+    if index is None or index.chunk_count != vectorstore._collection.count():
+        print("🔧 Rebuilding clause index")
+        index = build_clause_index(vectorstore, db_path)
+    return index
+
+
+def sync_knowledge_base(pdf_folder, vectorstore, db_path=DB_PATH, params=None, embeddings=None):
+    """Bring the vector store in line with the PDFs in pdf_folder.
+
+    Unchanged files are skipped, changed files have their old chunks replaced and
+    deleted files have their chunks removed, so a warm restart makes no embedding calls.
+    Changed files stream through extract, split, embed and upsert stages running
+    concurrently; new chunks are embedded by `embeddings` (the vector store's own
+    embedding function by default) in batches of EMBED_BATCH_SIZE spanning files.
+    Near-duplicate chunks (e.g. the same clause in several agreements) are stored
+    and embedded once, with the other occurrences kept as source references.
+    Agreements generated for a tenant (with a reference number) are stored whole
+    in a separate index per reference number and are never collapsed, since their
+    names, addresses and amounts are what a tenant asks about.
+    """
+    params = params or chunking_params()
+    manifest = load_manifest(db_path)
+    threshold = params.get("dedup_threshold")
+    dedup = load_dedup_index(db_path, threshold) if threshold else None
+
+    if manifest is None or manifest.get("chunking") != params:
+        # A store written before the manifest existed holds untracked (and usually
+        # duplicated) chunks, and new chunking or dedup settings invalidate every
+        # chunk, so start over from a clean collection (the embedding cache makes
+        # re-embedding unchanged text free)
+        existing_ids = vectorstore.get(include=[])["ids"]
+        if manifest is not None:
+            print("🔧 Chunking parameters changed, rebuilding the knowledge base")
+        elif existing_ids:
+            print(f"🧹 Removing {len(existing_ids)} untracked chunks from existing database")
+        _delete_chunks(vectorstore, existing_ids)
+        shutil.rmtree(os.path.join(db_path, TENANT_INDEX_DIR), ignore_errors=True)
+        manifest = {"chunking": params, "files": {}}
+        if dedup is not None:
+            dedup = NearDuplicateIndex(threshold=threshold)
+
+    bm25 = load_bm25_index(vectorstore, db_path)
+
+    stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0,
+             "chunks_added": 0, "chunks_removed": 0, "chunks_deduplicated": 0}
+    pdf_files = list_pdf_files(pdf_folder)
+    # Canonical chunks whose source references need refreshing in the store
+    touched = set()
+
+    if dedup is not None:
+        # Drop references to chunks the manifest does not know about (an interrupted sync)
+        manifest_ids = [i for entry in manifest["files"].values() for i in entry["chunk_ids"]]
+        orphaned, changed = dedup.retain(manifest_ids)
+        touched.update(changed)
+        _delete_chunks(vectorstore, orphaned)
+        bm25.remove(orphaned)
+
+    # Files that no longer exist in the folder
+    for file in sorted(set(manifest["files"]) - set(pdf_files)):
+        entry = manifest["files"].pop(file)
+        deleted = _remove_entry_chunks(vectorstore, db_path, bm25, dedup, entry, entry["chunk_ids"], touched)
+        save_manifest(manifest, db_path)
+        stats["removed"] += 1
+        stats["chunks_removed"] += len(deleted)
+        print(f"🗑️ Removed file: {file}")
+
+    # Work out which files need (re)processing before parsing anything
+    file_hashes = {pdf_file: file_sha256(pdf_file) for pdf_file in pdf_files.values()}
+    pending = []
+    for file, pdf_file in pdf_files.items():
+        entry = manifest["files"].get(file)
+        if entry and entry["sha256"] == file_hashes[pdf_file]:
+            stats["unchanged"] += 1
+        else:
+            pending.append(file)
+
+    embedder = embeddings or vectorstore.embeddings
+    # The dedup index is assigned to while splitting and released from while storing
+    dedup_lock = threading.Lock()
+    pending_paths = {pdf_files[file]: file for file in pending}
+
+    def extract(files, stage):
+        for pdf_file, content in iter_documents([pdf_files[file] for file in files], file_hashes):
+            stage.units += len(content)
+            yield pending_paths[pdf_file], content
+
+    def split(items, stage):
+        """Split each file, keeping only chunks that are not in the store yet"""
+        for file, content in items:
+            pdf_file = pdf_files[file]
+            entry = manifest["files"].get(file)
+            print(f"Processing file: {pdf_file}")
+            docs, partitions, tenant = split_file(pdf_file, content, params)
+            for doc in docs:
+                doc.metadata.update(partition_metadata([partitions]))
+                if tenant:
+                    doc.metadata["tenant_key"] = tenant
+            chunk_ids = make_chunk_ids(file, docs)
+            stage.units += len(docs)
+
+            # Replace only the stale chunks belonging to this file; chunks whose text
+            # did not change keep their IDs and are not embedded again. A tenant's
+            # index is small and rewritten whole (unchanged text hits the embedding cache).
+            if entry and not tenant and not entry.get("tenant_key"):
+                old_ids = set(entry["chunk_ids"])
+            else:
+                old_ids = set()
+            current_ids = set(chunk_ids) if old_ids else set()
+            stale_ids = [i for i in entry["chunk_ids"] if i not in current_ids] if entry else []
+            new_docs = [doc for doc, i in zip(docs, chunk_ids) if i not in old_ids]
+            new_ids = [i for i in chunk_ids if i not in old_ids]
+            if dedup is not None and stale_ids and not entry.get("tenant_key"):
+                # Release the chunks being replaced before assigning the new ones, so an
+                # edited clause is not collapsed into the old text of itself; only canonical
+                # chunks left without members (and chunks the index lost track of) are deleted
+                with dedup_lock:
+                    unknown = [i for i in stale_ids if i not in dedup.canonical_of]
+                    emptied, changed = dedup.release(stale_ids)
+                    touched.update(changed)
+                stale_ids = emptied + unknown
+            if dedup is not None and not tenant:
+                # Only chunks unlike every stored chunk are embedded and stored
+                kept = []
+                with dedup_lock:
+                    for doc, chunk_id in zip(new_docs, new_ids):
+                        reference = {"source": pdf_file, "page": doc.metadata.get("page"), **partitions}
+                        canonical_id, is_new = dedup.assign(chunk_id, doc.page_content, reference)
+                        if is_new:
+                            kept.append((doc, chunk_id))
+                        else:
+                            touched.add(canonical_id)
+                            stats["chunks_deduplicated"] += 1
+                new_docs = [doc for doc, _ in kept]
+                new_ids = [chunk_id for _, chunk_id in kept]
+            yield file, entry, chunk_ids, stale_ids, new_docs, new_ids, tenant
+
+    def embed(updates, stage):
+        """Embed new chunks in batches spanning consecutive files, passing files on in order"""
+        batch = []
+        for update in updates:
+            batch.append(update)
+            if sum(len(queued[4]) for queued in batch) >= EMBED_BATCH_SIZE:
+                yield from embed_batch(batch, stage)
+                batch = []
+        yield from embed_batch(batch, stage)
+
+    def embed_batch(batch, stage):
+        texts = [doc.page_content for update in batch for doc in update[4]]
+        vectors = embedder.embed_documents(texts) if texts else []
+        stage.units += len(texts)
+        offset = 0
+        for update in batch:
+            yield update, vectors[offset:offset + len(update[4])]
+            offset += len(update[4])
+
+    def checkpoint():
+        with dedup_lock:
+            if dedup is not None:
+                dedup.save(os.path.join(db_path, DEDUP_INDEX_FILE))
+            save_manifest(manifest, db_path)
+
+    def upsert(items, stage):
+        """Store each file's chunks and record it in the manifest.
+
+        Files arrive in order, so a chunk's canonical owner is always stored before
+        the files collapsed into it. The manifest and dedup index are checkpointed
+        every CHECKPOINT_FILES files; files stored after the last checkpoint are
+        simply processed again after a crash (chunk IDs are content-addressed).
+        """
+        since_checkpoint = 0
+        for (file, entry, chunk_ids, stale_ids, new_docs, new_ids, tenant), vectors in items:
+            with dedup_lock:
+                # The split stage already released a shared file's stale chunks from the dedup index
+                deleted = _remove_entry_chunks(vectorstore, db_path, bm25, None, entry or {}, stale_ids, touched)
+                if new_docs and not tenant and dedup is not None:
+                    new_docs = [
+                        Document(page_content=doc.page_content,
+                                 metadata=_source_metadata(doc.metadata, dedup.references(chunk_id)))
+                        for doc, chunk_id in zip(new_docs, new_ids)
+                    ]
+            if new_docs and tenant:
+                _write_tenant_index(db_path, tenant, new_ids, new_docs, vectors)
+            elif new_docs:
+                add_embedded_chunks(vectorstore, new_ids, new_docs, vectors)
+                bm25.add(new_ids, [doc.page_content for doc in new_docs])
+
+            manifest["files"][file] = _manifest_entry(pdf_files[file], file_hashes[pdf_files[file]], chunk_ids, tenant)
+            stats["updated" if entry else "added"] += 1
+            stats["chunks_added"] += len(new_docs)
+            stats["chunks_removed"] += len(deleted)
+            stage.units += len(new_docs)
+            since_checkpoint += 1
+            if since_checkpoint >= CHECKPOINT_FILES:
+                checkpoint()
+                since_checkpoint = 0
+            yield file
+        checkpoint()
+
+    # Parsing (worker processes), splitting, embedding (network) and storing overlap,
+    # with a few files at most queued between stages, so memory stays flat and the
+    # store fills up while the rest of the corpus is still being parsed
+    if pending:
+        stats["pipeline"] = run_pipeline(pending, [("extract", extract), ("split", split),
+                                                   ("embed", embed), ("upsert", upsert)], PIPELINE_QUEUE_SIZE)
+        print("🚰 Pipeline (units: pages or records, chunks, new chunks embedded, new chunks stored):")
+        for line in format_stage_stats(stats["pipeline"]):
+            print(f"   {line}")
+
+    if dedup is not None:
+        # Canonical chunks stored earlier that gained or lost duplicates in this sync
+        _update_sources(vectorstore, dedup, touched)
+        dedup.save(os.path.join(db_path, DEDUP_INDEX_FILE))
+        stats.update(dedup.stats())
+    stats["leases"] = sum(1 for entry in manifest["files"].values() if entry.get("tenant_key"))
+    save_manifest(manifest, db_path)
+    # The keyword index is updated together with the vector store
+    bm25.save(os.path.join(db_path, BM25_INDEX_FILE))
+    if pending or stats["removed"] or touched or not os.path.exists(os.path.join(db_path, CLAUSE_INDEX_FILE)):
+        stats["clauses"] = len(build_clause_index(vectorstore, db_path))
+    return stats
@@ -0,0 +1,106 @@
+import json
+import time
+import base64
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from embeddings import hash_embedding, count_tokens
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` requests per second (0 disables limiting)"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def make_handler(dim, limiter, latency):
+    class EmbeddingHandler(BaseHTTPRequestHandler):
+        """Serves POST /v1/embeddings in the OpenAI response format"""
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/embeddings"):
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            if not limiter.allow():
+                self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                                headers={"Retry-After": "1"})
+                return
+
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            inputs = request["input"]
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            if latency:
+                time.sleep(latency)
+
+            data = []
+            for i, text in enumerate(inputs):
+                vector = hash_embedding(text, dim)
+                if request.get("encoding_format") == "base64":
+                    vector = base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+                data.append({"object": "embedding", "index": i, "embedding": vector})
+            n_tokens = sum(count_tokens(text) for text in inputs)
+            self._send_json(200, {
+                "object": "list",
+                "data": data,
+                "model": request.get("model", "local-stand-in"),
+                "usage": {"prompt_tokens": n_tokens, "total_tokens": n_tokens},
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return EmbeddingHandler
+
+
+def serve(port=8001, dim=1536, rate_limit=0.0, latency=0.0):
+    """Start the stand-in server and block until interrupted"""
+    handler = make_handler(dim, RateLimiter(rate_limit), latency)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    print(f"🧪 Local embedding stand-in on http://127.0.0.1:{port}/v1 (dim={dim}, rate limit={rate_limit or 'none'}/s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    # Point the scheduler at it with base_url="http://127.0.0.1:8001/v1" (or OPENAI_BASE_URL)
+    parser = argparse.ArgumentParser(description="OpenAI-compatible embeddings stand-in for offline KB builds")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second before returning 429")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    args = parser.parse_args()
+    serve(args.port, args.dim, args.rate_limit, args.latency)
@@ -1,4 +1,7 @@
 import os
+import time
+import functools
+import threading
 import warnings
 from dotenv import load_dotenv
 import asyncio
@@ -14,11 +17,19 @@ from langchain.chains import RetrievalQA
 # Retrieval & Vector Stores
 from langchain_community.vectorstores import Chroma
 from langchain_openai import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_experimental.agents.agent_toolkits.pandas.base import create_pandas_dataframe_agent
-from langchain_community.document_loaders import PyPDFLoader
 
+from answer_cache import AnswerCache, FileVersion, place_terms
 from classifier import classify
+from context_packer import CONTEXT_TOKEN_BUDGET, PACK_FETCH_K, ContextPacker, PackedRetriever
+from knowledge_base import DB_PATH, load_clause_index, load_manifest
+from kb_versions import current_version, embedding_model_id, load_and_process_pdf, version_path
+from embeddings import EMBEDDING_BACKEND, LOCAL_EMBEDDINGS_FILE, CachedEmbeddings, LocalEmbeddings
+from partitions import normalize_tenant_key
+from retrieval_cache import RETRIEVAL_CACHE_PATH, CachedRetriever, RetrievalCache
+from retrievers import (
+    RETRIEVER_BACKEND, ClauseRetriever, TenantRetriever, build_retriever, store_path, tenant_index_exists
+)
 
 # Suppress warnings
 warnings.filterwarnings('ignore')
@@ -31,63 +42,39 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
     raise ValueError("OPENAI_API_KEY not found in environment variables.")
 
-def load_and_process_pdf(pdf_path):
-    """Load PDF and process it for Chroma DB"""
-    # Knowledge base
-    # Load and process multiple PDFs from the examples folder
-    pdf_folder = pdf_path
-    pdf_files = [os.path.join(pdf_folder, file) for file in os.listdir(pdf_folder) if file.endswith(".pdf")]
-    
-    all_docs = []
-    for pdf_file in pdf_files:
-        print(f"Processing file: {pdf_file}")
-        loader = PyPDFLoader(pdf_file)
-        pages = loader.load()
-        
-        text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-        )
-        docs = text_splitter.split_documents(pages)
-        all_docs.extend(docs)
-    
-    print(f"📝 Total text chunks from all PDFs: {len(all_docs)}")
-    
-    # Create embeddings
-    embeddings_pdf = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
-    
-    # Clear any existing chroma database (commented out to prevent errors on rerun)
-    db_path = "./pdf_knowledge_base"
-    # if os.path.exists(db_path):
-    #     shutil.rmtree(db_path)
-    #     print("🧹 Cleared existing database")
-    
-    # Create Chroma vector store
-    print("🔍 Creating vector embeddings...")
-    vectorstore_pdf = Chroma.from_documents(
-        documents=all_docs,
-        embedding=embeddings_pdf,
-        persist_directory=db_path)
-    
-    # Persist the database
-    vectorstore_pdf.persist()
-    print(f"💾 Vector database saved to: {db_path}")
-    
-    return vectorstore_pdf
+def version_embeddings(path, embeddings):
+    """Embeddings for querying a knowledge base version with the same backend as `embeddings`.
 
+    That is the version's own fitted local model for the local backend, or the
+    embeddings given; None if the version was embedded with another model (e.g.
+    built by `kb_versions.py build` with the other backend).
+    """
+    manifest = load_manifest(path)
+    if manifest is None:
+        return None
+    if isinstance(embeddings, LocalEmbeddings):
+        local_path = os.path.join(path, LOCAL_EMBEDDINGS_FILE)
+        if not os.path.exists(local_path):
+            return None
+        embeddings = LocalEmbeddings.load(local_path)
+    return embeddings if manifest["chunking"].get("embedding_model") == embedding_model_id(embeddings) else None
 
-def create_pdf_qa_system(vectorstore_pdf, llm):
+
+def create_pdf_qa_system(vectorstore_pdf, llm, retriever=None):
     """Create Q&A system for PDF documents"""
     
+    # Default to Chroma similarity search; any other retriever backend can be plugged in
+    if retriever is None:
+        retriever = vectorstore_pdf.as_retriever(
+            search_type="similarity",
+            search_kwargs={"k": 3}  # Return top 3 relevant chunks
+        )
+
     # Create retrieval QA chain
     qa_chain_pdf = RetrievalQA.from_chain_type(
         llm=llm,
         chain_type="stuff",
-        retriever=vectorstore_pdf.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 3}  # Return top 3 relevant chunks
-        ),
+        retriever=retriever,
         return_source_documents=True
     )
     
@@ -111,7 +98,9 @@ def create_csv_agent(csv_path, llm):
 
 
 class PropertySupportBot:
-    def __init__(self):
+    def __init__(self, fast_start=True, retriever_backend=RETRIEVER_BACKEND, embedding_backend=EMBEDDING_BACKEND,
+                 clause_lookup=True, context_budget=CONTEXT_TOKEN_BUDGET, retrieval_cache=True,
+                 retrieval_cache_path=RETRIEVAL_CACHE_PATH, answer_cache=True, answer_thresholds=None):
         # Load environment variables
         load_dotenv()
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
@@ -127,36 +116,213 @@ class PropertySupportBot:
                 max_retries=3,
                 request_timeout=30
             )
-            self.embeddings = OpenAIEmbeddings(
+            # Embeddings are served from the local cache whenever the text was seen before
+            self.embeddings = CachedEmbeddings(OpenAIEmbeddings(
                 openai_api_key=self.openai_api_key,
                 max_retries=3,
                 request_timeout=30
-            )
+            ))
         except Exception as e:
             print(f"Error initializing OpenAI models: {e}")
             raise
         
         try:
             # Knowledge base
-            self.vectorstore = load_and_process_pdf("property_data_generator")
+            self.vectorstore = load_and_process_pdf("property_data_generator", self.embeddings, fast_start=fast_start,
+                                                    embedding_backend=embedding_backend,
+                                                    retriever_backend=retriever_backend)
+            # The local backend queries with the model fitted for the live version
+            self.embeddings = self.vectorstore.embeddings
+            self.kb_version = current_version(DB_PATH)
+            # Last published version skipped for being embedded with another model
+            self._incompatible_version = None
+            # Repeated queries reuse their embedding and top-k chunks until the knowledge base
+            # version changes (retrieval_cache_path=None keeps the cache in memory only)
+            self.retrieval_cache = RetrievalCache(self.kb_version, retrieval_cache_path) if retrieval_cache else None
+            self.vectorstore = self._open_store(store_path(self.vectorstore))
             
             # Memory for conversations
             self.memory = ConversationBufferMemory()
             
-            # QA chain for policies
-            self.qa_chain = create_pdf_qa_system(self.vectorstore, self.llm)
-            self.csv_agent = create_csv_agent("property_database_v2.csv", self.llm)
+            # QA chain for policies and CSV agent are built on the first query routed to them
+            self.csv_path = "property_database_v2.csv"
+            self.retriever_backend = retriever_backend
+            # Queries naming a clause ("diplomatic clause") are answered from the clause index
+            self.clause_lookup = clause_lookup
+            # Retrieved chunks are cut down to the query's sentences within a token budget (None sends them whole)
+            self.context_packer = ContextPacker(context_budget) if context_budget else None
+            self.retriever_k = PACK_FETCH_K if self.context_packer else 3
+            self._search_retriever = None
+            self._qa_chain = None
+            self._csv_agent = None
+            # Paraphrases of an answered query get its answer without classifying or answering again,
+            # until the data behind its route changes (answer_thresholds overrides the per-route similarity)
+            # The property database is only hashed and read once a query needs it
+            self.csv_version = FileVersion(self.csv_path)
+            self._csv_seen = None
+            self.answer_cache = (AnswerCache(answer_thresholds, places=functools.partial(place_terms, self.csv_path))
+                                 if answer_cache else None)
+            # QA chains searching one tenant's agreement together with the shared clauses
+            self._tenant_qa_chains = {}
+            self._lazy_lock = threading.Lock()
         except Exception as e:
             print(f"Error initializing knowledge base: {e}")
             raise
+
+    @property
+    def qa_chain(self):
+        """PDF QA chain, created on first use"""
+        if self._qa_chain is None:
+            with self._lazy_lock:
+                if self._qa_chain is None:
+                    self._qa_chain = create_pdf_qa_system(
+                        self.vectorstore, self.llm, self._packed(self._knowledge_base_retriever()))
+        return self._qa_chain
+
+    def _open_store(self, path):
+        """Chroma store of a knowledge base version, querying through the retrieval cache if there is one"""
+        embeddings = self.retrieval_cache.wrap(self.embeddings) if self.retrieval_cache else self.embeddings
+        return Chroma(persist_directory=path, embedding_function=embeddings)
+
+    def _cached(self, retriever, scope):
+        """The retriever behind the retrieval cache, if there is one"""
+        if self.retrieval_cache is None:
+            return retriever
+        return CachedRetriever(retriever=retriever, cache=self.retrieval_cache, embeddings=self.vectorstore.embeddings,
+                               scope=scope)
+
+    def _packed(self, retriever):
+        """The retriever with its chunks packed into the context token budget, if one is set"""
+        if self.context_packer is None:
+            return retriever
+        return PackedRetriever(retriever=retriever, packer=self.context_packer)
+
+    def _knowledge_base_retriever(self):
+        """Search shared by every QA chain: clause lookup, then the retrieval cache, then the configured backend.
+
+        Clause lookup comes before the cache, which embeds every query for its
+        key, so queries naming a clause are answered without an embedding call.
+        Built on first use by a caller holding _lazy_lock.
+        """
+        if self._search_retriever is None:
+            retriever = build_retriever(self.vectorstore, self.retriever_backend, k=self.retriever_k)
+            retriever = self._cached(retriever, f"{self.retriever_backend}/k={self.retriever_k}")
+            if self.clause_lookup:
+                clauses = load_clause_index(self.vectorstore, store_path(self.vectorstore))
+                retriever = ClauseRetriever(clauses=clauses, retriever=retriever, k=self.retriever_k)
+            self._search_retriever = retriever
+        return self._search_retriever
+
+    def refresh_knowledge_base(self):
+        """Switch to the live knowledge base version if a newer build has been published"""
+        version = current_version(DB_PATH)
+        if version is None or version in (self.kb_version, self._incompatible_version):
+            return False
+        with self._lazy_lock:
+            if version in (self.kb_version, self._incompatible_version):
+                return False
+            path = version_path(version, DB_PATH)
+            embeddings = version_embeddings(path, self.embeddings)
+            if embeddings is None:
+                # Querying it with this bot's embeddings would fail on every query
+                self._incompatible_version = version
+                print(f"⚠️ Not switching to knowledge base version {version}: it was not embedded with "
+                      f"{embedding_model_id(self.embeddings)}; staying on {self.kb_version}")
+                return False
+            self.embeddings = embeddings
+            self.vectorstore = self._open_store(path)
+            self.kb_version = version
+            if self.retrieval_cache:
+                self.retrieval_cache.set_version(version)
+            # Chains are rebuilt against the new version on their next use
+            self._search_retriever = None
+            self._qa_chain = None
+            self._tenant_qa_chains = {}
+        print(f"🔄 Switched to knowledge base version {version}")
+        return True
+
+    def qa_chain_for(self, tenant_id=None):
+        """PDF QA chain searching one tenant's agreement on top of the shared knowledge base, created on first use.
+
+        Tenants without an agreement in the knowledge base get the shared chain.
+        """
+        key = normalize_tenant_key(tenant_id)
+        if key is None or not tenant_index_exists(self.vectorstore, key):
+            return self.qa_chain
+        if key not in self._tenant_qa_chains:
+            with self._lazy_lock:
+                if key not in self._tenant_qa_chains:
+                    retriever = TenantRetriever(vectorstore=self.vectorstore, retriever=self._knowledge_base_retriever(),
+                                                tenant_key=key, k=self.retriever_k)
+                    self._tenant_qa_chains[key] = create_pdf_qa_system(self.vectorstore, self.llm,
+                                                                       self._packed(retriever))
+        return self._tenant_qa_chains[key]
+
+    @property
+    def csv_agent(self):
+        """CSV agent over the property database, created on first use"""
+        if self._csv_agent is None:
+            with self._lazy_lock:
+                if self._csv_agent is None:
+                    # Version of the table the agent loads into memory
+                    self._csv_seen = self.csv_version.current()
+                    self._csv_agent = create_csv_agent(self.csv_path, self.llm)
+        return self._csv_agent
     
-    def process_query(self, query: str):
+    def data_versions(self):
+        """Version of the data behind each route: the knowledge base version and the property database hash"""
+        csv_version = self.csv_version.current()
+        if self._csv_agent is not None and csv_version != self._csv_seen:
+            with self._lazy_lock:
+                if self._csv_agent is not None and csv_version != self._csv_seen:
+                    # The CSV agent holds the old table in memory
+                    print("🔄 Property database changed, the CSV agent will be rebuilt")
+                    self._csv_agent = None
+        return {"information_retrieval": self.kb_version, "property_data_analysis": csv_version}
+
+    def _cached_answer(self, query, tenant_id=None):
+        """Answer cache entry of a cached paraphrase of the query (its answer and route), or None"""
+        if self.answer_cache is None:
+            return None
+        try:
+            entry = self.answer_cache.lookup(query, self.vectorstore.embeddings, normalize_tenant_key(tenant_id),
+                                             self.data_versions())
+        except Exception as e:
+            print(f"❌ Answer cache error: {e}")
+            return None
+        if entry is None:
+            return None
+        print(f"💾 Answer cache hit ({entry['route']}, similarity {entry['similarity']:.3f}, "
+              f"~{entry['seconds']:.1f}s saved): {entry['query']}")
+        return entry
+
+    def _remember_answer(self, query, tenant_id, route, answer, started, sources=None):
+        """Add an answer to the answer cache with the time it took and the version of its data"""
+        if self.answer_cache is None:
+            return
+        try:
+            self.answer_cache.add(query, self.vectorstore.embeddings, route, answer, sources,
+                                  time.perf_counter() - started, normalize_tenant_key(tenant_id),
+                                  self.data_versions().get(route))
+        except Exception as e:
+            print(f"❌ Answer cache error: {e}")
+
+    def process_query(self, query: str, tenant_id: str = None):
         """Process user query based on category classification (synchronous version)"""
         
         print(f"🔵 INPUT TO SUPPORT BOT:")
         print(f"Query: {query}")
+        if tenant_id:
+            print(f"Tenant: {tenant_id}")
 
         try:
+            # Pick up a knowledge base rebuilt by another process since the last query
+            self.refresh_knowledge_base()
+            started = time.perf_counter()
+            cached = self._cached_answer(query, tenant_id)
+            if cached is not None:
+                return cached["answer"]
+
             # Classify the query with timeout
             try:
                 # Check if we're already in an event loop
@@ -183,11 +349,14 @@ class PropertySupportBot:
             if module == "information_retrieval":
                 print("\n🔵 HANDLING INFORMATION RETRIEVAL QUERY...")
                 try:
-                    result = self.qa_chain.invoke(query)
+                    result = self.qa_chain_for(tenant_id).invoke(query)
                     print(f"Answer: {result['result']}")
                     if result.get('source_documents'):
                         print(f"📄 Sources: Page {result['source_documents'][0].metadata.get('page', 'Unknown')} of PDF")
                         print(f"📝 Source Text Preview: {result['source_documents'][0].page_content[:150]}...")
+                    sources = [{key: doc.metadata.get(key) for key in ("source", "page", "heading")}
+                               for doc in result.get('source_documents', [])]
+                    self._remember_answer(query, tenant_id, module, result['result'], started, sources)
                     return result['result']
                 except Exception as e:
                     print(f"❌ PDF QA error: {e}")
@@ -198,6 +367,8 @@ class PropertySupportBot:
                 try:
                     result = self.csv_agent.invoke(query)
                     print(f"Analysis Result: {result['output']}")
+                    self._remember_answer(query, tenant_id, module, result['output'], started,
+                                          [{"source": self.csv_path}])
                     return result['output']
                 except Exception as e:
                     print(f"❌ CSV analysis error: {e}")
@@ -208,6 +379,7 @@ class PropertySupportBot:
                 try:
                     # Use simple LLM for general queries
                     response = self.llm.invoke(query)
+                    self._remember_answer(query, tenant_id, module, response.content, started)
                     return response.content
                 except Exception as e:
                     print(f"❌ General query error: {e}")
@@ -217,13 +389,30 @@ class PropertySupportBot:
             print(f"❌ Critical error in process_query: {e}")
             return f"I apologize, but I encountered an error while processing your query: '{query}'. Please try rephrasing your question or contact support if the issue persists."
 
-    async def process_query_async(self, query: str):
+    async def process_query_async(self, query: str, tenant_id: str = None):
         """Process user query based on category classification (asynchronous version)"""
+        return (await self.answer_query_async(query, tenant_id))[0]
+
+    async def answer_query_async(self, query: str, tenant_id: str = None):
+        """Answer a query like process_query_async; returns (answer, route).
+
+        route is the module that produced the answer (also for answers from the
+        answer cache), or None for the fallback and error replies.
+        """
         
         print(f"🔵 INPUT TO SUPPORT BOT (ASYNC):")
         print(f"Query: {query}")
+        if tenant_id:
+            print(f"Tenant: {tenant_id}")
 
         try:
+            # Pick up a knowledge base rebuilt by another process since the last query
+            self.refresh_knowledge_base()
+            started = time.perf_counter()
+            cached = self._cached_answer(query, tenant_id)
+            if cached is not None:
+                return cached["answer"], cached["route"]
+
             # Classify the query with timeout
             try:
                 classification = await asyncio.wait_for(classify(query), timeout=10.0)
@@ -241,15 +430,18 @@ class PropertySupportBot:
                 try:
                     # Run the synchronous invoke in a thread pool to avoid blocking
                     loop = asyncio.get_event_loop()
-                    result = await loop.run_in_executor(None, self.qa_chain.invoke, query)
+                    result = await loop.run_in_executor(None, self.qa_chain_for(tenant_id).invoke, query)
                     print(f"Answer: {result['result']}")
                     if result.get('source_documents'):
                         print(f"📄 Sources: Page {result['source_documents'][0].metadata.get('page', 'Unknown')} of PDF")
                         print(f"📝 Source Text Preview: {result['source_documents'][0].page_content[:150]}...")
-                    return result['result']
+                    sources = [{key: doc.metadata.get(key) for key in ("source", "page", "heading")}
+                               for doc in result.get('source_documents', [])]
+                    self._remember_answer(query, tenant_id, module, result['result'], started, sources)
+                    return result['result'], module
                 except Exception as e:
                     print(f"❌ PDF QA error: {e}")
-                    return self._fallback_response(query, "PDF knowledge base")
+                    return self._fallback_response(query, "PDF knowledge base"), None
                     
             elif module == "property_data_analysis":
                 print("\n🔵 HANDLING PROPERTY DATA ANALYSIS QUERY...")
@@ -258,10 +450,12 @@ class PropertySupportBot:
                     loop = asyncio.get_event_loop()
                     result = await loop.run_in_executor(None, self.csv_agent.invoke, query)
                     print(f"Analysis Result: {result['output']}")
-                    return result['output']
+                    self._remember_answer(query, tenant_id, module, result['output'], started,
+                                          [{"source": self.csv_path}])
+                    return result['output'], module
                 except Exception as e:
                     print(f"❌ CSV analysis error: {e}")
-                    return self._fallback_response(query, "property data analysis")
+                    return self._fallback_response(query, "property data analysis"), None
                     
             else:
                 print("\n🔵 HANDLING GENERAL QUERY...")
@@ -269,14 +463,15 @@ class PropertySupportBot:
                     # Run the synchronous invoke in a thread pool to avoid blocking
                     loop = asyncio.get_event_loop()
                     response = await loop.run_in_executor(None, self.llm.invoke, query)
-                    return response.content
+                    self._remember_answer(query, tenant_id, module, response.content, started)
+                    return response.content, module
                 except Exception as e:
                     print(f"❌ General query error: {e}")
-                    return self._fallback_response(query, "general support")
+                    return self._fallback_response(query, "general support"), None
                 
         except Exception as e:
             print(f"❌ Critical error in process_query_async: {e}")
-            return f"I apologize, but I encountered an error while processing your query: '{query}'. Please try rephrasing your question or contact support if the issue persists."
+            return f"I apologize, but I encountered an error while processing your query: '{query}'. Please try rephrasing your question or contact support if the issue persists.", None
     
     def _fallback_response(self, query: str, context: str):
         """Provide a fallback response when API calls fail"""
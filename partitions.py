@@ -0,0 +1,133 @@
+import re
+
+# Property type partitions; "standard" holds clauses that apply to every property type
+PROPERTY_TYPES = ["hdb", "condo", "landed", "standard"]
+# Rental type partitions; clause PDFs that are not specific to one apply to both
+RENTAL_TYPES = ["whole", "bedroom"]
+
+PROPERTY_PATTERNS = {
+    "hdb": re.compile(r"\bhdb\b|\bflats?\b|\b[1-5][ -]?room\b|\bexecutive\b|\bmaisonettes?\b|\bmansionettes?\b"),
+    "condo": re.compile(r"\bcondo(minium)?s?\b|\bapartments?\b|\bprivate (property|residence)\b"),
+    "landed": re.compile(r"\blanded\b|\bterrace[ds]?\b|\bsemi-?detached\b|\bdetached\b|\bbungalows?\b|\bcluster house"),
+}
+RENTAL_PATTERNS = {
+    "bedroom": re.compile(r"\bbed ?rooms?\b|\b(common|master) room\b|\brent(ing)? (a|one) room\b|\broom rental\b"),
+    "whole": re.compile(r"\bwhole\b|\bentire\b"),
+}
+
+# "TENANCY AGREEMENT (HDB FLAT)", "SPECIFIC TENANCY CLAUSES FOR LANDED", "STANDARD TENANCY CLAUSES"
+_TITLE_RE = re.compile(r"TENANCY AGREEMENT\s*\(([^)]*)\)|TENANCY CLAUSES FOR ([^\n]*)|(STANDARD) TENANCY CLAUSES")
+_BEDROOM_NOTE_RE = re.compile(r"partial rental of bedrooms", re.IGNORECASE)
+# "Reference No.: SPPL/2023/0007" on an agreement generated for a rented property (blank on templates)
+_REFERENCE_RE = re.compile(r"Reference No\.:\s*([A-Z]+/\d{4}/\d+)")
+REFERENCE_PREFIX = "SPPL/2023/"
+
+
+def detect_property_types(text):
+    """Property type partitions mentioned in a piece of text"""
+    text = text.lower()
+    return [name for name, pattern in PROPERTY_PATTERNS.items() if pattern.search(text)]
+
+
+def detect_rental_type(text):
+    """"bedroom" or "whole" if the text says which kind of rental it is about, else None"""
+    text = text.lower()
+    for name, pattern in RENTAL_PATTERNS.items():
+        if pattern.search(text):
+            return name
+    return None
+
+
+def document_partitions(pages):
+    """Property and rental type of a loaded PDF, read from its title and notes on the first page.
+
+    Documents with no recognizable title (e.g. example Q&A) go into the "standard"
+    partition so they stay searchable for every query.
+    """
+    first_page = " ".join(pages[0].page_content.split()) if pages else ""
+    match = _TITLE_RE.search(first_page[:500])
+    property_types = []
+    if match and not match.group(3):
+        property_types = detect_property_types(match.group(1) or match.group(2))
+    if _BEDROOM_NOTE_RE.search(first_page):
+        rental_type = "bedroom"
+    elif match and match.group(1):
+        # Generated agreements without the bedroom note rent out the whole unit
+        rental_type = "whole"
+    else:
+        rental_type = None
+    return {"property_types": property_types or ["standard"], "rental_type": rental_type}
+
+
+def document_tenant_key(pages):
+    """Reference number of a tenant's own agreement, or None for shared documents (clauses, templates)"""
+    first_page = " ".join(pages[0].page_content.split()) if pages else ""
+    match = _REFERENCE_RE.search(first_page)
+    return match.group(1) if match else None
+
+
+def record_partitions(records):
+    """Property and rental type of a document given as clause records, read from their fields.
+
+    Agreements for units that are not bedrooms (e.g. "4 ROOM", "TERRACE HOUSE") rent
+    out the whole unit, as with document_partitions.
+    """
+    first = records[0] if records else {}
+    property_types = detect_property_types(first.get("property_type") or "")
+    rental_type = detect_rental_type(first.get("rental_type") or "")
+    if rental_type is None and first.get("rental_type"):
+        rental_type = "whole"
+    return {"property_types": property_types or ["standard"], "rental_type": rental_type}
+
+
+def record_tenant_key(records):
+    """Reference number of the agreement a document's clause records belong to, or None"""
+    return normalize_tenant_key(records[0].get("ref_no")) if records else None
+
+
+def normalize_tenant_key(tenant_id):
+    """Normalize a tenant identity to an agreement reference number ("7", "0007" and "SPPL/2023/0007" match)"""
+    if tenant_id is None:
+        return None
+    tenant_id = str(tenant_id).strip().upper()
+    if tenant_id.isdigit():
+        return REFERENCE_PREFIX + tenant_id.zfill(4)
+    return tenant_id or None
+
+
+def partition_metadata(partitions):
+    """Boolean pt_*/rt_* metadata flags for the union of one or more documents' partitions"""
+    metadata = {f"pt_{name}": False for name in PROPERTY_TYPES}
+    metadata.update({f"rt_{name}": False for name in RENTAL_TYPES})
+    for partition in partitions:
+        for name in partition["property_types"]:
+            metadata[f"pt_{name}"] = True
+        for name in [partition["rental_type"]] if partition["rental_type"] else RENTAL_TYPES:
+            metadata[f"rt_{name}"] = True
+    return metadata
+
+
+def _any_of(conditions):
+    return conditions[0] if len(conditions) == 1 else {"$or": conditions}
+
+
+def partition_filter(property_types, rental_type=None):
+    """Chroma `where` filter for chunks of the given property types (plus standard clauses) and rental type"""
+    property_types = [name for name in property_types if name != "standard"]
+    conditions = []
+    if property_types:
+        conditions.append(_any_of([{f"pt_{name}": True} for name in property_types + ["standard"]]))
+    if rental_type:
+        conditions.append({f"rt_{rental_type}": True})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def query_filter(query):
+    """Chroma `where` filter restricting a search to the partitions a query is about, or None.
+
+    A query naming property types searches those types plus the standard clauses;
+    a query naming a rental type searches chunks that apply to it.
+    """
+    return partition_filter(detect_property_types(query), detect_rental_type(query))
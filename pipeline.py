@@ -0,0 +1,141 @@
+import time
+import queue
+import threading
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+class StageStats:
+    """Counters for one pipeline stage: items, time spent working or waiting, and input queue depth"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items_in = 0
+        self.items_out = 0
+        self.units = 0
+        self.elapsed = 0.0
+        # Time blocked on an empty input queue (starved) or a full output queue (back-pressure)
+        self.wait_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.queue_max = 0
+        self._queue_total = 0
+        self._queue_samples = 0
+
+    def record_depth(self, depth):
+        self.queue_max = max(self.queue_max, depth)
+        self._queue_total += depth
+        self._queue_samples += 1
+
+    def as_dict(self):
+        busy = max(self.elapsed - self.wait_seconds - self.blocked_seconds, 1e-9)
+        return {
+            "items": self.items_out,
+            "units": self.units,
+            "busy_s": busy,
+            "wait_s": self.wait_seconds,
+            "blocked_s": self.blocked_seconds,
+            "items_per_s": self.items_out / busy,
+            "units_per_s": self.units / busy,
+            "queue_max": self.queue_max,
+            "queue_mean": self._queue_total / self._queue_samples if self._queue_samples else 0.0,
+        }
+
+
+def run_pipeline(source, stages, queue_size=4):
+    """Run generator stages connected by bounded queues; returns {stage name: stats dict}.
+
+    Each stage is a (name, function) pair: the function takes an iterator of input
+    items and yields output items, and may add to its StageStats.units (e.g.
+    chunks) through the second argument it is called with. Every stage but the
+    last runs in its own thread and hands items on through a queue holding at
+    most queue_size of them, so a slow stage holds back the ones before it
+    instead of letting work pile up in memory. The last stage runs in the calling
+    thread. An exception in any stage stops the pipeline and is re-raised here.
+    """
+    stats = [StageStats(name) for name, _ in stages]
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages[:-1]]
+    stop = threading.Event()
+    errors = []
+
+    def feed(index):
+        stage = stats[index]
+        if index == 0:
+            for item in source:
+                stage.items_in += 1
+                yield item
+            return
+        inbox = queues[index - 1]
+        while True:
+            start = time.perf_counter()
+            while True:
+                try:
+                    depth = inbox.qsize()
+                    item = inbox.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    if stop.is_set():
+                        return
+            stage.wait_seconds += time.perf_counter() - start
+            if item is _DONE:
+                return
+            stage.record_depth(depth)
+            stage.items_in += 1
+            yield item
+
+    def put(index, item):
+        start = time.perf_counter()
+        while not stop.is_set():
+            try:
+                queues[index].put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stats[index].blocked_seconds += time.perf_counter() - start
+        return not stop.is_set()
+
+    def run(index):
+        _, function = stages[index]
+        stage = stats[index]
+        start = time.perf_counter()
+        output = function(feed(index), stage)
+        try:
+            for item in output:
+                stage.items_out += 1
+                if index < len(queues) and not put(index, item):
+                    break
+            if index < len(queues):
+                put(index, _DONE)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            close = getattr(output, "close", None)
+            if close is not None:
+                close()
+            stage.elapsed = time.perf_counter() - start
+
+    threads = [threading.Thread(target=run, args=(index,), daemon=True) for index in range(len(stages) - 1)]
+    for thread in threads:
+        thread.start()
+    try:
+        run(len(stages) - 1)
+    finally:
+        # Releases any stage still blocked on a queue once the last stage is done
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return {stage.name: stage.as_dict() for stage in stats}
+
+
+def format_stage_stats(pipeline_stats, unit="units"):
+    """One line per stage: throughput, busy/starved/blocked seconds and input queue depth"""
+    lines = []
+    for name, stage in pipeline_stats.items():
+        rate = f"{stage['units_per_s']:.1f} {unit}/s" if stage["units"] else f"{stage['items_per_s']:.1f} items/s"
+        lines.append(f"{name:<8}{stage['items']:>7} items{stage['units']:>9} {unit:<7}{rate:>18}  "
+                     f"busy {stage['busy_s']:.1f}s, starved {stage['wait_s']:.1f}s, blocked {stage['blocked_s']:.1f}s, "
+                     f"queue max {stage['queue_max']} mean {stage['queue_mean']:.1f}")
+    return lines
@@ -1,7 +1,14 @@
+import argparse
+
 import pandas as pd
 import numpy as np
 from tenancy_agreement_generator import generate_tenancy_agreement
 
+parser = argparse.ArgumentParser(description="Generate a tenancy agreement for every rented property")
+parser.add_argument("--output", default="pdf", choices=["pdf", "records", "both"],
+                    help="write the agreement PDFs, their clause records (.clauses.json) or both")
+args = parser.parse_args()
+
 # Read the property database CSV file
 df = pd.read_csv('property_database.csv')
 
@@ -29,7 +36,7 @@ for i in range(len(rented_df)):
     rental_date = rented_df.loc[i, 'rental_date']
     # print(property_type, '|', rental_type, '|', property_address, '|', rental_price)
 
-    generate_tenancy_agreement(property_type, rental_type, ref_no, landlord_name, tenant_name, property_address, rental_price, rental_date)
+    generate_tenancy_agreement(property_type, rental_type, ref_no, landlord_name, tenant_name, property_address, rental_price, rental_date, output=args.output)
     print(f"Generated tenancy agreement for {tenant_name} at {property_address}")
 
 
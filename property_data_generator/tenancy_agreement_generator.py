@@ -1,9 +1,15 @@
+import json
 import random
 from datetime import datetime, timedelta
 from fpdf import FPDF
 from fpdf.enums import XPos, YPos  # Import the new enums
 
-def generate_tenancy_agreement(property_type, rental_type, ref_no, landlord_name, tenant_name, rental_address, monthly_rent, rental_date):
+def generate_tenancy_agreement(property_type, rental_type, ref_no, landlord_name, tenant_name, rental_address, monthly_rent, rental_date, output="pdf"):
+    """Write tenancy_agreement_{ref_no}.pdf and/or its clause records; returns the clause records.
+
+    output is "pdf", "records" (tenancy_agreement_{ref_no}.clauses.json: one record per clause with
+    the reference number, section, heading, text, property type and rental type) or "both".
+    """
 
     # Create a random date for use as start_date and rental_start_date (depreciated as rental_date is now passed in)
     # first_date = datetime(2025, 1, 1)
@@ -91,6 +97,8 @@ def generate_tenancy_agreement(property_type, rental_type, ref_no, landlord_name
     tent_id_field = f"**NRIC:** {tenant_id}"
     tent_email_field = f"**EMAIL:** {tenant_email}"
     tent_definition = "(hereinafter referred to as the \"TENANT\" which expression where the context so admits shall include the Tenant's successors and assigns) of the other part."
+    landlord_note = "**The Landlord:** Please inspect the original employment or work pass, original travel and identification documents of the prospective foreign tenants."
+    tenant_note = "**The Tenant:** The Tenant is required to inform the Landlord of any visitors staying in the house from time to time. The Tenant shall be responsible to ensure that the number of Tenants and occupiers shall not exceed the maximum occupants allowed by the authorities."
 
     section1title = "1. RENT"
     section1 = f"The Landlord agrees to let and the Tenant agrees to take all that premises known as **{rental_address}** (hereinafter called the \"Premises\") together with the furniture, fixtures and other effects therein (as more fully described in the Inventory List attached)* for a period of **{rental_period}** months commencing from **{rental_start_date}** (the \"Tenancy Agreement\"), at the monthly rental of S$ **{monthly_rent}**. The Monthly Rent shall be paid monthly without demand in advance and clear of all deductions on or before the 21st day of each calendar month. All payments of Rent shall be made to the account of the Landlord with account number **{bank_account}**. If the payment is by GIRO, evidence of such GIRO arrangement shall be provided by the Tenant to the Landlord within 1 month from the commencement of this Tenancy Agreement."
@@ -254,6 +262,69 @@ def generate_tenancy_agreement(property_type, rental_type, ref_no, landlord_name
     section5p = "If at any time during the Term, the Housing & Development Board (HDB) revokes or withdraws its consent to the rental in which case the termination of this Agreement shall be without prejudice to any rights and/or liabilities of the Landlord or the Tenant, where relevant, in respect of any antecedent breach of this Agreement which is accruing, has accrued or may accrue."
 
 
+    # Clauses of sections 1 to 5 in document order as (section title, sub-clause heading, text)
+    is_bedroom = rental_type == "1 BEDROOM" or rental_type == "2 BEDROOM"
+    clauses = [(section1title, None, section1)]
+    section2 = [
+        (section2ah, section2a), (section2bh, section2b), (section2ch, section2c), (section2dh, section2d),
+        (section2eh, section2e), (section2fh, section2f), (section2gh, section2g), (section2hh, section2h),
+        (section2ih, section2i), (section2jh, section2j), (section2kh, section2k), (section2lh, section2l),
+        (section2mh, section2m), (section2nh, section2n), (section2oh, section2o), (section2ph, section2p),
+        (section2qh, section2q), (section2rh, section2r), (section2sh, section2s), (section2th, section2t),
+        (section2uh, section2u), (section2vh, section2v), (section2wh, section2w), (section2xh, section2x),
+        (section2yh, section2y), (section2zh, section2z), (section2aah, section2aa),
+    ]
+    if property_type != "HDB FLAT":
+        section2.append((section2abh, section2ab))
+    clauses += [(section2title, heading, text) for heading, text in section2]
+    clauses.append((section3title, None, f"{section3p1}\n{section3p2}"))
+    clauses += [(section3title, heading, text) for heading, text in [
+        (section3ah, section3a), (section3bh, section3b), (section3ch, section3c), (section3dh, section3d),
+        (section3eh, section3e),
+    ]]
+    section4 = [(section4ah, section4a), (section4bh, section4b), (section4ch, section4c), (section4dh, section4d),
+                (section4eh, section4e)]
+    if is_bedroom:
+        section4 += [(section4fh, section4f), (section4gh, section4g)]
+    clauses += [(section4title, heading, text) for heading, text in section4]
+    section5 = [
+        (section5ah, section5a), (section5bh, section5b), (section5ch, section5c), (section5dh, section5d),
+        (section5eh, section5e), (section5fh, section5f), (section5gh, section5g), (section5hh, section5h),
+        (section5ih, section5i), (section5jh, section5j), (section5kh, section5k), (section5lh, section5l),
+        (section5mh, section5m), (section5nh, section5n), (section5oh, section5o),
+    ]
+    if property_type == 'HDB FLAT':
+        section5.append((section5ph, section5p))
+    clauses += [(section5title, heading, text) for heading, text in section5]
+
+    # The same agreement as structured records (bold markers removed), which the knowledge base
+    # ingests directly instead of parsing the PDF back to text
+    preamble = [f"TENANCY AGREEMENT ({property_type})"]
+    if is_bedroom:
+        preamble.append("Note: This lease agreement is for the partial rental of bedrooms only.")
+    preamble += [ref_no_para, disclaimer_para, f"This AGREEMENT is made on the {start_date}", "BETWEEN",
+                 ll_name_field, ll_id_field, ll_add_field, ll_email_field, ll_definition, "AND",
+                 tent_name_field, tent_id_field, tent_email_field, tent_definition, "WHEREBY IT IS AGREED as follows:"]
+    witness = ["the parties hereto have hereunto set their hands the day and year first above written.",
+               "SIGNED by the LANDLORD", f"Name: {landlord_name}", f"NRIC: {landlord_id}",
+               "SIGNED by the TENANT", f"Name: {tenant_name}", f"NRIC: {tenant_id}",
+               "List of occupier(s)", f"Name of Occupier: {tenant_name}, ID No.: {tenant_id}",
+               landlord_note, tenant_note]
+
+    def record(section, heading, text):
+        return {"ref_no": full_ref_no, "section": section, "heading": heading, "text": text.replace("**", ""),
+                "property_type": property_type, "rental_type": rental_type}
+
+    records = [record(None, None, "\n".join(preamble))]
+    records += [record(section_title, heading, text) for section_title, heading, text in clauses]
+    records.append(record("IN WITNESS WHEREOF", None, "\n".join(witness)))
+    if output in ("records", "both"):
+        with open(f"tenancy_agreement_{ref_no}.clauses.json", "w", encoding="utf-8") as f:
+            json.dump(records, f)
+    if output == "records":
+        return records
+
+
     # Instantiate a PDF
     pdf = FPDF()
     pdf.add_page()
@@ -295,138 +366,20 @@ def generate_tenancy_agreement(property_type, rental_type, ref_no, landlord_name
     bold_all("WHEREBY IT IS AGREED as follows:", pdf)
     pdf.ln(10)
 
-    # Detailed clauses for section 1
-    header_text(section1title, pdf, 14)
-    body_text(section1, pdf, 10)
-
-    # Detailed clauses for section 2
-    header_text(section2title, pdf, 14)
-    subheader_text(section2ah, pdf, 10)
-    body_text(section2a, pdf)
-    subheader_text(section2bh, pdf)
-    body_text(section2b, pdf)
-    subheader_text(section2ch, pdf)
-    body_text(section2c, pdf)
-    subheader_text(section2dh, pdf)
-    body_text(section2d, pdf)
-    subheader_text(section2eh, pdf)
-    body_text(section2e, pdf)
-    subheader_text(section2fh, pdf)
-    body_text(section2f, pdf)
-    subheader_text(section2gh, pdf)
-    body_text(section2g, pdf)
-    subheader_text(section2hh, pdf)
-    body_text(section2h, pdf)
-    subheader_text(section2ih, pdf)
-    body_text(section2i, pdf)
-    subheader_text(section2jh, pdf)
-    body_text(section2j, pdf)
-    subheader_text(section2kh, pdf)
-    body_text(section2k, pdf)
-    subheader_text(section2lh, pdf)
-    body_text(section2l, pdf)
-    subheader_text(section2mh, pdf)
-    body_text(section2m, pdf)
-    subheader_text(section2nh, pdf)
-    body_text(section2n, pdf)
-    subheader_text(section2oh, pdf)
-    body_text(section2o, pdf)
-    subheader_text(section2ph, pdf)
-    body_text(section2p, pdf)
-    subheader_text(section2qh, pdf)
-    body_text(section2q, pdf)
-    subheader_text(section2rh, pdf)
-    body_text(section2r, pdf)
-    subheader_text(section2sh, pdf)
-    body_text(section2s, pdf)
-    subheader_text(section2th, pdf)
-    body_text(section2t, pdf)
-    subheader_text(section2uh, pdf)
-    body_text(section2u, pdf)
-    subheader_text(section2vh, pdf)
-    body_text(section2v, pdf)
-    subheader_text(section2wh, pdf)
-    body_text(section2w, pdf)
-    subheader_text(section2xh, pdf)
-    body_text(section2x, pdf)
-    subheader_text(section2yh, pdf)
-    body_text(section2y, pdf)
-    subheader_text(section2zh, pdf)
-    body_text(section2z, pdf)
-    subheader_text(section2aah, pdf)
-    body_text(section2aa, pdf)
-    if property_type != "HDB FLAT":
-        subheader_text(section2abh, pdf)
-        body_text(section2ab, pdf)
-
-    # Detailed clauses for section 3
-    header_text(section3title, pdf, 14)
-    body_text_ns(section3p1, pdf, 10)
-    body_text(section3p2, pdf)
-    subheader_text(section3ah, pdf)
-    body_text(section3a, pdf)
-    subheader_text(section3bh, pdf)
-    body_text(section3b, pdf)
-    subheader_text(section3ch, pdf)
-    body_text(section3c, pdf)
-    subheader_text(section3dh, pdf)
-    body_text(section3d, pdf)
-    subheader_text(section3eh, pdf)
-    body_text(section3e, pdf)
-
-    # Detailed clauses for section 4
-    header_text(section4title, pdf, 14)
-    subheader_text(section4ah, pdf, 10)
-    body_text(section4a, pdf)
-    subheader_text(section4bh, pdf, 10)
-    body_text(section4b, pdf)
-    subheader_text(section4ch, pdf, 10)
-    body_text(section4c, pdf)
-    subheader_text(section4dh, pdf, 10)
-    body_text(section4d, pdf)
-    subheader_text(section4eh, pdf, 10)
-    body_text(section4e, pdf)
-    if rental_type == "1 BEDROOM" or rental_type == "2 BEDROOM":
-        subheader_text(section4fh, pdf, 10)
-        body_text(section4f, pdf)
-        subheader_text(section4gh, pdf, 10)
-        body_text(section4g, pdf)
-
-    # Detailed clauses for section 5
-    header_text(section5title, pdf, 14)
-    subheader_text(section5ah, pdf, 10)
-    body_text(section5a, pdf)
-    subheader_text(section5bh, pdf, 10)
-    body_text(section5b, pdf)
-    subheader_text(section5ch, pdf, 10)
-    body_text(section5c, pdf)
-    subheader_text(section5dh, pdf, 10)
-    body_text(section5d, pdf)
-    subheader_text(section5eh, pdf, 10)
-    body_text(section5e, pdf)
-    subheader_text(section5fh, pdf, 10)
-    body_text(section5f, pdf)
-    subheader_text(section5gh, pdf, 10)
-    body_text(section5g, pdf)
-    subheader_text(section5hh, pdf, 10)
-    body_text(section5h, pdf)
-    subheader_text(section5ih, pdf, 10)
-    body_text(section5i, pdf)
-    subheader_text(section5jh, pdf, 10)
-    body_text(section5j, pdf)
-    subheader_text(section5kh, pdf, 10)
-    body_text(section5k, pdf)
-    subheader_text(section5lh, pdf, 10)
-    body_text(section5l, pdf)
-    subheader_text(section5mh, pdf, 10)
-    body_text(section5m, pdf)
-    subheader_text(section5nh, pdf, 10)
-    body_text(section5n, pdf)
-    subheader_text(section5oh, pdf, 10)
-    body_text(section5o, pdf)
-    if property_type == 'HDB FLAT':
-        subheader_text(section5ph, pdf, 10)
-        body_text(section5p, pdf)
+    # Detailed clauses for sections 1 to 5, rendered from the clause list above
+    current_section = None
+    for section_title, heading, text in clauses:
+        if section_title != current_section:
+            header_text(section_title, pdf, 14)
+            current_section = section_title
+        if section_title == section3title and heading is None:
+            # Section 3's preamble is one record but two paragraphs, the first without spacing after it
+            body_text_ns(section3p1, pdf, 10)
+            body_text(section3p2, pdf)
+            continue
+        if heading:
+            subheader_text(heading, pdf)
+        body_text(text, pdf)
 
     # Signatures and Witness
     pdf.ln(10)
@@ -455,8 +408,8 @@ def generate_tenancy_agreement(property_type, rental_type, ref_no, landlord_name
 
 
     pdf.ln(10)
-    body_text(f"**The Landlord:** Please inspect the original employment or work pass, original travel and identification documents of the prospective foreign tenants.", pdf)
-    body_text(f"**The Tenant:** The Tenant is required to inform the Landlord of any visitors staying in the house from time to time. The Tenant shall be responsible to ensure that the number of Tenants and occupiers shall not exceed the maximum occupants allowed by the authorities.", pdf)
+    body_text(landlord_note, pdf)
+    body_text(tenant_note, pdf)
 
     pdf.line(10, pdf.get_y(), 200, pdf.get_y())
     pdf.ln(5)
@@ -464,4 +417,5 @@ def generate_tenancy_agreement(property_type, rental_type, ref_no, landlord_name
     pdf.write(5, "This document has been anonymized to remove all personally identifiable information (PII) for public release. All names, addresses, contact information, identification numbers, and financial details have been replaced with generic placeholders or fictional information.")
 
     pdf.output(f"tenancy_agreement_{ref_no}.pdf")
-    print(f"Tenancy Agreement PDF generated: tenancy_agreement_{ref_no}.pdf")
\ No newline at end of file
+    print(f"Tenancy Agreement PDF generated: tenancy_agreement_{ref_no}.pdf")
+    return records
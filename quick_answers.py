@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+from partitions import normalize_tenant_key
+
+# Canned questions offered as buttons in the Streamlit sidebar, with the route expected to answer each
+QUICK_QUESTIONS = {
+    "When is my rent due?": "information_retrieval",
+    "How long is the defect free period?": "information_retrieval",
+    "Can I keep pets?": "information_retrieval",
+    "Who has to pay for repairs?": "information_retrieval",
+}
+# Seconds between checks for a new knowledge base version or property database
+QUICK_REFRESH_INTERVAL = 60
+# Version of a question not answered yet; differs from every data version, including None
+_MISSING = object()
+
+
+class QuickAnswers:
+    """Answers to a fixed set of questions, computed ahead of time and refreshed in the background.
+
+    start() launches a daemon thread that answers every question through the
+    bot for each known tenant, then every `interval` seconds picks up a newly
+    published knowledge base and recomputes the answers whose route's data
+    version changed. Only answers produced by the question's expected route
+    are stored; fallback and error replies, or answers from another route (e.g.
+    after a classification timeout), are retried on the next check. get()
+    never calls the LLM: it returns the stored answer, or None while a question
+    has not been answered yet, in which case the caller answers it live.
+    Answers stay available while they are being recomputed and are swapped in
+    one at a time as they finish.
+    """
+
+    def __init__(self, bot, questions=None, tenants=(None,), interval=QUICK_REFRESH_INTERVAL):
+        self.bot = bot
+        # question -> route expected to answer it
+        self.routes = dict(questions or QUICK_QUESTIONS)
+        self.questions = list(self.routes)
+        self.tenants = set(normalize_tenant_key(tenant) for tenant in tenants)
+        self.interval = interval
+        # (question, tenant key) -> answer, and the version of its route's data it was computed on
+        self.answers = {}
+        self.versions = {}
+        self.refreshes = 0
+        self.last_refresh_seconds = None
+        self._failed = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_tenant(self, tenant_id):
+        """Answer the questions for a tenant from now on, starting in the background if it is new"""
+        key = normalize_tenant_key(tenant_id)
+        with self._lock:
+            if key in self.tenants:
+                return
+            self.tenants.add(key)
+        self._wake.set()
+
+    def get(self, question, tenant_id=None):
+        """Stored answer to one of the questions, or None if it is not ready (or not one of them)"""
+        with self._lock:
+            answer = self.answers.get((question, normalize_tenant_key(tenant_id)))
+        if answer is None and question in self.questions:
+            self.add_tenant(tenant_id)
+        return answer
+
+    def ready(self, tenant_id=None):
+        """Number of questions with a stored answer for a tenant"""
+        key = normalize_tenant_key(tenant_id)
+        with self._lock:
+            return sum((question, key) in self.answers for question in self.questions)
+
+    def refresh(self, force=False):
+        """Answer every question still missing for a tenant, or whose route's data changed since it was answered"""
+        self.bot.refresh_knowledge_base()
+        versions = self.bot.data_versions()
+        with self._lock:
+            pending = [
+                (question, tenant) for tenant in self.tenants for question in self.questions
+                if force or (question, tenant) in self._failed
+                or self.versions.get((question, tenant), _MISSING) != versions.get(self.routes[question])
+            ]
+        if not pending:
+            return 0
+        start = time.perf_counter()
+        for question, tenant in pending:
+            route = self.routes[question]
+            version = versions.get(route)
+            answer, answered_by = asyncio.run(self.bot.answer_query_async(question, tenant))
+            with self._lock:
+                if answered_by != route:
+                    # Keep serving the previous answer, if any, and try again on the next check
+                    self._failed.add((question, tenant))
+                else:
+                    self._failed.discard((question, tenant))
+                    self.answers[(question, tenant)] = answer
+                    self.versions[(question, tenant)] = version
+        with self._lock:
+            self.refreshes += 1
+            self.last_refresh_seconds = time.perf_counter() - start
+        print(f"⚡ Quick answers: {len(pending)} computed in {self.last_refresh_seconds:.1f}s")
+        return len(pending)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"❌ Quick answer refresh error: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self):
+        """Warm the answers and keep them current in a daemon thread; returns self"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="quick-answers", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
@@ -0,0 +1,510 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import warnings
+import multiprocessing
+
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from knowledge_base import DB_PATH
+from kb_versions import current_version_path
+
+# Suppress warnings
+warnings.filterwarnings('ignore')
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def latency_summary(latencies):
+    """p50 / p95 of a list of latencies in seconds, reported in milliseconds"""
+    latencies = np.asarray(latencies) * 1000
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95))}
+
+
+def open_chroma(db_path):
+    """Open a persisted Chroma store without an embedding function (searches use raw vectors)"""
+    from langchain_community.vectorstores import Chroma
+    return Chroma(persist_directory=db_path)
+
+
+def build_synthetic_store(n_chunks, dim, seed=0):
+    """Create a temporary Chroma store filled with random unit vectors"""
+    db_path = tempfile.mkdtemp(prefix="kb_bench_")
+    vectors = np.random.default_rng(seed).standard_normal((n_chunks, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectorstore = open_chroma(db_path)
+    for start in range(0, n_chunks, 1000):
+        end = min(start + 1000, n_chunks)
+        vectorstore._collection.add(
+            ids=[f"chunk-{i}" for i in range(start, end)],
+            embeddings=vectors[start:end].tolist(),
+            documents=[f"synthetic chunk {i}" for i in range(start, end)],
+            metadatas=[{"page": i} for i in range(start, end)],
+        )
+    return db_path
+
+
+def queries_near(stored, n_queries, noise=0.3, seed=1):
+    """Unit query vectors made by adding noise to randomly chosen rows of a matrix"""
+    rng = np.random.default_rng(seed)
+    picks = np.asarray(stored[np.sort(rng.integers(0, len(stored), n_queries))], dtype=np.float32)
+    queries = picks + noise * rng.standard_normal(picks.shape).astype(np.float32) / np.sqrt(picks.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def make_query_vectors(db_path, n_queries, noise=0.3, seed=1):
+    """Queries near randomly chosen stored chunks, so no embedding API is needed"""
+    stored = np.asarray(open_chroma(db_path).get(include=["embeddings"])["embeddings"], dtype=np.float32)
+    return queries_near(stored, n_queries, noise, seed)
+
+
+def _run_backend(backend, db_path, query_vectors, k, results):
+    """Load one backend and time its searches (runs in a fresh process for a clean RSS reading)"""
+    from retrievers import NumpyVectorIndex
+
+    warnings.filterwarnings('ignore')
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    if backend == "chroma":
+        vectorstore = open_chroma(db_path)
+
+        def search(query_vector):
+            return vectorstore.similarity_search_by_vector(query_vector.tolist(), k=k)
+    else:
+        index = NumpyVectorIndex.from_chroma(open_chroma(db_path))
+
+        def search(query_vector):
+            indices, _ = index.search(query_vector, k)
+            return [index.document(i) for i in indices[0]]
+    search(query_vectors[0])
+    load_seconds = time.perf_counter() - start
+
+    latencies = []
+    for query_vector in query_vectors:
+        t = time.perf_counter()
+        search(query_vector)
+        latencies.append(time.perf_counter() - t)
+
+    result = {"backend": backend, "load_s": load_seconds, **latency_summary(latencies)}
+    if backend == "numpy":
+        # Batched queries: one matrix-matrix product for the whole set
+        t = time.perf_counter()
+        index.search(query_vectors, k)
+        result["batch_qps"] = len(query_vectors) / (time.perf_counter() - t)
+    result["rss_mb"] = current_rss_mb() - rss_before
+    results.put(result)
+
+
+def compare_backends(db_path, query_vectors, k=3, backends=("chroma", "numpy")):
+    """Run each backend in its own process and collect latency and memory figures"""
+    from retrievers import NumpyVectorIndex
+
+    # Build the NumPy index up front so the benchmark measures loading it, not creating it
+    NumpyVectorIndex.from_chroma(open_chroma(db_path))
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for backend in backends:
+        results = context.Queue()
+        process = context.Process(target=_run_backend, args=(backend, db_path, query_vectors, k, results))
+        process.start()
+        rows.append(results.get())
+        process.join()
+    return rows
+
+
+# (reduction, dim, dtype) configurations compared by the quantization report
+QUANTIZATION_CONFIGS = [
+    ("none", None, "float16"), ("none", None, "int8"),
+    ("pca", 256, "int8"), ("pca", 128, "int8"), ("pca", 64, "int8"),
+    ("random", 256, "int8"), ("random", 128, "int8"),
+]
+
+
+def quantization_report(db_path, query_vectors, configs=QUANTIZATION_CONFIGS, k=3, candidates=None):
+    """recall@k of each compressed index against the exact float32 index, before and after rescoring.
+
+    Recall is the share of returned chunks that belong to the exact top-k; a chunk
+    tied with the exact k-th score counts, as duplicate chunks have equal vectors.
+    "codes" ranks by the compressed scores alone, "rescored" re-ranks the best
+    candidates with the float32 vectors as the retriever does.
+    """
+    from retrievers import RESCORE_CANDIDATES, NumpyVectorIndex, QuantizedVectorIndex, normalize_rows, top_k
+
+    candidates = candidates or RESCORE_CANDIDATES
+    vectorstore = open_chroma(db_path)
+    exact_path = tempfile.mkdtemp(prefix="kb_exact_")
+    exact = NumpyVectorIndex.from_chroma(vectorstore, exact_path)
+    query_vectors = normalize_rows(query_vectors)
+    _, exact_scores = exact.search(query_vectors, k)
+    position = {chunk_id: i for i, chunk_id in enumerate(exact.ids)}
+
+    def recall(index, indices):
+        hits = []
+        for query_vector, row, scores in zip(query_vectors, indices, exact_scores):
+            found = np.asarray(exact.vectors[[position[index.ids[i]] for i in row]]) @ query_vector
+            hits.append(np.mean(found >= scores[-1] - 1e-6))
+        return float(np.mean(hits))
+
+    rows = []
+    for reduction, dim, dtype in configs:
+        index_path = tempfile.mkdtemp(prefix="kb_quantized_")
+        try:
+            start = time.perf_counter()
+            index = QuantizedVectorIndex.from_chroma(vectorstore, index_path, reduction=reduction,
+                                                     dim=dim or exact.vectors.shape[1], dtype=dtype)
+            index.candidates = candidates
+            build_seconds = time.perf_counter() - start
+            codes_only, _ = top_k(index.approximate_scores(query_vectors), k)
+            latencies = []
+            rescored = []
+            for query_vector in query_vectors:
+                t = time.perf_counter()
+                indices, _ = index.search(query_vector, k)
+                latencies.append(time.perf_counter() - t)
+                rescored.append(indices[0])
+            rows.append({
+                "config": f"{reduction}{dim or ''}/{dtype}",
+                "dims": index.codes.shape[1],
+                "codes_mb": index.codes.nbytes / 2**20,
+                "compression": exact.vectors.nbytes / max(index.codes.nbytes, 1),
+                "recall_codes": recall(index, codes_only),
+                "recall_rescored": recall(index, rescored),
+                "build_s": build_seconds,
+                **latency_summary(latencies),
+            })
+        finally:
+            shutil.rmtree(index_path, ignore_errors=True)
+    shutil.rmtree(exact_path, ignore_errors=True)
+    return rows
+
+
+def print_quantization_rows(rows, k=3):
+    print(f"{'config':<16}{'dims':>6}{'codes MB':>10}{'ratio':>8}{f'R@{k} codes':>12}{f'R@{k} rescored':>15}"
+          f"{'p50 ms':>9}{'p95 ms':>9}")
+    for row in rows:
+        print(f"{row['config']:<16}{row['dims']:>6}{row['codes_mb']:>10.3f}{row['compression']:>7.1f}x"
+              f"{row['recall_codes']:>12.3f}{row['recall_rescored']:>15.3f}{row['p50_ms']:>9.3f}{row['p95_ms']:>9.3f}")
+
+
+HIERARCHICAL_SECTIONS = [1, 2, 3, 5]
+
+
+def hierarchical_report(db_path, query_vectors, k=3, section_counts=HIERARCHICAL_SECTIONS, questions=None,
+                        answers=None):
+    """Flat exact top-k against section-then-chunk search for each number of searched sections.
+
+    rows scored is the average number of section and chunk vectors a query is
+    scored against; context tokens is the size of the k chunks handed to the
+    "stuff" chain; overlap is the share of the flat top-k also returned. With
+    reference answers, coverage is the share of each answer's terms found in
+    the retrieved chunks. With the questions, each searches the sections of the
+    property types it names as the hierarchical retriever does.
+    """
+    from embeddings import count_tokens
+    from embedding_benchmark import answer_coverage
+    from partitions import detect_property_types
+    from retrievers import HierarchicalIndex, NumpyVectorIndex, normalize_rows
+
+    vectorstore = open_chroma(db_path)
+    work_path = tempfile.mkdtemp(prefix="kb_sections_")
+    try:
+        chunks = NumpyVectorIndex.from_chroma(vectorstore, os.path.join(work_path, "chunks"))
+        hierarchical = HierarchicalIndex.build(os.path.join(work_path, "sections"), chunks)
+        query_vectors = normalize_rows(query_vectors)
+        if questions:
+            property_types = [detect_property_types(question) for question in questions]
+        else:
+            property_types = [[]] * len(query_vectors)
+        tokens = {}
+
+        def measure(name, search, rows_scored):
+            latencies, rankings = [], []
+            for query_vector, types in zip(query_vectors, property_types):
+                t = time.perf_counter()
+                indices, _ = search(query_vector, types)
+                latencies.append(time.perf_counter() - t)
+                rankings.append(list(indices[0]))
+            for ranking in rankings:
+                for i in ranking:
+                    if i not in tokens:
+                        tokens[i] = count_tokens(chunks.texts[i])
+            row = {
+                "config": name,
+                "rows_scored": rows_scored,
+                "context_tokens": float(np.mean([sum(tokens[i] for i in ranking) for ranking in rankings])),
+                "rankings": rankings,
+                **latency_summary(latencies),
+            }
+            if answers is not None:
+                row["coverage"] = float(np.mean([
+                    answer_coverage(answer, [chunks.texts[i] for i in ranking])
+                    for answer, ranking in zip(answers, rankings)
+                ]))
+            return row
+
+        rows = [measure("flat", lambda query_vector, types: chunks.search(query_vector, k), len(chunks))]
+        for n_sections in section_counts:
+            hierarchical.n_sections = n_sections
+            scored = np.mean([len(hierarchical.candidate_rows(query_vector, k, types))
+                              for query_vector, types in zip(query_vectors, property_types)])
+            rows.append(measure(f"sections={n_sections}",
+                                lambda query_vector, types: hierarchical.search(query_vector, k, types),
+                                len(hierarchical.sections) + scored))
+        flat_rankings = rows[0]["rankings"]
+        for row in rows:
+            row["overlap"] = float(np.mean([len(set(a) & set(b)) / k
+                                            for a, b in zip(row.pop("rankings"), flat_rankings)]))
+        return rows
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+
+
+def print_hierarchical_rows(rows, k=3):
+    coverage = "coverage" in rows[0]
+    print(f"{'config':<12}{'rows scored':>12}{f'ctx tok@{k}':>11}{'overlap':>9}{'coverage' if coverage else '':>10}"
+          f"{'p50 ms':>9}{'p95 ms':>9}")
+    for row in rows:
+        print(f"{row['config']:<12}{row['rows_scored']:>12.0f}{row['context_tokens']:>11.0f}{row['overlap']:>9.3f}"
+              f"{format(row['coverage'], '.3f') if coverage else '':>10}{row['p50_ms']:>9.3f}{row['p95_ms']:>9.3f}")
+
+
+# (lambda_mult, pool size) configurations compared by the MMR report
+MMR_CONFIGS = [(0.7, 10), (0.5, 10), (0.5, 20), (0.3, 20), (0.5, 50)]
+# Returned chunks at least this similar to a better-ranked one count as redundant context
+REDUNDANT_SIMILARITY = 0.95
+
+
+def mmr_report(db_path, query_vectors, k=3, configs=MMR_CONFIGS, answers=None):
+    """Plain top-k against MMR re-ranking of a candidate pool for each (lambda, pool size).
+
+    Both search the exact NumPy index, so the latency difference is the cost of
+    the larger pool plus the MMR selection. Redundant tokens are those of
+    returned chunks nearly identical (cosine >= REDUNDANT_SIMILARITY) to a chunk
+    ranked above them, i.e. context the LLM pays for twice; coverage (with
+    reference answers) is the share of each answer's terms in the chunks.
+    """
+    from embeddings import count_tokens
+    from embedding_benchmark import answer_coverage
+    from retrievers import NumpyVectorIndex, mmr_select, normalize_rows
+
+    vectorstore = open_chroma(db_path)
+    index_path = tempfile.mkdtemp(prefix="kb_mmr_")
+    try:
+        index = NumpyVectorIndex.from_chroma(vectorstore, index_path)
+        query_vectors = normalize_rows(query_vectors)
+        tokens = {}
+
+        def search_top_k(query_vector, pool, lambda_mult):
+            indices, _ = index.search(query_vector, k)
+            return list(indices[0])
+
+        def search_mmr(query_vector, pool, lambda_mult):
+            indices, _ = index.search(query_vector, pool)
+            picked, _ = mmr_select(query_vector, np.asarray(index.vectors[indices[0]]), k, lambda_mult)
+            return [indices[0][i] for i in picked]
+
+        rows = []
+        for name, search, pool, lambda_mult in [("top-k", search_top_k, k, 1.0)] + [
+                (f"mmr l={lambda_mult} pool={pool}", search_mmr, pool, lambda_mult) for lambda_mult, pool in configs]:
+            latencies, rankings = [], []
+            for query_vector in query_vectors:
+                t = time.perf_counter()
+                rankings.append(search(query_vector, pool, lambda_mult))
+                latencies.append(time.perf_counter() - t)
+            context, redundant = [], []
+            for ranking in rankings:
+                for i in ranking:
+                    if i not in tokens:
+                        tokens[i] = count_tokens(index.texts[i])
+                vectors = np.asarray(index.vectors[ranking], dtype=np.float32)
+                similarity = vectors @ vectors.T
+                repeats = [i for rank, i in enumerate(ranking)
+                           if rank and similarity[rank, :rank].max() >= REDUNDANT_SIMILARITY]
+                context.append(sum(tokens[i] for i in ranking))
+                redundant.append(sum(tokens[i] for i in repeats))
+            row = {
+                "config": name,
+                "context_tokens": float(np.mean(context)),
+                "redundant_tokens": float(np.mean(redundant)),
+                **latency_summary(latencies),
+            }
+            if answers is not None:
+                row["coverage"] = float(np.mean([
+                    answer_coverage(answer, [index.texts[i] for i in ranking])
+                    for answer, ranking in zip(answers, rankings)
+                ]))
+            rows.append(row)
+        return rows
+    finally:
+        shutil.rmtree(index_path, ignore_errors=True)
+
+
+def print_mmr_rows(rows, k=3):
+    coverage = "coverage" in rows[0]
+    base = rows[0]
+    print(f"{'config':<22}{f'ctx tok@{k}':>11}{'redundant':>11}{'saved/answer':>14}{'coverage' if coverage else '':>10}"
+          f"{'p50 ms':>9}{'overhead':>10}")
+    for row in rows:
+        saved = base["redundant_tokens"] - row["redundant_tokens"]
+        print(f"{row['config']:<22}{row['context_tokens']:>11.0f}{row['redundant_tokens']:>11.0f}{saved:>14.0f}"
+              f"{format(row['coverage'], '.3f') if coverage else '':>10}{row['p50_ms']:>9.3f}"
+              f"{row['p50_ms'] - base['p50_ms']:>+10.3f}")
+
+
+# (token budget, score cutoff, trim) configurations compared by the packing report; None disables the cutoff
+PACKING_CONFIGS = [(350, None, True), (350, None, False), (250, None, True), (350, 0.85, True), (350, 0.7, True),
+                   (350, 0.5, True), (100000, None, True)]
+
+
+def packing_report(db_path, query_vectors, questions, answers, k=3, configs=PACKING_CONFIGS, fetch_k=None):
+    """Prompt tokens and answer coverage of the top-k chunks against context packing for each configuration.
+
+    Each question retrieves fetch_k chunks (PACK_FETCH_K by default) from the exact
+    NumPy index with their cosine scores; "top-k" stuffs the first k whole, as
+    the chain does without packing, and every other row packs all of them with a
+    ContextPacker. Tokens are counted with the chat model's encoding; saved is
+    per query against top-k, and coverage is the share of each reference answer's
+    terms left in the context. Pack time excludes retrieval.
+    """
+    from langchain_core.documents import Document
+    from context_packer import LLM_MODEL, PACK_FETCH_K, ContextPacker
+    from embeddings import count_tokens
+    from embedding_benchmark import answer_coverage
+    from retrievers import NumpyVectorIndex
+
+    vectorstore = open_chroma(db_path)
+    index_path = tempfile.mkdtemp(prefix="kb_packing_")
+    try:
+        index = NumpyVectorIndex.from_chroma(vectorstore, index_path)
+        indices, scores = index.search(query_vectors, fetch_k or PACK_FETCH_K)
+        retrieved = [
+            [Document(page_content=index.texts[i], metadata={"score": float(score)}) for i, score in zip(row, row_scores)]
+            for row, row_scores in zip(indices, scores)
+        ]
+        baseline = [docs[:k] for docs in retrieved]
+        baseline_tokens = [sum(count_tokens(doc.page_content, LLM_MODEL) for doc in docs) for docs in baseline]
+        rows = [{
+            "config": f"top-{k}",
+            "chunks": float(np.mean([len(docs) for docs in baseline])),
+            "tokens": float(np.mean(baseline_tokens)),
+            "saved": 0.0,
+            "coverage": float(np.mean([answer_coverage(answer, [doc.page_content for doc in docs])
+                                       for answer, docs in zip(answers, baseline)])),
+            "p50_ms": 0.0,
+        }]
+        for budget, cutoff, trim in configs:
+            packer = ContextPacker(budget, cutoff, trim)
+            packed, latencies = [], []
+            for question, docs in zip(questions, retrieved):
+                t = time.perf_counter()
+                packed.append(packer.pack(question, docs, k)[0])
+                latencies.append(time.perf_counter() - t)
+            summary = packer.summary()
+            rows.append({
+                "config": f"budget={budget} cutoff={cutoff}{' trim' if trim else ''}",
+                "chunks": summary["chunks_per_query"],
+                "tokens": summary["tokens_per_query"],
+                "saved": summary["saved_per_query"],
+                "coverage": float(np.mean([answer_coverage(answer, [doc.page_content for doc in docs])
+                                           for answer, docs in zip(answers, packed)])),
+                "p50_ms": latency_summary(latencies)["p50_ms"],
+            })
+        return rows
+    finally:
+        shutil.rmtree(index_path, ignore_errors=True)
+
+
+def print_packing_rows(rows):
+    print(f"{'config':<32}{'chunks':>8}{'ctx tokens':>12}{'saved/query':>13}{'coverage':>10}{'pack ms':>9}")
+    for row in rows:
+        print(f"{row['config']:<32}{row['chunks']:>8.2f}{row['tokens']:>12.0f}{row['saved']:>13.0f}"
+              f"{row['coverage']:>10.3f}{row['p50_ms']:>9.3f}")
+
+
+def print_rows(rows):
+    print(f"{'backend':<10}{'load s':>9}{'p50 ms':>9}{'p95 ms':>9}{'batch q/s':>11}{'RSS +MB':>9}")
+    for row in rows:
+        batch = f"{row['batch_qps']:.0f}" if "batch_qps" in row else "-"
+        print(f"{row['backend']:<10}{row['load_s']:>9.3f}{row['p50_ms']:>9.3f}{row['p95_ms']:>9.3f}"
+              f"{batch:>11}{row['rss_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare latency and memory of the PDF retriever backends")
+    parser.add_argument("--db", help="persisted Chroma DB to benchmark (defaults to the live version)")
+    parser.add_argument("--synthetic", type=int, default=0, help="benchmark N random chunks instead of --db")
+    parser.add_argument("--dim", type=int, default=1536, help="embedding size for --synthetic")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--quantization", action="store_true",
+                        help="report recall of the compressed index modes against the exact index instead")
+    parser.add_argument("--hierarchical", action="store_true",
+                        help="compare flat top-k with section-then-chunk search instead")
+    parser.add_argument("--mmr", action="store_true",
+                        help="compare plain top-k with MMR re-ranking (redundant context, latency) instead")
+    parser.add_argument("--packing", action="store_true",
+                        help="compare stuffing the top-k chunks with token-budgeted context packing instead "
+                             "(needs --qa)")
+    parser.add_argument("--qa", help="QA pair CSV whose questions are the queries of the --quantization, "
+                                     "--hierarchical, --mmr and --packing reports (embedded with the store's "
+                                     "local model if it has one, else cached OpenAI)")
+    args = parser.parse_args()
+
+    db_path = build_synthetic_store(args.synthetic, args.dim) if args.synthetic else (
+        args.db or current_version_path() or DB_PATH)
+    try:
+        # Search time only: both backends receive the same precomputed query vectors,
+        # so the (identical) query embedding call of as_retriever(k=3) is left out
+        questions, answers = None, None
+        if args.qa:
+            from embeddings import LOCAL_EMBEDDINGS_FILE, CachedEmbeddings, LocalEmbeddings
+            from embedding_benchmark import load_qa_pairs
+            from ingestion_benchmark import load_questions
+
+            if args.hierarchical or args.mmr or args.packing:
+                questions, answers = map(list, zip(*load_qa_pairs(args.qa)))
+            else:
+                questions = load_questions(args.qa)
+            local_path = os.path.join(db_path, LOCAL_EMBEDDINGS_FILE)
+            if os.path.exists(local_path):
+                embedder = LocalEmbeddings.load(local_path)
+            else:
+                from langchain_openai import OpenAIEmbeddings
+
+                embedder = CachedEmbeddings(OpenAIEmbeddings())
+            query_vectors = np.asarray(embedder.embed_documents(questions))
+        else:
+            query_vectors = make_query_vectors(db_path, args.queries)
+        print(f"📊 {len(query_vectors)} queries, k={args.k}, store: {db_path}")
+        if args.quantization:
+            print_quantization_rows(quantization_report(db_path, query_vectors, k=args.k), args.k)
+        elif args.packing:
+            if answers is None:
+                parser.error("--packing needs --qa")
+            print_packing_rows(packing_report(db_path, query_vectors, questions, answers, args.k))
+        elif args.mmr:
+            print_mmr_rows(mmr_report(db_path, query_vectors, args.k, answers=answers), args.k)
+        elif args.hierarchical:
+            rows = hierarchical_report(db_path, query_vectors, args.k, questions=questions, answers=answers)
+            print_hierarchical_rows(rows, args.k)
+        else:
+            print_rows(compare_backends(db_path, query_vectors, args.k))
+    finally:
+        if args.synthetic:
+            shutil.rmtree(db_path, ignore_errors=True)
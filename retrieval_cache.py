@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from embeddings import embedding_model_name, normalize_text
+from knowledge_base import CACHE_DIR
+from partitions import query_filter
+
+# SQLite file the retrieval cache is written through to, so a restarted bot starts warm
+RETRIEVAL_CACHE_PATH = os.path.join(CACHE_DIR, "retrieval_cache.sqlite3")
+# Most query embeddings and search results held at once (least recently used are evicted first)
+QUERY_CACHE_SIZE = 2048
+RESULT_CACHE_SIZE = 1024
+# Seconds an entry stays valid; results also go as soon as the knowledge base version changes
+QUERY_TTL = 7 * 24 * 3600
+RESULT_TTL = 6 * 3600
+# embed_documents calls with at most this many texts are queries (NumpyRetriever batches) and are cached
+QUERY_BATCH_MAX = 8
+
+
+class LRUCache:
+    """Thread-safe least-recently-used map whose entries expire after `ttl` seconds.
+
+    Each entry carries a tag (for search results, the knowledge base version it
+    was computed on) so invalidate() can drop everything computed on another
+    version. With persist_path, entries are written through to a SQLite table as
+    they are added and the newest max_entries are loaded back on start; values
+    must be JSON-serializable.
+    """
+
+    def __init__(self, name, max_entries, ttl=None, persist_path=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (created, tag, value), least recently used first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.invalidated = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if persist_path:
+            os.makedirs(os.path.dirname(persist_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(persist_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {name} ("
+                               "key TEXT PRIMARY KEY, tag TEXT, created REAL NOT NULL, value TEXT NOT NULL)")
+            self._conn.commit()
+            self._load()
+
+    def _load(self):
+        cutoff = time.time() - self.ttl if self.ttl else 0
+        rows = self._conn.execute(f"SELECT key, tag, created, value FROM {self.name} WHERE created >= ? "
+                                  "ORDER BY created DESC LIMIT ?", (cutoff, self.max_entries)).fetchall()
+        for key, tag, created, value in reversed(rows):
+            self.entries[key] = (created, tag, json.loads(value))
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key):
+        """Cached value for a key, or None if it is missing or has expired"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self.entries[key]
+                if self._conn is not None:
+                    self._conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value, tag=None):
+        with self._lock:
+            created = time.time()
+            self.entries[key] = (created, tag, value)
+            self.entries.move_to_end(key)
+            evicted = []
+            while len(self.entries) > self.max_entries:
+                evicted.append(self.entries.popitem(last=False)[0])
+            self.evictions += len(evicted)
+            if self._conn is not None:
+                self._conn.execute(f"INSERT OR REPLACE INTO {self.name} VALUES (?, ?, ?, ?)",
+                                   (key, tag, created, json.dumps(value)))
+                self._conn.executemany(f"DELETE FROM {self.name} WHERE key = ?", [(key,) for key in evicted])
+                self._conn.commit()
+
+    def invalidate(self, current_tag):
+        """Drop every entry tagged with anything but current_tag; returns how many were dropped"""
+        with self._lock:
+            stale = [key for key, (_, tag, _) in self.entries.items() if tag != current_tag]
+            for key in stale:
+                del self.entries[key]
+            self.invalidated += len(stale)
+            if self._conn is not None:
+                self._conn.execute(f"DELETE FROM {self.name} WHERE tag IS NOT ?", (current_tag,))
+                self._conn.commit()
+        return len(stale)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """Hit rate and evictions since this cache was created"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "invalidated": self.invalidated,
+        }
+
+
+class QueryEmbeddingCache(Embeddings):
+    """Embeddings wrapper answering repeated queries from an in-process LRU.
+
+    Keys are the model name plus the query text with whitespace, unicode forms
+    and case normalized, so "Who replaces the light bulbs?" and "who replaces
+    the  light bulbs?" are embedded once. Documents (knowledge base builds) go
+    straight to the wrapped embeddings; batches of up to QUERY_BATCH_MAX texts
+    are taken to be queries.
+    """
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = getattr(embeddings, "model_name", None) or embedding_model_name(embeddings)
+
+    def cache_key(self, text):
+        return hashlib.sha256(f"{self.model}\x00{normalize_text(text).casefold()}".encode("utf-8")).hexdigest()
+
+    def embed_query(self, text):
+        key = self.cache_key(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = [float(value) for value in self.embeddings.embed_query(text)]
+            self.cache.put(key, vector)
+        return vector
+
+    def embed_documents(self, texts):
+        if len(texts) > QUERY_BATCH_MAX:
+            return self.embeddings.embed_documents(texts)
+        return [self.embed_query(text) for text in texts]
+
+
+def query_fingerprint(query_vector):
+    """Short hash of a query embedding"""
+    return hashlib.sha256(np.asarray(query_vector, dtype=np.float32).tobytes()).hexdigest()[:32]
+
+
+class RetrievalCache:
+    """Two-layer cache in front of the PDF retrievers.
+
+    The first layer maps normalized query text to its embedding; the second maps
+    (embedding fingerprint, knowledge base version, partition filter, retriever
+    configuration) to the top-k chunks the search returned, stored with their
+    IDs, text and metadata so a hit needs neither an embedding call nor a vector
+    search. Both layers evict by size and TTL. set_version() drops the results
+    of every other version as soon as the bot switches to a new build.
+    """
+
+    def __init__(self, version=None, persist_path=None, query_size=QUERY_CACHE_SIZE, result_size=RESULT_CACHE_SIZE,
+                 query_ttl=QUERY_TTL, result_ttl=RESULT_TTL):
+        self.version = version
+        self.queries = LRUCache("query_embeddings", query_size, query_ttl, persist_path)
+        self.results = LRUCache("results", result_size, result_ttl, persist_path)
+        self.results.invalidate(version)
+
+    def wrap(self, embeddings):
+        """Embeddings that serve repeated queries from the first layer"""
+        return QueryEmbeddingCache(embeddings, self.queries)
+
+    def set_version(self, version):
+        """Switch to a knowledge base version, dropping results computed on any other"""
+        if version != self.version:
+            self.version = version
+            dropped = self.results.invalidate(version)
+            if dropped:
+                print(f"🧹 Retrieval cache: dropped {dropped} results of the previous knowledge base version")
+
+    def result_key(self, query_vector, where=None, scope=""):
+        key = [query_fingerprint(query_vector), self.version, where, scope]
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Cached Documents for a result key, or None"""
+        entries = self.results.get(key)
+        if entries is None:
+            return None
+        return [Document(page_content=entry["text"], metadata=dict(entry["metadata"])) for entry in entries]
+
+    def put(self, key, docs):
+        entries = [{"id": doc.metadata.get("id"), "text": doc.page_content, "metadata": doc.metadata} for doc in docs]
+        self.results.put(key, entries, self.version)
+
+    def stats(self):
+        """Hit rates of both layers"""
+        return {"queries": self.queries.stats(), "results": self.results.stats()}
+
+
+class CachedRetriever(BaseRetriever):
+    """Retriever returning the cached chunks of a repeated query instead of searching again.
+
+    `embeddings` should be the QueryEmbeddingCache the wrapped retriever's store
+    queries with, so the embedding computed for the cache key is the one the
+    search reuses on a miss. `scope` names the retriever configuration (backend,
+    k, tenant) so different retrievers never share results.
+    """
+
+    retriever: Any
+    cache: Any
+    embeddings: Any
+    scope: str = ""
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        key = self.cache.result_key(self.embeddings.embed_query(query), query_filter(query), self.scope)
+        docs = self.cache.get(key)
+        if docs is not None:
+            print(f"⚡ Retrieval cache hit ({len(docs)} chunks)")
+            return docs
+        docs = self.retriever.invoke(query)
+        self.cache.put(key, docs)
+        return docs
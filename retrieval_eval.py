@@ -0,0 +1,226 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import warnings
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from chunking import SECTION_RE, SUBCLAUSE_RE
+from clauses import heading_key
+from embeddings import LOCAL_EMBEDDINGS_FILE, LocalEmbeddings
+from knowledge_base import chunking_params, folder_chunk_texts, sync_knowledge_base
+from retrieval_benchmark import current_rss_mb, latency_summary
+
+# Suppress warnings
+warnings.filterwarnings('ignore')
+
+PDF_FOLDER = "property_data_generator"
+# Questions labelled with the clauses that answer them; the first rows are the
+# document questions of qa_pair_for_testing_v2.csv, the rest cover further clauses
+GOLD_PATH = "question_answer_pair/retrieval_gold.csv"
+CHUNKERS = ["clause", "recursive"]
+BACKENDS = ["chroma", "numpy", "quantized", "hierarchical", "hybrid", "partitioned", "mmr"]
+# (clause lookup, context packing) variants run on every backend; the chatbot uses both
+VARIANTS = [(False, False), (True, False), (True, True)]
+CUTOFFS = [1, 3, 5]
+
+
+def load_gold(gold_path=GOLD_PATH):
+    """Labelled questions: the normalized headings of their gold clauses and the property type they are about"""
+    data = pd.read_csv(gold_path).fillna("")
+    return [
+        {
+            "question": question,
+            "clauses": set(heading_key(clause) for clause in clauses.split(";") if clause.strip()),
+            "property_type": property_type or None,
+        }
+        for question, clauses, property_type in zip(data["question"], data["gold_clauses"], data["property_type"])
+    ]
+
+
+def chunk_clauses(doc):
+    """Normalized headings of the clauses a retrieved chunk holds.
+
+    Taken from the heading and section the clause splitter records, and from
+    the heading lines in the text, so recursive chunks spanning several clauses
+    count for each of them.
+    """
+    titles = [doc.metadata.get("heading") or ""]
+    section = SECTION_RE.match(doc.metadata.get("section") or "")
+    if section:
+        titles.append(section.group(2))
+    for line in doc.page_content.splitlines():
+        match = SUBCLAUSE_RE.match(line) or SECTION_RE.match(line)
+        if match:
+            titles.append(match.group(2))
+    return set(heading_key(title) for title in titles if title) - {""}
+
+
+def gold_hits(doc, item):
+    """Gold clauses of a labelled question found in a retrieved chunk.
+
+    Questions about one property type only count chunks of that type, so the
+    condominium pets clause does not answer a question about landed houses.
+    """
+    if item["property_type"] and not doc.metadata.get(f"pt_{item['property_type']}"):
+        return set()
+    return chunk_clauses(doc) & item["clauses"]
+
+
+def score_ranking(docs, item, cutoffs=CUTOFFS):
+    """recall@k for each cutoff and the reciprocal rank of the first relevant chunk"""
+    hits = [gold_hits(doc, item) for doc in docs]
+    scores = {f"recall@{k}": len(set().union(*hits[:k])) / len(item["clauses"]) for k in cutoffs}
+    first = next((rank for rank, found in enumerate(hits, start=1) if found), None)
+    scores["rr"] = 1 / first if first else 0.0
+    return scores
+
+
+def build_store(pdf_folder, splitter, db_path):
+    """Sync a folder into a new Chroma store split by one chunker and embedded with a fitted local model"""
+    from langchain_community.vectorstores import Chroma
+
+    embeddings = LocalEmbeddings().fit(folder_chunk_texts(pdf_folder, chunking_params(splitter)))
+    vectorstore = Chroma(persist_directory=db_path, embedding_function=embeddings)
+    sync_knowledge_base(pdf_folder, vectorstore, db_path,
+                        params=chunking_params(splitter, embedding_model=embeddings.model))
+    embeddings.save(os.path.join(db_path, LOCAL_EMBEDDINGS_FILE))
+    return db_path
+
+
+def open_store(db_path):
+    """Open a store with the embeddings its chunks were embedded with (its local model, else cached OpenAI)"""
+    from langchain_community.vectorstores import Chroma
+    from embeddings import CachedEmbeddings
+
+    local_path = os.path.join(db_path, LOCAL_EMBEDDINGS_FILE)
+    if os.path.exists(local_path):
+        embeddings = LocalEmbeddings.load(local_path)
+    else:
+        from langchain_openai import OpenAIEmbeddings
+
+        embeddings = CachedEmbeddings(OpenAIEmbeddings())
+    return Chroma(persist_directory=db_path, embedding_function=embeddings)
+
+
+def config_name(backend, clause_lookup, packed):
+    return f"{backend}{'+clause' if clause_lookup else ''}{'+packed' if packed else ''}"
+
+
+def _run_config(db_path, backend, clause_lookup, packed, gold, k, results):
+    """Load one retriever and run every labelled question through it (in a fresh process for a clean RSS reading)"""
+    from context_packer import ContextPacker
+    from retrievers import build_retriever
+
+    warnings.filterwarnings('ignore')
+    vectorstore = open_store(db_path)
+    # Memory is counted from here: the index loaded by the retriever and its first query
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    retriever = build_retriever(vectorstore, backend, k, clause_lookup)
+    packer = ContextPacker() if packed else None
+    retriever.invoke(gold[0]["question"])
+    load_seconds = time.perf_counter() - start
+
+    latencies, scores = [], []
+    for item in gold:
+        t = time.perf_counter()
+        docs = retriever.invoke(item["question"])
+        if packer:
+            # Packed chunks are scored as the retrieved chunks they were cut from,
+            # since trimming joins the heading lines the recursive chunks are labelled by
+            for rank, doc in enumerate(docs):
+                doc.metadata["rank"] = rank
+            docs = [docs[doc.metadata["rank"]] for doc in packer.pack(item["question"], docs)[0]]
+        latencies.append(time.perf_counter() - t)
+        scores.append(score_ranking(docs, item))
+
+    row = {"config": config_name(backend, clause_lookup, packed), "load_s": load_seconds}
+    for key in scores[0]:
+        row["mrr" if key == "rr" else key] = float(np.mean([score[key] for score in scores]))
+    row.update(latency_summary(latencies))
+    row["rss_mb"] = current_rss_mb() - rss_before
+    row["misses"] = [item["question"] for item, score in zip(gold, scores) if score["rr"] == 0]
+    results.put(row)
+
+
+def evaluate_store(db_path, gold, k=max(CUTOFFS), backends=BACKENDS, variants=VARIANTS):
+    """recall@k, MRR, latency and memory of every retriever configuration on one store.
+
+    Every configuration retrieves k chunks per question; recall@n is the share
+    of the question's gold clauses found in the first n, and MRR uses the rank
+    of the first chunk holding any of them. Latency includes embedding the
+    query with the store's model, and no LLM is called.
+    """
+    from retrievers import build_retriever
+
+    # Build the derived indexes (NumPy, quantized, sections, BM25, clauses) up front,
+    # so the runs measure loading them, not creating them
+    vectorstore = open_store(db_path)
+    for backend in backends:
+        build_retriever(vectorstore, backend, k, clause_lookup=any(lookup for lookup, _ in variants))
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for backend in backends:
+        for clause_lookup, packed in variants:
+            results = context.Queue()
+            process = context.Process(target=_run_config,
+                                      args=(db_path, backend, clause_lookup, packed, gold, k, results))
+            process.start()
+            rows.append(results.get())
+            process.join()
+    return rows
+
+
+def retrieval_report(pdf_folder=PDF_FOLDER, gold=None, chunkers=CHUNKERS, k=max(CUTOFFS), backends=BACKENDS):
+    """Evaluate every retriever configuration on a local-embedding store built with each chunker"""
+    gold = gold or load_gold()
+    rows = []
+    for splitter in chunkers:
+        db_path = tempfile.mkdtemp(prefix=f"kb_eval_{splitter}_")
+        try:
+            print(f"🔍 Building {splitter} store from {pdf_folder}...")
+            build_store(pdf_folder, splitter, db_path)
+            for row in evaluate_store(db_path, gold, k, backends):
+                rows.append({"chunker": splitter, **row})
+        finally:
+            shutil.rmtree(db_path, ignore_errors=True)
+    return rows
+
+
+def print_eval_rows(rows, show_misses=False):
+    recalls = [key for key in rows[0] if key.startswith("recall@")]
+    print(f"{'chunker':<11}{'retriever':<28}" + "".join(f"{'R@' + key.split('@')[1]:>7}" for key in recalls)
+          + f"{'MRR':>7}{'p50 ms':>9}{'p95 ms':>9}{'load s':>8}{'RSS +MB':>9}")
+    for row in rows:
+        print(f"{row['chunker']:<11}{row['config']:<28}" + "".join(f"{row[key]:>7.3f}" for key in recalls)
+              + f"{row['mrr']:>7.3f}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['load_s']:>8.2f}"
+                f"{row['rss_mb']:>9.1f}")
+        if show_misses:
+            for question in row["misses"]:
+                print(f"{'':<11}  ✗ {question}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline recall@k, MRR and latency of every PDF retriever "
+                                                 "on labelled questions (no LLM calls)")
+    parser.add_argument("--gold", default=GOLD_PATH, help="CSV of questions and their gold clause headings")
+    parser.add_argument("--pdf-folder", default=PDF_FOLDER)
+    parser.add_argument("--chunkers", nargs="+", default=CHUNKERS, choices=CHUNKERS)
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--db", help="evaluate an existing store instead of building local-embedding stores "
+                                     "(queries use its local model if it has one, else cached OpenAI embeddings)")
+    parser.add_argument("--misses", action="store_true", help="list the questions each configuration missed")
+    args = parser.parse_args()
+
+    gold = load_gold(args.gold)
+    print(f"📊 {len(gold)} labelled questions, {sum(len(item['clauses']) for item in gold)} gold clauses")
+    if args.db:
+        rows = [{"chunker": "store", **row} for row in evaluate_store(args.db, gold, backends=args.backends)]
+    else:
+        rows = retrieval_report(args.pdf_folder, gold, args.chunkers, backends=args.backends)
+    print_eval_rows(rows, args.misses)
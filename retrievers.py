@@ -0,0 +1,714 @@
+import os
+import json
+import hashlib
+import tempfile
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from knowledge_base import DB_PATH, load_bm25_index, load_clause_index, tenant_index_path
+from partitions import PROPERTY_TYPES, detect_property_types, normalize_tenant_key, query_filter
+
+# Backend the bot retrieves with (see build_retriever); also decides which derived indexes a build includes
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "partitioned")
+# Memory-mapped vector index, kept inside the Chroma DB directory it mirrors
+NUMPY_INDEX_DIR = "numpy_index"
+# Compressed variant, one directory per configuration (e.g. quantized_index_pca256_int8)
+QUANTIZED_INDEX_DIR = "quantized_index"
+QUANTIZED_REDUCTION = "pca"
+QUANTIZED_DIM = 256
+QUANTIZED_DTYPE = "int8"
+# Rows rescored with the full float32 vectors after the compressed search
+RESCORE_CANDIDATES = 20
+# Section-level index searched before the chunks (one vector per numbered clause)
+SECTION_INDEX_DIR = "section_index"
+# Best sections whose chunks are searched by the hierarchical retriever
+SEARCH_SECTIONS = 3
+# Maximal marginal relevance: relevance weight against diversity, and candidates re-ranked
+MMR_LAMBDA = 0.5
+MMR_POOL = 20
+
+
+def store_path(vectorstore):
+    """Directory a Chroma vector store persists to"""
+    return getattr(vectorstore, "_persist_directory", None) or DB_PATH
+
+
+def ids_digest(ids):
+    """Order-independent fingerprint of a set of chunk IDs"""
+    return hashlib.sha256("\n".join(sorted(ids)).encode("utf-8")).hexdigest()
+
+
+def normalize_rows(matrix):
+    """L2-normalize each row of a matrix (zero rows are left as zeros)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def temp_path(index_path, suffix):
+    """New, uniquely named file in index_path, so processes building the same index never share a temp file"""
+    fd, path = tempfile.mkstemp(dir=index_path, suffix=suffix)
+    os.close(fd)
+    # mkstemp creates the file private to its owner; the index is read by every bot process
+    os.chmod(path, 0o644)
+    return path
+
+
+def top_k(scores, k):
+    """Indices and scores of the k highest scores in each row, best first"""
+    scores = np.atleast_2d(scores)
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty
+    # argpartition finds the top k in linear time, then only those k are sorted
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1)
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(candidate_scores, order, axis=1)
+
+
+class NumpyVectorIndex:
+    """Exact cosine-similarity index over a memory-mapped float32 matrix.
+
+    Normalized embeddings live in vectors.npy and chunk IDs, texts and metadata
+    in a chunks.json sidecar. The matrix is opened read-only with mmap, so
+    several processes share one copy through the OS page cache, and a search is
+    a single matrix-vector (or matrix-matrix for batches) product.
+    """
+
+    VECTORS_FILE = "vectors.npy"
+    CHUNKS_FILE = "chunks.json"
+
+    def __init__(self, vectors, ids, texts, metadatas, digest=None):
+        self.vectors = vectors
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.digest = digest or ids_digest(ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, index_path, ids, texts, metadatas, vectors):
+        """Write a new index to index_path and open it"""
+        os.makedirs(index_path, exist_ok=True)
+        matrix = normalize_rows(vectors) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+        tmp_vectors = temp_path(index_path, ".npy")
+        np.save(tmp_vectors, matrix)
+        tmp_chunks = temp_path(index_path, ".json")
+        with open(tmp_chunks, "w", encoding="utf-8") as f:
+            json.dump({"digest": ids_digest(ids), "ids": list(ids), "texts": list(texts),
+                       "metadatas": [metadata or {} for metadata in metadatas]}, f)
+        os.replace(tmp_vectors, os.path.join(index_path, cls.VECTORS_FILE))
+        os.replace(tmp_chunks, os.path.join(index_path, cls.CHUNKS_FILE))
+        return cls.load(index_path)
+
+    @classmethod
+    def load(cls, index_path):
+        """Open an index from disk, memory-mapping the vector matrix read-only"""
+        vectors = np.load(os.path.join(index_path, cls.VECTORS_FILE), mmap_mode="r")
+        with open(os.path.join(index_path, cls.CHUNKS_FILE), "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        return cls(vectors, chunks["ids"], chunks["texts"], chunks["metadatas"], chunks["digest"])
+
+    @classmethod
+    def from_chroma(cls, vectorstore, index_path=None, **build_options):
+        """Build (or reuse) an index holding the same chunks and embeddings as a Chroma store"""
+        index_path = index_path or os.path.join(store_path(vectorstore), NUMPY_INDEX_DIR)
+        if os.path.exists(os.path.join(index_path, cls.CHUNKS_FILE)):
+            index = cls.load(index_path)
+            if index.digest == ids_digest(vectorstore.get(include=[])["ids"]):
+                return index
+        data = vectorstore.get(include=["embeddings", "documents", "metadatas"])
+        print(f"🔧 Building NumPy vector index with {len(data['ids'])} chunks")
+        return cls.build(index_path, data["ids"], data["documents"], data["metadatas"], data["embeddings"],
+                         **build_options)
+
+    def search(self, query_vectors, k=3):
+        """Exact top-k for one query vector or a batch; returns (indices, scores) arrays"""
+        query_vectors = normalize_rows(np.atleast_2d(query_vectors))
+        if not len(self.ids):
+            empty = np.empty((query_vectors.shape[0], 0))
+            return empty.astype(np.int64), empty
+        return top_k(query_vectors @ self.vectors.T, k)
+
+    def document(self, position, score=None):
+        """Document for the chunk at a row position"""
+        metadata = dict(self.metadatas[position])
+        metadata["id"] = self.ids[position]
+        if score is not None:
+            metadata["score"] = float(score)
+        return Document(page_content=self.texts[position], metadata=metadata)
+
+
+def project(matrix, components, mean=None):
+    """Reduce rows with a projection matrix (None keeps them as they are), after subtracting mean if given"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if mean is not None:
+        matrix = matrix - mean
+    return matrix if components is None else matrix @ components.T
+
+
+class QuantizedVectorIndex(NumpyVectorIndex):
+    """NumpyVectorIndex searched through reduced, scalar-quantized codes.
+
+    At build time the normalized embeddings are projected to `dim` dimensions
+    (PCA fitted on the chunks, a seeded Gaussian random projection, or "none")
+    and stored as int8 codes with per-dimension scales or as float16. A search
+    scores every code, then rescores the best `candidates` rows with the full
+    float32 vectors; those stay memory-mapped on disk and only the candidate rows
+    are read, so the resident matrix is the compressed one.
+    """
+
+    CODES_FILE = "codes.npy"
+    PROJECTION_FILE = "projection.npz"
+    # Rows scored per block, bounding the float32 copy made of the codes
+    BLOCK_ROWS = 16384
+
+    def __init__(self, vectors, ids, texts, metadatas, digest=None, codes=None, projection=None,
+                 candidates=RESCORE_CANDIDATES):
+        super().__init__(vectors, ids, texts, metadatas, digest)
+        self.codes = codes
+        self.mean = projection["mean"]
+        self.components = projection["components"]
+        self.scales = projection["scales"]
+        self.candidates = candidates
+
+    @staticmethod
+    def fit_projection(matrix, dim, reduction="pca", sample_size=20000, seed=0):
+        """Mean and projection rows for reducing `matrix` to `dim` columns (None components keep all columns)"""
+        n_rows, n_cols = matrix.shape
+        if reduction not in ("pca", "random", "none"):
+            raise ValueError(f"Unknown reduction: {reduction}")
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(n_rows, sample_size, replace=False)) if n_rows > sample_size else slice(None)
+        sample = np.asarray(matrix[rows], dtype=np.float32)
+        mean = sample.mean(axis=0)
+        if reduction == "none" or dim >= n_cols:
+            return mean, None
+        if reduction == "random":
+            return mean, rng.standard_normal((dim, n_cols)).astype(np.float32) / np.sqrt(dim)
+        _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+        return mean, vt[:dim].astype(np.float32)
+
+    @classmethod
+    def build(cls, index_path, ids, texts, metadatas, vectors, dim=QUANTIZED_DIM, reduction=QUANTIZED_REDUCTION,
+              dtype=QUANTIZED_DTYPE):
+        """Write the reduced, quantized codes plus the float32 index to index_path and open it"""
+        if dtype not in ("int8", "float16"):
+            raise ValueError(f"Unknown dtype: {dtype}")
+        os.makedirs(index_path, exist_ok=True)
+        matrix = normalize_rows(vectors) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+        if len(ids):
+            mean, components = cls.fit_projection(matrix, dim, reduction)
+        else:
+            mean, components = np.zeros(0, dtype=np.float32), None
+        # Chunk vectors are centered: mean . q is the same for every chunk, so ranking
+        # by (x - mean) . q (what the projection preserves best) matches ranking by x . q
+        reduced = project(matrix, components, mean)
+        if dtype == "int8":
+            scales = np.maximum(np.abs(reduced).max(axis=0), 1e-12) / 127 if len(ids) else np.ones(0)
+            codes = np.round(reduced / scales).astype(np.int8)
+        else:
+            scales = np.ones(reduced.shape[1])
+            codes = reduced.astype(np.float16)
+
+        # The codes are written first: chunks.json, written last by the base build,
+        # is what marks the index as complete for from_chroma
+        tmp_codes = temp_path(index_path, ".npy")
+        np.save(tmp_codes, codes)
+        tmp_projection = temp_path(index_path, ".npz")
+        np.savez(tmp_projection, mean=mean, scales=scales.astype(np.float32),
+                 components=components if components is not None else np.zeros((0, 0), dtype=np.float32))
+        os.replace(tmp_codes, os.path.join(index_path, cls.CODES_FILE))
+        os.replace(tmp_projection, os.path.join(index_path, cls.PROJECTION_FILE))
+        NumpyVectorIndex.build(index_path, ids, texts, metadatas, matrix)
+        return cls.load(index_path)
+
+    @classmethod
+    def load(cls, index_path, candidates=RESCORE_CANDIDATES):
+        """Open an index from disk, memory-mapping both the codes and the float32 vectors"""
+        base = NumpyVectorIndex.load(index_path)
+        codes = np.load(os.path.join(index_path, cls.CODES_FILE), mmap_mode="r")
+        with np.load(os.path.join(index_path, cls.PROJECTION_FILE)) as data:
+            projection = {name: data[name] for name in data.files}
+        if not projection["components"].size:
+            projection["components"] = None
+        return cls(base.vectors, base.ids, base.texts, base.metadatas, base.digest, codes, projection, candidates)
+
+    def approximate_scores(self, query_vectors):
+        """Scores of every chunk from the compressed codes (same ranking as the dot product, not the same scale)"""
+        weights = project(query_vectors, self.components) * self.scales
+        scores = np.empty((len(query_vectors), len(self.ids)), dtype=np.float32)
+        for start in range(0, len(self.ids), self.BLOCK_ROWS):
+            block = np.asarray(self.codes[start:start + self.BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = (block @ weights.T).T
+        return scores
+
+    def search(self, query_vectors, k=3):
+        """Top-k by compressed scores over all chunks, rescored exactly on the best candidates"""
+        query_vectors = normalize_rows(np.atleast_2d(query_vectors))
+        if not len(self.ids):
+            empty = np.empty((query_vectors.shape[0], 0))
+            return empty.astype(np.int64), empty
+        candidates, _ = top_k(self.approximate_scores(query_vectors), max(self.candidates, k))
+        candidates = np.sort(candidates, axis=1)
+        exact = np.stack([
+            np.asarray(self.vectors[rows], dtype=np.float32) @ query_vector
+            for rows, query_vector in zip(candidates, query_vectors)
+        ])
+        order, scores = top_k(exact, k)
+        return np.take_along_axis(candidates, order, axis=1), scores
+
+
+def section_key(metadata):
+    """Section a chunk belongs to: its document's numbered clause, or its page when no clause was recorded"""
+    section = metadata.get("section") or f"page {metadata.get('page', 0)}"
+    return f"{metadata.get('source', '')}#{section}"
+
+
+class HierarchicalIndex:
+    """Two-stage search: section vectors first, then only the chunks of the best sections.
+
+    Every section (a numbered clause of one document, e.g. the condominium
+    clauses' "2. The Tenant hereby agrees ...") is represented by the normalized
+    mean of its chunk embeddings, so the coarse index costs no embedding calls. A
+    search scores the section vectors, then scores exactly only the chunks in the
+    best `sections` sections, gathered from the memory-mapped chunk matrix. Its
+    cost grows with the number of sections plus the size of a few sections rather
+    than with the whole collection, and chunks from unrelated documents never
+    reach the prompt.
+    """
+
+    # Digest of the chunk index the sections were built from, written last
+    CHUNK_DIGEST_FILE = "chunk_digest.txt"
+
+    def __init__(self, chunks, sections, n_sections=SEARCH_SECTIONS):
+        self.chunks = chunks
+        self.sections = sections
+        self.n_sections = n_sections
+        self.section_rows = [np.asarray(metadata["rows"], dtype=np.int64) for metadata in sections.metadatas]
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @classmethod
+    def build(cls, index_path, chunks, n_sections=SEARCH_SECTIONS):
+        """Write the section index for a chunk index to index_path and open it"""
+        groups = {}
+        for position, metadata in enumerate(chunks.metadatas):
+            groups.setdefault(section_key(metadata), []).append(position)
+        keys = list(groups)
+        centroids = [np.asarray(chunks.vectors[rows], dtype=np.float32).mean(axis=0) for rows in groups.values()]
+        metadatas = [
+            {"source": chunks.metadatas[rows[0]].get("source"), "section": chunks.metadatas[rows[0]].get("section"),
+             "property_types": [name for name in PROPERTY_TYPES
+                                if any(chunks.metadatas[i].get(f"pt_{name}") for i in rows)],
+             "rows": rows}
+            for rows in groups.values()
+        ]
+        sections = NumpyVectorIndex.build(index_path, keys, keys, metadatas, centroids)
+        tmp_digest = temp_path(index_path, ".txt")
+        with open(tmp_digest, "w", encoding="utf-8") as f:
+            f.write(chunks.digest)
+        os.replace(tmp_digest, os.path.join(index_path, cls.CHUNK_DIGEST_FILE))
+        return cls(chunks, sections, n_sections)
+
+    @classmethod
+    def from_chunks(cls, chunks, index_path, n_sections=SEARCH_SECTIONS):
+        """Open the section index for a chunk index, rebuilding it if the chunks changed"""
+        digest_path = os.path.join(index_path, cls.CHUNK_DIGEST_FILE)
+        if os.path.exists(digest_path):
+            with open(digest_path, "r", encoding="utf-8") as f:
+                if f.read() == chunks.digest:
+                    return cls(chunks, NumpyVectorIndex.load(index_path), n_sections)
+        print(f"🔧 Building section index over {len(chunks)} chunks")
+        return cls.build(index_path, chunks, n_sections)
+
+    def select_sections(self, query_vector, k=3, property_types=()):
+        """Sections to search for one normalized query vector, and those each named property type requires.
+
+        The best section tagged with each property type in property_types comes
+        first, then the best sections overall until `n_sections` sections holding
+        at least k chunks are chosen.
+        """
+        order, _ = self.sections.search(query_vector, len(self.sections))
+        order = [int(i) for i in order[0]]
+        required = []
+        for name in property_types:
+            best = next((i for i in order if name in self.sections.metadatas[i].get("property_types", [])), None)
+            if best is not None and best not in required:
+                required.append(best)
+        selected, count = list(required), sum(len(self.section_rows[i]) for i in required)
+        for i in order:
+            if len(selected) >= self.n_sections and count >= k:
+                break
+            if i not in selected:
+                selected.append(i)
+                count += len(self.section_rows[i])
+        return selected, required
+
+    def candidate_rows(self, query_vector, k=3, property_types=()):
+        """Chunk rows searched for one normalized query vector"""
+        selected, _ = self.select_sections(query_vector, k, property_types)
+        return np.sort(np.concatenate([self.section_rows[i] for i in selected]))
+
+    def search(self, query_vectors, k=3, property_types=()):
+        """Top-k chunks within the best sections for one query vector or a batch; returns (indices, scores).
+
+        The best chunk of each section required by property_types is always
+        returned, so a question comparing condo and HDB clauses sees both.
+        """
+        query_vectors = normalize_rows(np.atleast_2d(query_vectors))
+        if not len(self.chunks):
+            empty = np.empty((query_vectors.shape[0], 0))
+            return empty.astype(np.int64), empty
+        indices, scores = [], []
+        for query_vector in query_vectors:
+            selected, required = self.select_sections(query_vector, k, property_types)
+            rows = np.sort(np.concatenate([self.section_rows[i] for i in selected]))
+            row_scores = np.asarray(self.chunks.vectors[rows], dtype=np.float32) @ query_vector
+            picked = {}
+            for i in required[:k]:
+                section_rows = self.section_rows[i]
+                section_scores = np.asarray(self.chunks.vectors[section_rows], dtype=np.float32) @ query_vector
+                best = int(np.argmax(section_scores))
+                picked.setdefault(int(section_rows[best]), float(section_scores[best]))
+            order, _ = top_k(row_scores, k + len(picked))
+            for j in order[0]:
+                if len(picked) >= k:
+                    break
+                picked.setdefault(int(rows[j]), float(row_scores[j]))
+            ranked = sorted(picked.items(), key=lambda item: item[1], reverse=True)
+            indices.append([position for position, _ in ranked])
+            scores.append([score for _, score in ranked])
+        return np.asarray(indices, dtype=np.int64), np.asarray(scores)
+
+    def document(self, position, score=None):
+        """Document for the chunk at a row position of the chunk index"""
+        return self.chunks.document(position, score)
+
+
+def quantized_index_path(vectorstore, reduction=QUANTIZED_REDUCTION, dim=QUANTIZED_DIM, dtype=QUANTIZED_DTYPE):
+    """Directory of the compressed index for one configuration"""
+    name = f"{QUANTIZED_INDEX_DIR}_{reduction}{dim if reduction != 'none' else ''}_{dtype}"
+    return os.path.join(store_path(vectorstore), name)
+
+
+class NumpyRetriever(BaseRetriever):
+    """Retriever backed by a NumpyVectorIndex"""
+
+    index: Any
+    embeddings: Any
+    k: int = 3
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return self.batch_search([query])[0]
+
+    def batch_search(self, queries):
+        """Retrieve top-k documents for several queries with one matrix product"""
+        query_vectors = self.embeddings.embed_documents(list(queries))
+        indices, scores = self.index.search(query_vectors, self.k)
+        return [
+            [self.index.document(i, score) for i, score in zip(row_indices, row_scores)]
+            for row_indices, row_scores in zip(indices, scores)
+        ]
+
+
+class HierarchicalRetriever(BaseRetriever):
+    """Retriever backed by a HierarchicalIndex, covering every property type a query names.
+
+    "What are the different terms of tenancy between condo and HDB flat?" names
+    two property types, so the best condominium section and the best HDB
+    section are both searched and each contributes its best chunk.
+    """
+
+    index: Any
+    embeddings: Any
+    k: int = 3
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        query_vector = self.embeddings.embed_query(query)
+        indices, scores = self.index.search(query_vector, self.k, detect_property_types(query))
+        return [self.index.document(i, score) for i, score in zip(indices[0], scores[0])]
+
+
+def chroma_search(vectorstore, query_vector, n, where=None):
+    """Vector search on a Chroma store returning (chunk_id, Document, relevance) tuples"""
+    count = vectorstore._collection.count()
+    if not count:
+        return []
+    result = vectorstore._collection.query(
+        query_embeddings=[list(query_vector)],
+        n_results=min(n, count),
+        where=where,
+        include=["documents", "metadatas", "distances"],
+    )
+    relevance = vectorstore._select_relevance_score_fn()
+    return [
+        (chunk_id, Document(page_content=text, metadata={**(metadata or {}), "id": chunk_id}), relevance(distance))
+        for chunk_id, text, metadata, distance in zip(
+            result["ids"][0], result["documents"][0], result["metadatas"][0], result["distances"][0]
+        )
+    ]
+
+
+def reciprocal_rank_fusion(rankings, weights=None, rrf_k=60):
+    """Fuse ranked lists of IDs; each list adds weight / (rrf_k + rank) to an ID's score"""
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """BM25 keyword search fused with vector search by reciprocal rank fusion.
+
+    Exact terms such as "diplomatic clause" or "GIRO" are caught by BM25 even
+    when embedding similarity ranks them low. `candidates` is the budget of
+    results each ranker contributes before fusion; `k` chunks are returned.
+    """
+
+    vectorstore: Any
+    bm25: Any
+    k: int = 3
+    candidates: int = 20
+    rrf_k: int = 60
+    vector_weight: float = 1.0
+    keyword_weight: float = 1.0
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        query_vector = self.vectorstore.embeddings.embed_query(query)
+        vector_hits = chroma_search(self.vectorstore, query_vector, self.candidates)
+        keyword_hits = self.bm25.search(query, self.candidates)
+        fused = reciprocal_rank_fusion(
+            [[chunk_id for chunk_id, _, _ in vector_hits], [chunk_id for chunk_id, _ in keyword_hits]],
+            [self.vector_weight, self.keyword_weight],
+            self.rrf_k,
+        )[:self.k]
+
+        docs = {chunk_id: doc for chunk_id, doc, _ in vector_hits}
+        # Chunks found only by BM25 are fetched from the store by ID
+        missing = [chunk_id for chunk_id, _ in fused if chunk_id not in docs]
+        if missing:
+            data = self.vectorstore.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"]):
+                docs[chunk_id] = Document(page_content=text, metadata={**(metadata or {}), "id": chunk_id})
+
+        results = []
+        for chunk_id, score in fused:
+            if chunk_id in docs:
+                doc = docs[chunk_id]
+                doc.metadata["score"] = score
+                results.append(doc)
+        return results
+
+
+class PartitionedRetriever(BaseRetriever):
+    """Vector search restricted to the property and rental types a query mentions.
+
+    "I'm renting a condominium unit, can I keep pets?" only searches chunks
+    tagged pt_condo or pt_standard at ingestion. Queries that name no partition,
+    or whose partitions hold fewer than `k` chunks, search the whole collection.
+    """
+
+    vectorstore: Any
+    k: int = 3
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        query_vector = self.vectorstore.embeddings.embed_query(query)
+        where = query_filter(query)
+        hits = chroma_search(self.vectorstore, query_vector, self.k, where) if where else []
+        if len(hits) < self.k:
+            hits = chroma_search(self.vectorstore, query_vector, self.k)
+        results = []
+        for _, doc, score in hits:
+            doc.metadata["score"] = score
+            results.append(doc)
+        return results
+
+
+def chroma_candidates(vectorstore, query_vector, n, where=None):
+    """Top-n chunks of a Chroma vector search with their stored embeddings; returns (Documents, vector matrix)"""
+    count = vectorstore._collection.count()
+    if not count:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    result = vectorstore._collection.query(
+        query_embeddings=[[float(value) for value in query_vector]],
+        n_results=min(n, count),
+        where=where,
+        include=["documents", "metadatas", "embeddings"],
+    )
+    if not result["ids"][0]:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    docs = [
+        Document(page_content=text, metadata={**(metadata or {}), "id": chunk_id})
+        for chunk_id, text, metadata in zip(result["ids"][0], result["documents"][0], result["metadatas"][0])
+    ]
+    return docs, normalize_rows(result["embeddings"][0])
+
+
+def mmr_select(query_vector, vectors, k, lambda_mult=MMR_LAMBDA):
+    """Rows picked by maximal marginal relevance, in pick order; returns (positions, query similarities).
+
+    Each step picks the row maximizing lambda_mult * sim(query, row) minus
+    (1 - lambda_mult) * its highest similarity to a row already picked. All
+    pairwise similarities come from one pool x pool matrix product, and the
+    highest-similarity vector is updated with one np.maximum per pick.
+    """
+    vectors = normalize_rows(vectors)
+    k = min(k, len(vectors))
+    if k <= 0:
+        return [], np.empty(0)
+    relevance = vectors @ normalize_rows([query_vector])[0]
+    pairwise = vectors @ vectors.T
+    picked = [int(np.argmax(relevance))]
+    redundancy = pairwise[picked[0]].copy()
+    available = np.ones(len(vectors), dtype=bool)
+    available[picked[0]] = False
+    while len(picked) < k:
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        np.maximum(redundancy, pairwise[best], out=redundancy)
+    return picked, relevance[picked]
+
+
+class MMRRetriever(BaseRetriever):
+    """Partitioned vector search re-ranked by maximal marginal relevance.
+
+    The `fetch_k` most similar chunks (within the partitions the query names, as
+    in PartitionedRetriever) form the candidate pool, and `k` of them are picked
+    so each adds something the earlier picks do not: the same clause repeated
+    across agreements fills one slot instead of three, leaving room for the
+    neighbouring clause. lambda_mult=1 is plain similarity search, lower values
+    trade relevance for diversity.
+    """
+
+    vectorstore: Any
+    k: int = 3
+    fetch_k: int = MMR_POOL
+    lambda_mult: float = MMR_LAMBDA
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        query_vector = self.vectorstore.embeddings.embed_query(query)
+        where = query_filter(query)
+        docs, vectors = chroma_candidates(self.vectorstore, query_vector, self.fetch_k, where) if where else ([], None)
+        if len(docs) < self.k:
+            docs, vectors = chroma_candidates(self.vectorstore, query_vector, self.fetch_k)
+        picked, scores = mmr_select(query_vector, vectors, self.k, self.lambda_mult)
+        results = []
+        for position, score in zip(picked, scores):
+            doc = docs[position]
+            doc.metadata["score"] = float(score)
+            results.append(doc)
+        return results
+
+
+def tenant_index_exists(vectorstore, tenant_key):
+    """Whether the knowledge base holds an agreement index for the tenant"""
+    key = normalize_tenant_key(tenant_key)
+    if key is None:
+        return False
+    index_path = tenant_index_path(store_path(vectorstore), key)
+    return os.path.exists(os.path.join(index_path, NumpyVectorIndex.CHUNKS_FILE))
+
+
+class TenantRetriever(BaseRetriever):
+    """Search one tenant's own agreement on top of the shared knowledge base retriever.
+
+    The tenant's chunks are read from the small memory-mapped index stored under
+    their reference number and scored exactly, so the cost of a query does not
+    grow with the number of stored agreements. Shared chunks come from
+    `retriever`, the bot's configured backend with clause lookup and the
+    retrieval cache in front of it. Both rankings are merged by reciprocal rank
+    fusion, dropping shared chunks whose text the lease already contains.
+    """
+
+    vectorstore: Any
+    retriever: Any
+    tenant_key: Optional[str] = None
+    k: int = 3
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        lease_docs = []
+        if tenant_index_exists(self.vectorstore, self.tenant_key):
+            lease = NumpyVectorIndex.load(tenant_index_path(store_path(self.vectorstore),
+                                                            normalize_tenant_key(self.tenant_key)))
+            query_vector = normalize_rows([self.vectorstore.embeddings.embed_query(query)])[0]
+            indices, _ = lease.search(query_vector, self.k)
+            lease_docs = [lease.document(i) for i in indices[0]]
+        lease_texts = {doc.page_content for doc in lease_docs}
+        shared_docs = [doc for doc in self.retriever.invoke(query) if doc.page_content not in lease_texts]
+
+        # The lease ranking comes first so its chunks win ties with shared chunks of the same rank
+        docs = {doc.page_content: doc for doc in lease_docs + shared_docs}
+        fused = reciprocal_rank_fusion(
+            [[doc.page_content for doc in lease_docs], [doc.page_content for doc in shared_docs]],
+            rrf_k=self.rrf_k,
+        )[:self.k]
+        results = []
+        for text, score in fused:
+            doc = docs[text]
+            doc.metadata["score"] = score
+            results.append(doc)
+        return results
+
+
+class ClauseRetriever(BaseRetriever):
+    """Answer queries that name a clause from the clause index, skipping vector search.
+
+    "What does the diplomatic clause say?" or "Who replaces the light bulbs?"
+    return the stored text of the named clause straight from the ClauseIndex,
+    without embedding the query; any other query goes to `retriever`.
+    """
+
+    clauses: Any
+    retriever: Any
+    k: int = 3
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        docs = self.clauses.lookup(query, self.k)
+        if docs:
+            return docs
+        return self.retriever.invoke(query)
+
+
+def build_retriever(vectorstore, backend="chroma", k=3, clause_lookup=False):
+    """Create the PDF retriever for the chosen backend
+
+    ("chroma", "numpy", "quantized", "hierarchical", "hybrid", "partitioned" or "mmr"),
+    answering queries that name a clause from the clause index if clause_lookup is set
+    """
+    if clause_lookup:
+        clauses = load_clause_index(vectorstore, store_path(vectorstore))
+        return ClauseRetriever(clauses=clauses, retriever=build_retriever(vectorstore, backend, k), k=k)
+    if backend == "numpy":
+        index = NumpyVectorIndex.from_chroma(vectorstore)
+        return NumpyRetriever(index=index, embeddings=vectorstore.embeddings, k=k)
+    if backend == "hierarchical":
+        chunks = NumpyVectorIndex.from_chroma(vectorstore)
+        index = HierarchicalIndex.from_chunks(chunks, os.path.join(store_path(vectorstore), SECTION_INDEX_DIR))
+        return HierarchicalRetriever(index=index, embeddings=vectorstore.embeddings, k=k)
+    if backend == "quantized":
+        index = QuantizedVectorIndex.from_chroma(vectorstore, quantized_index_path(vectorstore))
+        return NumpyRetriever(index=index, embeddings=vectorstore.embeddings, k=k)
+    if backend == "hybrid":
+        bm25 = load_bm25_index(vectorstore, store_path(vectorstore))
+        return HybridRetriever(vectorstore=vectorstore, bm25=bm25, k=k)
+    if backend == "partitioned":
+        return PartitionedRetriever(vectorstore=vectorstore, k=k)
+    if backend == "mmr":
+        return MMRRetriever(vectorstore=vectorstore, k=k)
+    if backend != "chroma":
+        raise ValueError(f"Unknown retriever backend: {backend}")
+    return vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": k})
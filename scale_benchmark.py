@@ -0,0 +1,394 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import warnings
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from kb_versions import directory_size
+from knowledge_base import TENANT_INDEX_DIR
+from local_embedding_server import RateLimiter, make_handler
+from retrieval_benchmark import current_rss_mb, latency_summary, queries_near
+
+# Suppress warnings
+warnings.filterwarnings('ignore')
+
+GENERATOR_DIR = "property_data_generator"
+PROPERTY_DATABASE = os.path.join(GENERATOR_DIR, "property_database.csv")
+NAMES_DATABASE = os.path.join(GENERATOR_DIR, "names_database.csv")
+QA_PATH = "question_answer_pair/qa_pair_for_testing_v2.csv"
+SIZES = [100, 1000, 10000]
+# (M, ef_search) pairs compared against exact search; ef_construction is fixed
+HNSW_CONFIGS = [(8, 10), (8, 50), (16, 10), (16, 50), (16, 100), (32, 50), (32, 200)]
+HNSW_CONSTRUCTION_EF = 100
+# File each generator output path writes per agreement; "records" skips the PDF round trip
+AGREEMENT_SUFFIXES = {"pdf": ".pdf", "records": ".clauses.json"}
+
+
+def _agreement_rows(n, seed=123):
+    """Arguments for generate_tenancy_agreement for reference numbers 1..n.
+
+    Properties are drawn (with replacement) from property_database.csv and tenant
+    names from names_database.csv, with addresses built the same way as
+    pdf_database_preparation.py does for the rented rows.
+    """
+    properties = pd.read_csv(PROPERTY_DATABASE)
+    names = pd.read_csv(NAMES_DATABASE)
+    rng = np.random.default_rng(seed)
+    rows = []
+    for ref_no, i in enumerate(rng.integers(0, len(properties), n), start=1):
+        row = properties.iloc[i]
+        postcode = rng.integers(100000, 700000)
+        if row["property_type"] == "Landed":
+            address = f"{rng.integers(1, 21)} {row['street_name']}, Singapore {postcode}"
+        elif row["property_type"] == "Condo / Private Apartment":
+            address = f"{row['block / building']}, {row['street_name']}, #{row['storey']}-{row['storey']}, Singapore {postcode}"
+        else:
+            address = f"{row['block / building']} {row['street_name']}, #{row['storey']}-{row['storey']}, Singapore {postcode}"
+        tenant = f"{rng.choice(names['first_name'])} {rng.choice(names['last_name'])}"
+        rental_date = date(2024, 1, 1) + timedelta(days=int(rng.integers(0, 730)))
+        rows.append((
+            row["property_type"].upper().replace("_", " "), row["rental_type"], ref_no, row["owner_name"], tenant,
+            address, row["rental_price"], rental_date.strftime("%d/%m/%Y"),
+        ))
+    return rows
+
+
+def _generate_batch(out_dir, rows, output="pdf"):
+    """Write a batch of agreements into out_dir (runs in a worker process)"""
+    sys.path.insert(0, os.path.abspath(GENERATOR_DIR))
+    from tenancy_agreement_generator import generate_tenancy_agreement
+
+    os.chdir(out_dir)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for row in rows:
+            generate_tenancy_agreement(*row, output=output)
+    return len(rows)
+
+
+def generate_agreements(n, out_dir, processes=None, batch_size=50, output="pdf"):
+    """Generate agreements 1..n in out_dir with the repo's generator, skipping existing files.
+
+    output is passed on to generate_tenancy_agreement: "pdf" writes
+    tenancy_agreement_<n>.pdf, "records" tenancy_agreement_<n>.clauses.json.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    out_dir = os.path.abspath(out_dir)
+    suffix = AGREEMENT_SUFFIXES[output]
+    missing = [row for row in _agreement_rows(n)
+               if not os.path.exists(os.path.join(out_dir, f"tenancy_agreement_{row[2]}{suffix}"))]
+    if not missing:
+        return 0
+    print(f"📄 Generating {len(missing)} tenancy agreements ({output}) in {out_dir}")
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+    with ProcessPoolExecutor(processes) as pool:
+        return sum(pool.map(_generate_batch, [out_dir] * len(batches), batches, [output] * len(batches)))
+
+
+def make_corpus(n, agreements_dir, corpus_dir, output="pdf"):
+    """Folder linking the clause PDFs and agreements 1..n, as the bot's PDF folder would hold them"""
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    os.makedirs(corpus_dir)
+    clause_pdfs = [os.path.join(GENERATOR_DIR, file) for file in os.listdir(GENERATOR_DIR) if file.endswith(".pdf")]
+    agreements = [os.path.join(agreements_dir, f"tenancy_agreement_{i}{AGREEMENT_SUFFIXES[output]}")
+                  for i in range(1, n + 1)]
+    for path in clause_pdfs + agreements:
+        os.symlink(os.path.abspath(path), os.path.join(corpus_dir, os.path.basename(path)))
+    return corpus_dir
+
+
+def start_embedding_server(dim=1536):
+    """Run the local embedding stand-in on a free port in a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(dim, RateLimiter(0), 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    if resource is None:
+        return float("nan")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _ingest_corpus(corpus_dir, db_path, base_url):
+    """Build a store from one corpus; returns (vector store, embeddings, sync stats, seconds, RSS growth MB)"""
+    from langchain_community.vectorstores import Chroma
+    from embeddings import CachedEmbeddings, EmbeddingScheduler, ScheduledEmbeddings
+    from knowledge_base import sync_knowledge_base
+
+    warnings.filterwarnings('ignore')
+    # The extracted-text cache (CACHE_DIR) is relative to the working directory;
+    # an empty one makes every run parse its PDFs, as a first build would
+    scratch_dir = db_path + ".cwd"
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+    os.makedirs(scratch_dir)
+    os.chdir(scratch_dir)
+    rss_before = current_rss_mb()
+    # Same build path as load_and_process_pdf: bulk embedding through the scheduler,
+    # queries through a cache it checkpoints into (a fresh one, so nothing is pre-embedded)
+    scheduler = EmbeddingScheduler(api_key="local", base_url=base_url)
+    embeddings = CachedEmbeddings(ScheduledEmbeddings(scheduler), cache_path=db_path + ".cache.sqlite3",
+                                  model_name=scheduler.model)
+    scheduler.cache = embeddings
+    vectorstore = Chroma(persist_directory=db_path, embedding_function=embeddings)
+
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        stats = sync_knowledge_base(corpus_dir, vectorstore, db_path, embeddings=ScheduledEmbeddings(scheduler))
+    return vectorstore, embeddings, stats, time.perf_counter() - start, current_rss_mb() - rss_before
+
+
+def _run_scale_point(n, corpus_dir, db_path, base_url, questions, k, n_queries, results):
+    """Ingest one corpus into an empty store and time queries against it (runs in a fresh process)"""
+    from retrievers import PartitionedRetriever, TenantRetriever
+
+    vectorstore, embeddings, stats, ingest_seconds, rss_ingest = _ingest_corpus(corpus_dir, db_path, base_url)
+
+    # Query embeddings are cached up front, so the latencies are retrieval only
+    embeddings.embed_documents(questions)
+    rng = np.random.default_rng(0)
+    shared = PartitionedRetriever(vectorstore=vectorstore, k=k)
+    shared_latencies, tenant_latencies = [], []
+    for i in range(n_queries):
+        question = questions[i % len(questions)]
+        t = time.perf_counter()
+        shared.invoke(question)
+        shared_latencies.append(time.perf_counter() - t)
+        tenant = TenantRetriever(vectorstore=vectorstore, retriever=shared, tenant_key=str(rng.integers(1, n + 1)),
+                                 k=k)
+        t = time.perf_counter()
+        tenant.invoke(question)
+        tenant_latencies.append(time.perf_counter() - t)
+
+    shared_summary = latency_summary(shared_latencies)
+    tenant_summary = latency_summary(tenant_latencies)
+    results.put({
+        "agreements": n,
+        "pdfs": stats["added"],
+        "shared_chunks": vectorstore._collection.count(),
+        "chunks": stats["chunks_added"] + stats.get("chunks_deduplicated", 0),
+        "ingest_s": ingest_seconds,
+        "agreements_per_s": n / ingest_seconds,
+        "chunks_per_s": stats["chunks_added"] / ingest_seconds,
+        "disk_mb": directory_size(db_path) / 2**20,
+        "tenant_disk_mb": directory_size(os.path.join(db_path, TENANT_INDEX_DIR)) / 2**20,
+        "rss_ingest_mb": rss_ingest,
+        "peak_rss_mb": peak_rss_mb(),
+        "shared_p50_ms": shared_summary["p50_ms"], "shared_p95_ms": shared_summary["p95_ms"],
+        "tenant_p50_ms": tenant_summary["p50_ms"], "tenant_p95_ms": tenant_summary["p95_ms"],
+    })
+
+
+def _clear_store(db_path):
+    shutil.rmtree(db_path, ignore_errors=True)
+    for suffix in ("", "-wal", "-shm"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(db_path + ".cache.sqlite3" + suffix)
+
+
+def _run_path_point(corpus_dir, db_path, base_url, results):
+    """Ingest one corpus into an empty store (runs in a fresh process)"""
+    _, _, stats, ingest_seconds, _ = _ingest_corpus(corpus_dir, db_path, base_url)
+    results.put({"ingest_s": ingest_seconds, "extract_busy_s": stats["pipeline"]["extract"]["busy_s"],
+                 "chunks": stats["chunks_added"] + stats.get("chunks_deduplicated", 0), "leases": stats["leases"]})
+
+
+def ingestion_paths_report(sizes, workdir, dim=1536, processes=None):
+    """End-to-end time to get N agreements into the store as PDFs and as clause records.
+
+    Each path starts from nothing: the generator writes the agreements (rendering
+    PDFs or dumping clause records), then a fresh process builds an empty store from
+    them, parsing each PDF back to text on the PDF path and reading the records
+    directly on the other. Embedding goes to the local stand-in, so the figures are
+    the pipeline's own cost.
+    """
+    server, base_url = start_embedding_server(dim)
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    try:
+        for n in sizes:
+            for output in AGREEMENT_SUFFIXES:
+                agreements_dir = os.path.abspath(os.path.join(workdir, f"{output}_{n}", "agreements"))
+                shutil.rmtree(agreements_dir, ignore_errors=True)
+                start = time.perf_counter()
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    generate_agreements(n, agreements_dir, processes, output=output)
+                generate_seconds = time.perf_counter() - start
+                corpus_dir = make_corpus(n, agreements_dir, os.path.join(workdir, f"{output}_{n}", "corpus"), output)
+                db_path = os.path.join(os.path.dirname(agreements_dir), "db")
+                _clear_store(db_path)
+                results = context.Queue()
+                process = context.Process(target=_run_path_point, args=(corpus_dir, db_path, base_url, results))
+                process.start()
+                row = {"agreements": n, "path": output, "generate_s": generate_seconds, **results.get()}
+                process.join()
+                row["total_s"] = row["generate_s"] + row["ingest_s"]
+                row["agreements_per_s"] = n / row["total_s"]
+                rows.append(row)
+                print_path_rows(rows[-1:], header=len(rows) == 1)
+    finally:
+        server.shutdown()
+    return rows
+
+
+def scale_report(sizes, workdir, dim=1536, k=3, n_queries=200, processes=None):
+    """Generate, ingest and query corpora of each size; one row of figures per size"""
+    from ingestion_benchmark import load_questions
+
+    agreements_dir = os.path.join(workdir, "agreements")
+    generate_agreements(max(sizes), agreements_dir, processes)
+    questions = load_questions(QA_PATH)
+    server, base_url = start_embedding_server(dim)
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    try:
+        for n in sizes:
+            corpus_dir = make_corpus(n, agreements_dir, os.path.abspath(os.path.join(workdir, f"corpus_{n}")))
+            db_path = os.path.abspath(os.path.join(workdir, f"db_{n}"))
+            _clear_store(db_path)
+            results = context.Queue()
+            process = context.Process(target=_run_scale_point,
+                                      args=(n, corpus_dir, db_path, base_url, questions, k, n_queries, results))
+            process.start()
+            rows.append(results.get())
+            process.join()
+            shutil.rmtree(db_path + ".cwd", ignore_errors=True)
+            print_scale_rows(rows[-1:], header=len(rows) == 1)
+    finally:
+        server.shutdown()
+    return rows
+
+
+def collect_vectors(db_path, limit=None, seed=0):
+    """Chunk embeddings of a knowledge base: the shared collection plus all tenant indexes.
+
+    With a limit, a random sample of that many chunks is returned.
+    """
+    from langchain_community.vectorstores import Chroma
+
+    matrices = [np.asarray(Chroma(persist_directory=db_path).get(include=["embeddings"])["embeddings"],
+                           dtype=np.float32)]
+    tenant_dir = os.path.join(db_path, TENANT_INDEX_DIR)
+    for name in sorted(os.listdir(tenant_dir)) if os.path.isdir(tenant_dir) else []:
+        matrices.append(np.load(os.path.join(tenant_dir, name, "vectors.npy")))
+    matrix = np.concatenate([m for m in matrices if len(m)])
+    if limit and len(matrix) > limit:
+        matrix = matrix[np.sort(np.random.default_rng(seed).choice(len(matrix), limit, replace=False))]
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def hnsw_report(vectors, query_vectors, configs=HNSW_CONFIGS, k=3, construction_ef=HNSW_CONSTRUCTION_EF,
+                batch_size=5000):
+    """recall@k and latency of Chroma's HNSW index for each (M, ef_search) against exact search.
+
+    All chunks go into one collection, the layout the bot used before leases got
+    their own indexes. A returned chunk counts as a hit when its exact score reaches
+    the exact k-th score, since chunks with identical text have identical vectors.
+    """
+    import chromadb
+    from retrievers import top_k
+
+    _, exact_scores = top_k(query_vectors @ vectors.T, k)
+    rows = []
+    for m, ef_search in configs:
+        path = tempfile.mkdtemp(prefix="kb_hnsw_")
+        try:
+            client = chromadb.PersistentClient(path=path)
+            collection = client.create_collection("hnsw-benchmark", metadata={
+                "hnsw:space": "cosine", "hnsw:M": m,
+                "hnsw:construction_ef": construction_ef, "hnsw:search_ef": ef_search,
+            })
+            start = time.perf_counter()
+            for offset in range(0, len(vectors), batch_size):
+                batch = vectors[offset:offset + batch_size]
+                collection.add(ids=[str(i) for i in range(offset, offset + len(batch))], embeddings=batch.tolist())
+            build_seconds = time.perf_counter() - start
+
+            latencies, hits = [], []
+            for query_vector, scores in zip(query_vectors, exact_scores):
+                t = time.perf_counter()
+                found = collection.query(query_embeddings=[query_vector.tolist()], n_results=k, include=[])["ids"][0]
+                latencies.append(time.perf_counter() - t)
+                found_scores = vectors[[int(i) for i in found]] @ query_vector
+                hits.append(np.sum(found_scores >= scores[-1] - 1e-6) / k)
+            rows.append({"M": m, "ef_search": ef_search, "build_s": build_seconds,
+                         "recall": float(np.mean(hits)), **latency_summary(latencies)})
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+    return rows
+
+
+def print_scale_rows(rows, header=True):
+    if header:
+        print(f"{'N':>7}{'shared':>8}{'chunks':>9}{'ingest s':>10}{'agr/s':>8}{'chunk/s':>9}{'disk MB':>9}"
+              f"{'RSS +MB':>9}{'peak MB':>9}{'shared p50/p95 ms':>19}{'tenant p50/p95 ms':>19}")
+    for row in rows:
+        print(f"{row['agreements']:>7}{row['shared_chunks']:>8}{row['chunks']:>9}{row['ingest_s']:>10.1f}"
+              f"{row['agreements_per_s']:>8.1f}{row['chunks_per_s']:>9.0f}{row['disk_mb']:>9.1f}"
+              f"{row['rss_ingest_mb']:>9.0f}{row['peak_rss_mb']:>9.0f}"
+              f"{row['shared_p50_ms']:>10.2f}/{row['shared_p95_ms']:<8.2f}{row['tenant_p50_ms']:>10.2f}/{row['tenant_p95_ms']:<8.2f}")
+
+
+def print_path_rows(rows, header=True):
+    if header:
+        print(f"{'N':>7}  {'path':<8}{'chunks':>9}{'generate s':>12}{'extract s':>11}{'ingest s':>10}{'total s':>9}"
+              f"{'agr/s':>8}")
+    for row in rows:
+        print(f"{row['agreements']:>7}  {row['path']:<8}{row['chunks']:>9}{row['generate_s']:>12.1f}"
+              f"{row['extract_busy_s']:>11.1f}{row['ingest_s']:>10.1f}{row['total_s']:>9.1f}{row['agreements_per_s']:>8.1f}")
+
+
+def print_hnsw_rows(rows, k=3):
+    print(f"{'M':>4}{'ef':>6}{'build s':>9}{f'R@{k}':>8}{'p50 ms':>9}{'p95 ms':>9}")
+    for row in rows:
+        print(f"{row['M']:>4}{row['ef_search']:>6}{row['build_s']:>9.1f}{row['recall']:>8.3f}"
+              f"{row['p50_ms']:>9.3f}{row['p95_ms']:>9.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest and query N generated tenancy agreements for several N")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="agreement counts to benchmark")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "kb_scale_benchmark"),
+                        help="where generated PDFs (kept between runs) and stores are written")
+    parser.add_argument("--dim", type=int, default=1536, help="embedding size of the local stand-in")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--processes", type=int, help="worker processes for generating PDFs")
+    parser.add_argument("--hnsw", action="store_true",
+                        help="also compare HNSW M/ef_search recall against exact search on the largest store")
+    parser.add_argument("--hnsw-chunks", type=int, default=20000,
+                        help="chunks sampled from the largest store for --hnsw (0 for all)")
+    parser.add_argument("--paths", action="store_true",
+                        help="instead compare generating and ingesting agreements as PDFs and as clause records")
+    args = parser.parse_args()
+
+    sizes = sorted(args.sizes)
+    if args.paths:
+        print(f"📊 Agreements {sizes} as PDFs and as clause records, workdir: {args.workdir}")
+        ingestion_paths_report(sizes, args.workdir, args.dim, args.processes)
+    else:
+        print(f"📊 Agreements {sizes}, k={args.k}, {args.queries} queries per size, workdir: {args.workdir}")
+        scale_report(sizes, args.workdir, args.dim, args.k, args.queries, args.processes)
+        if args.hnsw:
+            vectors = collect_vectors(os.path.join(args.workdir, f"db_{sizes[-1]}"), args.hnsw_chunks)
+            # Lease chunks repeating the same clause text have identical vectors, which HNSW handles poorly
+            distinct = len(np.unique(vectors.round(5), axis=0))
+            print(f"📊 HNSW vs exact search over {len(vectors)} chunks, {distinct} distinct "
+                  f"(ef_construction={HNSW_CONSTRUCTION_EF})")
+            print_hnsw_rows(hnsw_report(vectors, queries_near(vectors, args.queries), k=args.k), args.k)
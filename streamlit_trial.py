@@ -9,6 +9,7 @@ from dotenv import load_dotenv
 try:
     # Import the model
     from model import PropertySupportBot
+    from quick_answers import QUICK_QUESTIONS, QuickAnswers
 except ImportError as e:
     st.error(f"❌ Error importing model: {e}")
     st.error("Please ensure all required files are present and dependencies are installed.")
@@ -266,6 +267,18 @@ def initialize_ai_model():
 # Initialize the model
 ai_bot = initialize_ai_model()
 
+@st.cache_resource
+def initialize_quick_answers(_bot):
+    """Answer the common questions in the background and keep them current as the knowledge base changes"""
+    if _bot is None:
+        return None
+    # One store and refresh thread per process, answering for every tenant it is given
+    return QuickAnswers(_bot, QUICK_QUESTIONS, tenants=()).start()
+
+quick_answers = initialize_quick_answers(ai_bot)
+if quick_answers is not None:
+    quick_answers.add_tenant(st.session_state.user_info['tenant_id'])
+
 # Test API connection
 def test_api_connection():
     """Test if the API connection is working"""
@@ -299,7 +312,7 @@ async def generate_response(user_input):
         try:
             # Set timeout for API calls (30 seconds)
             response = await asyncio.wait_for(
-                ai_bot.process_query_async(user_input), 
+                ai_bot.process_query_async(user_input, st.session_state.user_info['tenant_id']), 
                 timeout=30.0
             )
             return response
@@ -322,12 +335,7 @@ with st.sidebar:
     # Common questions
     st.markdown("#### Common Questions")
     
-    example_questions = [
-        "When is my rent due?",
-        "How long is the defect free period?",
-        "Can I keep pets?",
-        "Who has to pay for repairs?"
-    ]
+    example_questions = QUICK_QUESTIONS
     
     for question in example_questions:
         if st.button(question, key=f"q_{question}", use_container_width=True):
@@ -337,11 +345,14 @@ with st.sidebar:
                 'timestamp': datetime.now()
             })
             
-            # Use AI model if available, otherwise show placeholder
-            if ai_bot is not None:
+            # Use the precomputed answer if it is ready, else the AI model if available, otherwise show placeholder
+            response = None
+            if quick_answers is not None:
+                response = quick_answers.get(question, st.session_state.user_info['tenant_id'])
+            if response is None and ai_bot is not None:
                 import asyncio
                 response = asyncio.run(generate_response(question))
-            else:
+            elif response is None:
                 response = "Retrieving information, please wait... (AI model not available)"
             
             st.session_state.messages.append({
@@ -359,6 +370,9 @@ with st.sidebar:
         if api_working:
             st.success("✅ AI Model Active & Connected")
             st.caption("Powered by GPT-4o-mini + RAG")
+            if quick_answers is not None:
+                ready = quick_answers.ready(st.session_state.user_info['tenant_id'])
+                st.caption(f"⚡ {ready}/{len(QUICK_QUESTIONS)} common questions answered instantly")
         else:
             st.warning("⚠️ AI Model Loaded but API Issues")
             st.caption("Check API key or network connection")
@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import hashlib
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+# model.py refuses to import without a key; no test calls the API
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic bag-of-words embeddings: each word hashed into one of `size` dimensions"""
+
+    def __init__(self, size=64, model="fake-embeddings"):
+        self.size = size
+        self.model = model
+        self.calls = 0
+
+    def embed_query(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.size] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [self.embed_query(text) for text in texts]
+
+
+def agreement(rate=10, ref_no=None, extra=None):
+    """Clause records of a small shared agreement; `rate` is the rent arrears interest rate"""
+    records = [
+        {"section": "1. The Tenant hereby agrees with the Landlord as follows:",
+         "heading": "(a) RENT",
+         "text": "To pay the rent on the first day of each month in advance without any deduction "
+                 "whatsoever to the Landlord by bank transfer or cheque at the address of the Landlord."},
+        {"section": "1. The Tenant hereby agrees with the Landlord as follows:",
+         "heading": "(b) INTEREST FOR RENT ARREARS",
+         "text": f"If the rent or any part of it remains unpaid for seven days after becoming due the Tenant "
+                 f"shall pay interest on the amount unpaid at the rate of {rate} per cent per annum from the "
+                 f"date it became due until the date of payment in full to the Landlord."},
+        {"section": "2. The Landlord hereby agrees with the Tenant as follows:",
+         "heading": "(a) PAYMENT OF PROPERTY TAX",
+         "text": "To pay all property tax and assessments charged on the premises during the term of the "
+                 "tenancy and to keep the Tenant indemnified against all claims arising from them."},
+    ]
+    for record in records:
+        record["property_type"] = "CONDOMINIUM"
+        if ref_no:
+            record["ref_no"] = ref_no
+    return records + list(extra or [])
+
+
+def write_records(folder, name, records):
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(records, f)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    """Run each test in its own directory, so relative cache paths (.kb_cache) stay out of the repo"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def embeddings():
+    return FakeEmbeddings()
+
+
+@pytest.fixture
+def open_store(embeddings):
+    from langchain_community.vectorstores import Chroma
+
+    def open_store(db_path):
+        return Chroma(persist_directory=str(db_path), embedding_function=embeddings)
+    return open_store
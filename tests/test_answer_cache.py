@@ -0,0 +1,64 @@
+import functools
+
+from answer_cache import AnswerCache, place_terms
+
+IR = "information_retrieval"
+DATA = "property_data_analysis"
+
+
+def test_repeated_query_is_answered_from_the_cache(embeddings):
+    cache = AnswerCache()
+    cache.add("Can I keep pets in my condo?", embeddings, IR, "Only with the landlord's consent.", version="v1")
+
+    entry = cache.lookup("can I keep pets in my condo?", embeddings, versions={IR: "v1"})
+
+    assert entry["answer"] == "Only with the landlord's consent."
+    assert entry["similarity"] >= cache.threshold(IR)
+    assert cache.stats()["hits_by_route"] == {IR: 1}
+
+
+def test_new_data_version_drops_only_that_routes_answers(embeddings):
+    cache = AnswerCache()
+    cache.add("Can I keep pets in my condo?", embeddings, IR, "Only with consent.", version="v1")
+    cache.add("Average rent of condos in Bishan?", embeddings, DATA, "$4,000", version="csv1")
+
+    assert cache.lookup("Can I keep pets in my condo?", embeddings, versions={IR: "v2", DATA: "csv1"}) is None
+    assert cache.stats()["invalidated"] == 1
+    assert cache.lookup("Average rent of condos in Bishan?", embeddings,
+                        versions={IR: "v2", DATA: "csv1"})["answer"] == "$4,000"
+    assert cache.lookup("Average rent of condos in Bishan?", embeddings, versions={IR: "v2", DATA: "csv2"}) is None
+
+
+def test_answers_are_not_shared_across_tenants(embeddings):
+    cache = AnswerCache()
+    cache.add("When is my rent due?", embeddings, IR, "On the 1st.", tenant="SPPL/2023/0007", version="v1")
+
+    assert cache.lookup("When is my rent due?", embeddings, tenant="SPPL/2023/0008", versions={IR: "v1"}) is None
+    assert cache.lookup("When is my rent due?", embeddings, tenant="SPPL/2023/0007", versions={IR: "v1"})
+
+
+def test_queries_naming_other_places_do_not_match(embeddings):
+    cache = AnswerCache(places={"bishan", "bedok"})
+    cache.add("Average rent of condos in Bishan?", embeddings, DATA, "$4,000", version="csv1")
+
+    assert cache.lookup("Average rent of condos in Bedok?", embeddings, versions={DATA: "csv1"}) is None
+
+
+def test_places_are_read_on_first_use(tmp_path, embeddings):
+    csv_path = tmp_path / "properties.csv"
+    # Nothing is read while the cache is created, so the database may not exist yet
+    cache = AnswerCache(places=functools.partial(place_terms, str(csv_path)))
+    csv_path.write_text("town,street_name,monthly_rent\nBISHAN,BISHAN ST 13,4000\nBEDOK,BEDOK NTH AVE 1,3500\n")
+    cache.add("Average rent of condos in Bishan?", embeddings, DATA, "$4,000", version="csv1")
+
+    assert cache.lookup("Average rent of condos in Bedok?", embeddings, versions={DATA: "csv1"}) is None
+    assert cache.lookup("Average rent of condos in Bishan?", embeddings, versions={DATA: "csv1"})
+
+
+def test_expired_answers_are_dropped(embeddings):
+    cache = AnswerCache(ttl=0)
+    cache.add("Can I keep pets in my condo?", embeddings, IR, "Only with consent.", version="v1")
+    cache.entries[0]["created"] -= 1
+
+    assert cache.lookup("Can I keep pets in my condo?", embeddings, versions={IR: "v1"}) is None
+    assert cache.stats()["expired"] == 1
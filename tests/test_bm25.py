@@ -0,0 +1,98 @@
+import math
+
+import pytest
+
+from bm25 import BM25Index, tokenize
+from knowledge_base import load_bm25_index
+from retrievers import HybridRetriever, build_retriever, reciprocal_rank_fusion
+
+CHUNKS = {
+    "rent": "The Tenant shall pay the rent every month in advance.",
+    "giro": "Payment shall be made by GIRO deduction from the Tenant's bank account.",
+    "pets": "No pets shall be kept on the premises without the Landlord's consent.",
+    "aircon": "The Tenant shall service the air-con units every three months.",
+}
+
+
+def reference_scores(index, query):
+    """BM25 score of every chunk computed straight from the definition"""
+    n_docs = len(index.doc_lengths)
+    avg_length = index.total_length / n_docs
+    scores = {}
+    for chunk_id, text in CHUNKS.items():
+        counts = {term: tokenize(text).count(term) for term in set(tokenize(query))}
+        score = 0.0
+        for term, tf in counts.items():
+            df = sum(term in tokenize(other) for other in CHUNKS.values())
+            if not tf or not df:
+                continue
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = index.k1 * (1 - index.b + index.b * len(tokenize(text)) / avg_length)
+            score += idf * tf * (index.k1 + 1) / (tf + norm)
+        if score:
+            scores[chunk_id] = score
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def test_tokenize_matches_hyphenated_and_plural_terms():
+    assert tokenize("Who services the air-con?") == ["service", "air-con", "aircon", "air", "con"]
+    assert tokenize("pets and repairs") == ["pet", "repair"]
+
+
+def test_bm25_search_matches_the_reference_scores():
+    index = BM25Index()
+    index.add(list(CHUNKS), list(CHUNKS.values()))
+
+    for query in ["pay rent by giro", "can I keep pets", "aircon servicing every month"]:
+        results = index.search(query, k=len(CHUNKS))
+        expected = reference_scores(index, query)
+        assert [chunk_id for chunk_id, _ in results] == [chunk_id for chunk_id, _ in expected]
+        assert [score for _, score in results] == pytest.approx([score for _, score in expected])
+
+
+def test_bm25_updates_match_a_fresh_build(tmp_path):
+    index = BM25Index()
+    index.add(list(CHUNKS), list(CHUNKS.values()))
+    index.add(["pets"], ["Cats and dogs are allowed with consent."])
+    index.remove(["giro"])
+    index.save(str(tmp_path / "bm25.json"))
+
+    fresh = BM25Index()
+    fresh.add(["rent", "pets", "aircon"], [CHUNKS["rent"], "Cats and dogs are allowed with consent.",
+                                           CHUNKS["aircon"]])
+    loaded = BM25Index.load(str(tmp_path / "bm25.json"))
+    for candidate in (index, loaded):
+        assert candidate.search("giro dogs rent", k=3) == pytest.approx(fresh.search("giro dogs rent", k=3))
+    assert loaded.search("giro") == []
+
+
+def test_empty_or_missing_bm25_index_finds_nothing(tmp_path):
+    index = BM25Index.load(str(tmp_path / "missing.json"))
+    assert len(index) == 0
+    assert index.search("rent") == []
+
+
+def test_reciprocal_rank_fusion_adds_weighted_reciprocal_ranks():
+    fused = dict(reciprocal_rank_fusion([["a", "b"], ["b", "c"]], [1.0, 2.0], rrf_k=10))
+    assert fused == pytest.approx({"a": 1 / 11, "b": 1 / 12 + 2 / 11, "c": 2 / 12})
+
+
+def test_hybrid_retriever_adds_keyword_matches_missed_by_vector_search(tmp_path, open_store):
+    db_path = tmp_path / "db"
+    store = open_store(db_path)
+    store.add_texts(list(CHUNKS.values()), ids=list(CHUNKS))
+    retriever = HybridRetriever(vectorstore=store, bm25=load_bm25_index(store, str(db_path)), k=2, candidates=1)
+
+    # Vector search ranks the GIRO clause first, BM25 the rent clause (one candidate each)
+    docs = retriever.invoke("is the rent paid by giro")
+
+    assert [doc.metadata["id"] for doc in docs] == ["giro", "rent"]
+    # The keyword-only match is fetched from the store by ID
+    assert docs[1].page_content == CHUNKS["rent"]
+
+
+def test_hybrid_retriever_on_an_empty_store(tmp_path, open_store):
+    store = open_store(tmp_path / "db")
+    assert build_retriever(store, "hybrid").invoke("rent") == []
+    with pytest.raises(ValueError):
+        build_retriever(store, "bm25")
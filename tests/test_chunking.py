@@ -0,0 +1,68 @@
+from langchain_core.documents import Document
+
+from chunking import ClauseTextSplitter, records_text
+from conftest import agreement
+
+PAGES = [
+    Document(page_content="1\nTENANCY AGREEMENT\nThis AGREEMENT is made between the Landlord and the Tenant "
+                          "named below, for the premises described in the schedule.\n"
+                          "1. The Tenant hereby agrees with the Landlord as follows:\n(a) RENT\n"
+                          "To pay the rent on the first day of each month in advance.\n(b) DEFECT FREE PERIOD\n"
+                          "The Landlord shall be responsible for defects reported within the first",
+             metadata={"source": "agreement.pdf", "page": 0}),
+    Document(page_content="2\nthirty (30) days of the term, (a) except those caused by the Tenant.\n"
+                          "2. The Landlord hereby agrees with the Tenant as follows:\n(a) PROPERTY TAX\n"
+                          "To pay all property tax on the premises.",
+             metadata={"source": "agreement.pdf", "page": 1}),
+]
+
+
+def test_each_clause_becomes_one_chunk_with_its_headings():
+    chunks = ClauseTextSplitter().split_documents(PAGES)
+
+    assert [(chunk.metadata.get("section", "")[:2], chunk.metadata.get("heading"), chunk.metadata["page"])
+            for chunk in chunks] == [("", None, 0), ("1.", "(a) RENT", 0), ("1.", "(b) DEFECT FREE PERIOD", 0),
+                                     ("2.", "(a) PROPERTY TAX", 1)]
+    # The section title is too short to stand alone and leads its first clause
+    assert chunks[1].page_content.startswith("1. The Tenant hereby agrees")
+    # A clause continues across the page break, without the page number, and a lower-case "(a)" is not a heading
+    assert chunks[2].page_content.endswith("within the first\nthirty (30) days of the term, (a) except those "
+                                           "caused by the Tenant.")
+    assert all(chunk.metadata["source"] == "agreement.pdf" for chunk in chunks)
+
+
+def test_oversized_clauses_are_split_with_the_heading_repeated():
+    long_clause = " ".join(f"The Tenant shall observe rule {i}." for i in range(60))
+    page = Document(page_content=f"1. The Tenant hereby agrees with the Landlord as follows:\n(a) HOUSE RULES\n"
+                                 f"{long_clause}", metadata={"page": 0})
+
+    chunks = ClauseTextSplitter(chunk_size=500, chunk_overlap=50).split_documents([page])
+
+    assert len(chunks) > 1
+    assert [chunk.metadata["part"] for chunk in chunks] == list(range(len(chunks)))
+    assert all(chunk.page_content.startswith("(a) HOUSE RULES (cont.)") for chunk in chunks[1:])
+    assert all(len(chunk.page_content) <= 500 + len("(a) HOUSE RULES (cont.)\n") for chunk in chunks)
+
+
+def test_records_split_like_the_text_of_their_pdf():
+    records = agreement(ref_no="SPPL/2023/0007")
+    splitter = ClauseTextSplitter()
+
+    from_records = splitter.split_records(records, {"source": "lease.clauses.json"})
+    from_text = splitter.split_documents([Document(page_content=records_text(records), metadata={"page": 0})])
+
+    assert [chunk.page_content for chunk in from_records] == [chunk.page_content for chunk in from_text]
+    assert [chunk.metadata.get("heading") for chunk in from_records] == [
+        "(a) RENT", "(b) INTEREST FOR RENT ARREARS", "(a) PAYMENT OF PROPERTY TAX"]
+    assert all("page" not in chunk.metadata for chunk in from_records)
+
+
+def test_empty_and_heading_free_documents():
+    splitter = ClauseTextSplitter()
+    assert splitter.split_documents([]) == []
+    assert splitter.split_records([]) == []
+
+    # A short document without any heading is kept whole on its last page
+    chunks = splitter.split_documents([Document(page_content="Annex", metadata={"page": 0}),
+                                       Document(page_content="3", metadata={"page": 1})])
+    assert [(chunk.page_content, chunk.metadata["page"]) for chunk in chunks] == [("Annex", 1)]
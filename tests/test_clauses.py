@@ -0,0 +1,96 @@
+from clauses import CLAUSE_INDEX_FILE, ClauseIndex, heading_key
+from conftest import agreement, write_records
+from knowledge_base import load_clause_index, sync_knowledge_base
+from retrievers import ClauseRetriever, build_retriever
+
+CHUNKS = [
+    ("rent", "To pay the rent monthly.", {"heading": "(a) RENT", "pt_standard": True}),
+    ("arrears", "Interest at 10 per cent.", {"heading": "(b) INTEREST FOR RENT ARREARS", "pt_standard": True}),
+    ("condo-pets", "Pets with MCST approval.", {"heading": "(c) PETS", "pt_condo": True}),
+    ("hdb-pets", "No pets in the flat.", {"heading": "(d) PETS", "pt_hdb": True}),
+    ("stamping", "The Tenant pays stamp duty.", {"heading": "(k) STAMPING", "pt_standard": True}),
+    ("plain", "Schedule of fittings.", {"page": 3}),
+]
+
+
+def clause_index():
+    return ClauseIndex.from_chunks(*zip(*CHUNKS))
+
+
+class RecordingRetriever:
+    """Stands in for vector search and records the queries that reach it"""
+
+    def __init__(self):
+        self.queries = []
+
+    def invoke(self, query):
+        self.queries.append(query)
+        return []
+
+
+def test_queries_naming_a_clause_match_its_heading_or_synonyms():
+    index = clause_index()
+
+    assert heading_key("(b) INTEREST FOR RENT ARREARS") == "interest rent arrear"
+    assert len(index) == 4
+    assert index.match("What is the interest for rent arrears?") == ["interest rent arrear"]
+    assert index.match("Is there late payment interest?") == ["interest rent arrear"]
+    # One-word headings need the word "clause" or a synonym, so a passing mention does not count
+    assert index.match("When is the rent due?") == []
+    assert index.match("What does the stamping clause say?") == ["stamping"]
+    assert index.match("Who pays stamp duty and can I keep pets?") == ["stamping", "pet"]
+
+
+def test_lookup_keeps_the_named_property_types_clauses():
+    index = clause_index()
+
+    assert [doc.metadata["id"] for doc in index.lookup("can I keep pets in my condo")] == ["condo-pets"]
+    assert [doc.metadata["id"] for doc in index.lookup("can I keep pets in my HDB flat")] == ["hdb-pets"]
+    docs = index.lookup("can I keep pets")
+    assert [doc.metadata["id"] for doc in docs] == ["condo-pets", "hdb-pets"]
+    assert docs[0].metadata["clause"] == "pet"
+    assert index.lookup("schedule of fittings") == []
+
+
+def test_clause_index_round_trips_and_a_missing_file_loads_as_none(tmp_path):
+    path = str(tmp_path / CLAUSE_INDEX_FILE)
+    clause_index().save(path)
+
+    loaded = ClauseIndex.load(path)
+
+    assert loaded.chunk_count == len(CHUNKS)
+    assert loaded.match("late rent") == ["interest rent arrear"]
+    assert ClauseIndex.load(str(tmp_path / "missing.json")) is None
+
+
+def test_named_clauses_skip_vector_search():
+    fallback = RecordingRetriever()
+    retriever = ClauseRetriever(clauses=clause_index(), retriever=fallback, k=3)
+
+    docs = retriever.invoke("What does the stamping clause say?")
+    assert [doc.page_content for doc in docs] == ["The Tenant pays stamp duty."]
+    assert fallback.queries == []
+
+    assert retriever.invoke("When is the rent due?") == []
+    assert fallback.queries == ["When is the rent due?"]
+
+
+def test_clause_index_follows_the_knowledge_base(tmp_path, open_store):
+    folder, db_path = str(tmp_path / "docs"), str(tmp_path / "db")
+    write_records(folder, "shared.clauses.json", agreement())
+    store = open_store(db_path)
+    sync_knowledge_base(folder, store, db_path)
+
+    docs = build_retriever(store, "numpy", k=3, clause_lookup=True).invoke("Is there late payment interest?")
+    assert len(docs) == 1 and "10 per cent" in docs[0].page_content
+
+    # An index saved for a different number of chunks is stale and rebuilt
+    pets = {"section": "1. The Tenant hereby agrees with the Landlord as follows:", "heading": "(c) PETS",
+            "text": "Not to keep any pets on the premises without the prior written consent of the Landlord.",
+            "property_type": "CONDOMINIUM"}
+    write_records(folder, "shared.clauses.json", agreement(extra=[pets]))
+    sync_knowledge_base(folder, store, db_path)
+    ClauseIndex().save(str(tmp_path / "db" / CLAUSE_INDEX_FILE))
+    index = load_clause_index(store, db_path)
+    assert index.chunk_count == 4
+    assert [doc.metadata["heading"] for doc in index.lookup("can I keep pets")] == ["(c) PETS"]
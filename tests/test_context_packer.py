@@ -0,0 +1,89 @@
+from langchain_core.documents import Document
+
+from context_packer import LLM_MODEL, ContextPacker, PackedRetriever, fit_to_budget, split_sentences, trim_to_query
+from embeddings import count_tokens
+
+ARREARS = ("(b) INTEREST FOR RENT ARREARS If the rent remains unpaid for seven days the Tenant shall pay interest. "
+           "The interest is charged at 10 per cent per annum. The Landlord may also deduct it from the deposit. "
+           "The Tenant shall keep the premises clean. The Tenant shall not sublet the premises.")
+
+
+def clause(name, sentences=8, score=None):
+    text = " ".join(f"The Tenant shall observe {name} rule number {i} at all times on the premises."
+                    for i in range(sentences))
+    metadata = {"id": name} if score is None else {"id": name, "score": score}
+    return Document(page_content=text, metadata=metadata)
+
+
+class ListRetriever:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def invoke(self, query):
+        return list(self.docs)
+
+
+def test_trim_keeps_the_first_sentence_and_those_the_query_names():
+    trimmed = trim_to_query(ARREARS, {"interest", "deposit", "tenant"})
+
+    # "tenant" is in most sentences and does not pick any
+    assert split_sentences(trimmed) == [
+        "(b) INTEREST FOR RENT ARREARS If the rent remains unpaid for seven days the Tenant shall pay interest.",
+        "The interest is charged at 10 per cent per annum.",
+        "The Landlord may also deduct it from the deposit.",
+        "...",
+    ]
+    assert trim_to_query(ARREARS, {"aircon"}) == ARREARS
+    assert trim_to_query("One sentence. Two sentences.", {"two"}) == "One sentence. Two sentences."
+
+
+def test_fit_to_budget_keeps_whole_leading_sentences():
+    fitted = fit_to_budget(ARREARS, 30)
+
+    assert count_tokens(fitted, LLM_MODEL) <= 30
+    assert ARREARS.startswith(fitted) and fitted.endswith(".")
+    # A first sentence over the budget is cut by characters
+    assert fit_to_budget("word " * 500, 10) == ("word " * 500)[:40]
+
+
+def test_packed_context_stays_within_the_budget_best_first():
+    docs = [clause("pets", score=0.9), clause("aircon", score=0.8), clause("bulbs", sentences=2, score=0.7)]
+    packer = ContextPacker(token_budget=200, trim=False)
+
+    packed, stats = packer.pack("can I keep pets", docs)
+
+    # The second chunk does not fit but the shorter third one still does
+    assert [doc.metadata["id"] for doc in packed] == ["pets", "bulbs"]
+    assert stats["tokens"] == sum(doc.metadata["context_tokens"] for doc in packed) <= 200
+    assert stats["tokens_saved"] == sum(count_tokens(doc.page_content, LLM_MODEL) for doc in docs) - stats["tokens"]
+
+    # A budget smaller than the best chunk still sends its leading sentences
+    packed, stats = ContextPacker(token_budget=40, trim=False).pack("can I keep pets", docs)
+    assert [doc.metadata["id"] for doc in packed] == ["pets"]
+    assert 0 < stats["tokens"] <= 40
+
+
+def test_budget_larger_than_the_chunks_passes_them_unchanged():
+    docs = [clause("pets", score=0.9), clause("aircon", score=0.1), clause("bulbs")]
+
+    packed, stats = ContextPacker(token_budget=10000, trim=False).pack("can I keep pets", docs)
+    assert [doc.page_content for doc in packed] == [doc.page_content for doc in docs]
+    assert stats["tokens_saved"] == 0
+
+    # The cutoff drops the low-scored chunk; a chunk without a score always passes
+    packed, _ = ContextPacker(token_budget=10000, score_cutoff=0.5, trim=False).pack("can I keep pets", docs)
+    assert [doc.metadata["id"] for doc in packed] == ["pets", "bulbs"]
+
+
+def test_packed_retriever_records_each_query():
+    packer = ContextPacker(token_budget=250)
+    assert packer.summary() == {"queries": 0}
+    retriever = PackedRetriever(retriever=ListRetriever([clause("pets"), clause("aircon")]), packer=packer, k=2)
+
+    for query in ["can I keep pets", "who services the aircon"]:
+        assert retriever.invoke(query)
+
+    summary = packer.summary()
+    assert summary["queries"] == 2
+    assert summary["tokens_per_query"] <= 250
+    assert 0 < summary["saved_ratio"] < 1
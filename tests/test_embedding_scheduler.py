@@ -0,0 +1,66 @@
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import openai
+import pytest
+
+from conftest import FakeEmbeddings
+from embeddings import CachedEmbeddings, EmbeddingScheduler, hash_embedding
+from local_embedding_server import RateLimiter, make_handler
+
+DIM = 32
+TEXTS = [f"clause {i}: the tenant shall pay the rent on day {i} of each month" for i in range(8)]
+
+
+@pytest.fixture
+def server():
+    """Start the local embedding stand-in on a free port; returns a function taking its rate limit"""
+    servers = []
+
+    def start(rate_limit=0.0):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(DIM, RateLimiter(rate_limit), 0))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1"
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def scheduler(base_url, cache=None, **options):
+    return EmbeddingScheduler(api_key="sk-test", base_url=base_url, cache=cache, max_batch_size=1, **options)
+
+
+def test_rate_limited_batches_back_off_and_still_complete(server):
+    # Four requests a second for eight single-text batches sent four at a time
+    embedder = scheduler(server(rate_limit=4))
+
+    vectors = asyncio.run(embedder.aembed(TEXTS + TEXTS[:2]))
+
+    assert np.allclose(vectors, [hash_embedding(text, DIM) for text in TEXTS + TEXTS[:2]], atol=1e-6)
+    assert embedder.last_run["batches"] == len(TEXTS)
+    assert embedder.last_run["rate_limited"] > 0
+    assert embedder.last_run["retries"] >= embedder.last_run["rate_limited"]
+
+
+def test_rate_limit_beyond_the_retries_fails_the_build(server):
+    embedder = scheduler(server(rate_limit=0.01), max_retries=0)
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(embedder.aembed(TEXTS[:2]))
+
+
+def test_finished_batches_are_checkpointed_into_the_cache(server, tmp_path):
+    cache = CachedEmbeddings(FakeEmbeddings(), cache_path=str(tmp_path / "cache.sqlite"),
+                             model_name="text-embedding-ada-002")
+    asyncio.run(scheduler(server(), cache).aembed(TEXTS))
+
+    # A resumed build against an endpoint that now rejects everything only needs the cache
+    resumed = scheduler(server(rate_limit=0.01), cache, max_retries=0)
+    vectors = asyncio.run(resumed.aembed(TEXTS))
+
+    assert np.allclose(vectors, [hash_embedding(text, DIM) for text in TEXTS], atol=1e-6)
+    assert resumed.last_run["batches"] == 0
@@ -0,0 +1,201 @@
+import os
+import json
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import FakeEmbeddings, agreement, write_records
+from embeddings import LocalEmbeddings
+from kb_versions import (
+    BUILDING_FILE, compact, current_version, directory_size, gc_versions, list_versions, load_and_process_pdf,
+    new_version, publish_version, version_path
+)
+from knowledge_base import DB_PATH, chunking_params, load_manifest, manifest_matches, sync_knowledge_base
+from retrievers import NUMPY_INDEX_DIR, SECTION_INDEX_DIR
+
+
+def published(root, count):
+    versions = []
+    for _ in range(count):
+        version, _ = new_version(root)
+        publish_version(version, root)
+        versions.append(version)
+    return versions
+
+
+def mark_built_by(path, pid, started=None):
+    with open(os.path.join(path, BUILDING_FILE), "w", encoding="utf-8") as f:
+        json.dump({"pid": pid, "host": socket.gethostname(), "started": started or time.time()}, f)
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_publish_switches_the_live_version(tmp_path):
+    root = str(tmp_path / "kb")
+    version, path = new_version(root)
+    assert current_version(root) is None
+    assert os.path.exists(os.path.join(path, BUILDING_FILE))
+
+    publish_version(version, root)
+
+    assert current_version(root) == version
+    assert not os.path.exists(os.path.join(path, BUILDING_FILE))
+
+
+def test_version_names_sort_by_creation_time(tmp_path):
+    root = str(tmp_path / "kb")
+    versions = [new_version(root)[0] for _ in range(3)]
+    assert list_versions(root) == versions
+    assert versions[0].startswith(time.strftime("%Y%m%d", time.gmtime()))
+
+
+def test_gc_keeps_the_newest_published_versions(tmp_path):
+    root = str(tmp_path / "kb")
+    versions = published(root, 4)
+
+    assert gc_versions(root, keep=2) == versions[:2]
+    assert list_versions(root) == versions[2:]
+
+
+def test_gc_leaves_a_build_in_progress_alone(tmp_path):
+    root = str(tmp_path / "kb")
+    building, _ = new_version(root)
+    live = published(root, 1)[0]
+
+    assert gc_versions(root) == []
+    assert list_versions(root) == [building, live]
+    # The build still publishes once it finishes
+    publish_version(building, root)
+    assert current_version(root) == building
+
+
+def test_gc_collects_abandoned_builds(tmp_path):
+    root = str(tmp_path / "kb")
+    crashed, crashed_path = new_version(root)
+    mark_built_by(crashed_path, exited_pid())
+    stale, stale_path = new_version(root)
+    mark_built_by(stale_path, os.getpid(), started=time.time() - 2 * 24 * 3600)
+    published(root, 1)
+
+    assert gc_versions(root) == [crashed, stale]
+    with pytest.raises(RuntimeError):
+        publish_version(crashed, root)
+
+
+def build(folder, root, embeddings=None, **options):
+    return load_and_process_pdf(folder, embeddings or FakeEmbeddings(), root=root, **options)
+
+
+def test_manifest_records_the_embedding_model(tmp_path):
+    folder, root = str(tmp_path / "docs"), str(tmp_path / "kb")
+    write_records(folder, "agreement.clauses.json", agreement())
+    build(folder, root)
+    live = version_path(current_version(root), root)
+
+    assert load_manifest(live)["chunking"]["embedding_model"] == "fake-embeddings"
+    assert manifest_matches(folder, live, chunking_params(embedding_model="fake-embeddings"))
+    assert not manifest_matches(folder, live, chunking_params(embedding_model="other-model"))
+
+
+def test_fast_start_attaches_only_for_the_same_model(tmp_path):
+    folder, root = str(tmp_path / "docs"), str(tmp_path / "kb")
+    write_records(folder, "agreement.clauses.json", agreement())
+    build(folder, root)
+    first = current_version(root)
+
+    build(folder, root)
+    assert current_version(root) == first
+
+    store = build(folder, root, FakeEmbeddings(model="other-model"))
+    assert current_version(root) != first
+    assert store._collection.count() == 3
+
+
+def test_switching_to_local_embeddings_rebuilds(tmp_path):
+    folder, root = str(tmp_path / "docs"), str(tmp_path / "kb")
+    write_records(folder, "agreement.clauses.json", agreement())
+    build(folder, root)
+    openai_version = current_version(root)
+
+    store = build(folder, root, embedding_backend="local")
+
+    local_version = current_version(root)
+    assert local_version != openai_version
+    assert isinstance(store.embeddings, LocalEmbeddings)
+    assert load_manifest(version_path(local_version, root))["chunking"]["embedding_model"] == store.embeddings.model
+    # Starting again with the local backend attaches to its own build
+    store = build(folder, root, embedding_backend="local")
+    assert current_version(root) == local_version
+    assert isinstance(store.embeddings, LocalEmbeddings)
+
+
+def running_bot(store):
+    """A PropertySupportBot on the live version, without the LLM and data set up by its constructor"""
+    import threading
+    from model import PropertySupportBot
+
+    bot = object.__new__(PropertySupportBot)
+    bot.embeddings = store.embeddings
+    bot.vectorstore = store
+    bot.kb_version = current_version(DB_PATH)
+    bot.retrieval_cache = None
+    bot._incompatible_version = None
+    bot._search_retriever = None
+    bot._qa_chain = None
+    bot._tenant_qa_chains = {}
+    bot._lazy_lock = threading.Lock()
+    return bot
+
+
+def test_bot_stays_on_its_version_when_a_build_uses_another_backend(tmp_path, capsys):
+    folder = str(tmp_path / "docs")
+    write_records(folder, "agreement.clauses.json", agreement())
+    bot = running_bot(build(folder, DB_PATH))
+    openai_version = bot.kb_version
+
+    build(folder, DB_PATH, embedding_backend="local")
+    local_version = current_version(DB_PATH)
+
+    assert not bot.refresh_knowledge_base()
+    assert bot.kb_version == openai_version
+    assert f"Not switching to knowledge base version {local_version}" in capsys.readouterr().out
+    assert bot.vectorstore.similarity_search("rent arrears interest", k=1)
+    # A later build with the bot's own embeddings is picked up again
+    build(folder, DB_PATH)
+    assert bot.refresh_knowledge_base()
+    assert bot.kb_version == current_version(DB_PATH) != local_version
+
+
+def test_build_includes_only_the_configured_backends_indexes(tmp_path):
+    folder, root = str(tmp_path / "docs"), str(tmp_path / "kb")
+    write_records(folder, "agreement.clauses.json", agreement())
+
+    build(folder, root, retriever_backend="partitioned")
+    assert not os.path.exists(os.path.join(version_path(current_version(root), root), NUMPY_INDEX_DIR))
+
+    build(folder, root, FakeEmbeddings(model="other-model"), retriever_backend="numpy")
+    live = version_path(current_version(root), root)
+    assert os.path.isdir(os.path.join(live, NUMPY_INDEX_DIR))
+    assert not os.path.exists(os.path.join(live, SECTION_INDEX_DIR))
+
+
+def test_compact_migrates_a_pre_versioning_store(tmp_path, open_store):
+    folder, root = str(tmp_path / "docs"), str(tmp_path / "kb")
+    write_records(folder, "agreement.clauses.json", agreement())
+    store = open_store(root)
+    sync_knowledge_base(folder, store, root)
+    size = directory_size(root)
+
+    stats = compact(root, source=root)
+
+    assert current_version(root) == stats["version"]
+    assert (stats["chunks_before"], stats["chunks_after"]) == (3, 3)
+    # The new version written inside the source is not counted as its size
+    assert stats["bytes_before"] == size
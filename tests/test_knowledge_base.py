@@ -0,0 +1,123 @@
+import os
+
+from conftest import agreement, write_records
+from knowledge_base import (
+    load_bm25_index, load_manifest, manifest_matches, sync_knowledge_base, tenant_index_path
+)
+
+
+def stored_texts(store):
+    return store.get(include=["documents"])["documents"]
+
+
+def test_edited_clause_replaces_its_old_text(tmp_path, open_store):
+    folder, db_path = str(tmp_path / "docs"), str(tmp_path / "db")
+    write_records(folder, "agreement.clauses.json", agreement(rate=10))
+    store = open_store(db_path)
+    sync_knowledge_base(folder, store, db_path)
+
+    # The edited clause is close enough to its old text to count as a near-duplicate of it
+    write_records(folder, "agreement.clauses.json", agreement(rate=8))
+    stats = sync_knowledge_base(folder, store, db_path)
+
+    assert stats["updated"] == 1
+    assert stats["chunks_added"] == 1
+    assert stats["chunks_deduplicated"] == 0
+    assert stats["chunks_removed"] == 1
+    texts = stored_texts(store)
+    assert any("8 per cent" in text for text in texts)
+    assert not any("10 per cent" in text for text in texts)
+
+
+def test_first_sync_adds_every_chunk(tmp_path, open_store):
+    folder, db_path = str(tmp_path / "docs"), str(tmp_path / "db")
+    write_records(folder, "agreement.clauses.json", agreement())
+    store = open_store(db_path)
+
+    stats = sync_knowledge_base(folder, store, db_path)
+
+    assert (stats["added"], stats["chunks_added"]) == (1, 3)
+    assert store._collection.count() == 3
+    assert list(load_manifest(db_path)["files"]) == ["agreement.clauses.json"]
+
+
+def test_unchanged_folder_embeds_nothing(tmp_path, open_store, embeddings):
+    folder, db_path = str(tmp_path / "docs"), str(tmp_path / "db")
+    write_records(folder, "agreement.clauses.json", agreement())
+    store = open_store(db_path)
+    sync_knowledge_base(folder, store, db_path)
+    calls = embeddings.calls
+
+    stats = sync_knowledge_base(folder, store, db_path)
+
+    assert (stats["unchanged"], stats["chunks_added"], stats["chunks_removed"]) == (1, 0, 0)
+    assert embeddings.calls == calls
+    assert manifest_matches(folder, db_path)
+
+
+def test_edit_only_embeds_the_changed_clause(tmp_path, open_store):
+    folder, db_path = str(tmp_path / "docs"), str(tmp_path / "db")
+    write_records(folder, "agreement.clauses.json", agreement())
+    store = open_store(db_path)
+    sync_knowledge_base(folder, store, db_path)
+    ids = set(store.get(include=[])["ids"])
+
+    records = agreement()
+    records[2]["text"] = "The Landlord shall bear all property tax on the premises for the whole term."
+    write_records(folder, "agreement.clauses.json", records)
+    stats = sync_knowledge_base(folder, store, db_path)
+
+    new_ids = set(store.get(include=[])["ids"])
+    assert (stats["chunks_added"], stats["chunks_removed"]) == (1, 1)
+    assert len(ids & new_ids) == 2
+    assert any("whole term" in text for text in stored_texts(store))
+
+
+def test_removed_then_readded_file(tmp_path, open_store):
+    folder, db_path = str(tmp_path / "docs"), str(tmp_path / "db")
+    path = write_records(folder, "agreement.clauses.json", agreement())
+    store = open_store(db_path)
+    sync_knowledge_base(folder, store, db_path)
+
+    os.remove(path)
+    stats = sync_knowledge_base(folder, store, db_path)
+    assert (stats["removed"], stats["chunks_removed"]) == (1, 3)
+    assert store._collection.count() == 0
+    assert load_manifest(db_path)["files"] == {}
+    assert len(load_bm25_index(store, db_path)) == 0
+
+    write_records(folder, "agreement.clauses.json", agreement())
+    stats = sync_knowledge_base(folder, store, db_path)
+    assert (stats["added"], stats["chunks_added"]) == (1, 3)
+    assert store._collection.count() == 3
+
+
+def test_duplicate_file_is_collapsed_and_survives_removal_of_the_original(tmp_path, open_store):
+    folder, db_path = str(tmp_path / "docs"), str(tmp_path / "db")
+    first = write_records(folder, "a.clauses.json", agreement())
+    write_records(folder, "b.clauses.json", agreement())
+    store = open_store(db_path)
+
+    stats = sync_knowledge_base(folder, store, db_path)
+    assert (stats["chunks_added"], stats["chunks_deduplicated"]) == (3, 3)
+    assert all(metadata["duplicates"] == 1 for metadata in store.get(include=["metadatas"])["metadatas"])
+
+    os.remove(first)
+    stats = sync_knowledge_base(folder, store, db_path)
+    assert stats["chunks_removed"] == 0
+    metadatas = store.get(include=["metadatas"])["metadatas"]
+    assert len(metadatas) == 3
+    assert all(metadata["source"].endswith("b.clauses.json") and metadata["duplicates"] == 0
+               for metadata in metadatas)
+
+
+def test_tenant_agreement_is_kept_out_of_the_shared_collection(tmp_path, open_store):
+    folder, db_path = str(tmp_path / "docs"), str(tmp_path / "db")
+    write_records(folder, "lease.clauses.json", agreement(ref_no="SPPL/2023/0007"))
+    store = open_store(db_path)
+
+    stats = sync_knowledge_base(folder, store, db_path)
+
+    assert stats["leases"] == 1
+    assert store._collection.count() == 0
+    assert os.path.isdir(tenant_index_path(db_path, "SPPL/2023/0007"))
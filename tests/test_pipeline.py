@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from pipeline import format_stage_stats, run_pipeline
+
+
+def double(items, stats):
+    for item in items:
+        stats.units += 2
+        yield item * 2
+
+
+def collect(into):
+    def stage(items, stats):
+        for item in items:
+            into.append(item)
+            yield item
+    return stage
+
+
+def test_items_flow_through_every_stage_in_order():
+    results = []
+
+    stats = run_pipeline(range(20), [("double", double), ("add", lambda items, _: (i + 1 for i in items)),
+                                     ("collect", collect(results))], queue_size=2)
+
+    assert results == [i * 2 + 1 for i in range(20)]
+    assert list(stats) == ["double", "add", "collect"]
+    assert [stage["items"] for stage in stats.values()] == [20, 20, 20]
+    assert stats["double"]["units"] == 40
+    # Bounded queues never hold more than queue_size items
+    assert stats["add"]["queue_max"] <= 2
+    assert len(format_stage_stats(stats, "chunks")) == 3
+
+
+def test_an_error_in_an_upstream_stage_is_raised_and_stops_the_pipeline():
+    received = []
+
+    def fail_at_five(items, _):
+        for item in items:
+            if item == 5:
+                raise RuntimeError("embedding request failed")
+            yield item
+
+    with pytest.raises(RuntimeError, match="embedding request failed"):
+        run_pipeline(range(100), [("embed", fail_at_five), ("collect", collect(received))])
+
+    assert received == [0, 1, 2, 3, 4]
+
+
+def test_an_error_in_the_last_stage_releases_the_stages_blocked_before_it():
+    produced = []
+
+    def endless(items, _):
+        for item in items:
+            produced.append(item)
+            yield item
+
+    def fail_on_first(items, _):
+        for _ in items:
+            raise ValueError("cannot write to the store")
+        yield from ()
+
+    def source():
+        i = 0
+        while True:
+            yield i
+            i += 1
+
+    start = time.perf_counter()
+    with pytest.raises(ValueError, match="cannot write"):
+        run_pipeline(source(), [("read", endless), ("write", fail_on_first)], queue_size=1)
+
+    # The reader stopped instead of filling memory or blocking forever on the full queue
+    assert time.perf_counter() - start < 5
+    assert len(produced) < 10
@@ -0,0 +1,82 @@
+from quick_answers import QuickAnswers
+
+IR = "information_retrieval"
+DATA = "property_data_analysis"
+QUESTIONS = {"Can I keep pets?": IR, "Average rent in Bishan?": DATA}
+
+
+class FakeBot:
+    """Answers each question with its expected route, or `replies[question]` as (answer, route) when given"""
+
+    def __init__(self):
+        self.versions = {IR: "v1", DATA: "csv1"}
+        self.replies = {}
+        self.asked = []
+
+    def refresh_knowledge_base(self):
+        return False
+
+    def data_versions(self):
+        return dict(self.versions)
+
+    async def answer_query_async(self, query, tenant_id=None):
+        self.asked.append((query, tenant_id))
+        return self.replies.get(query, (f"{query} ({self.versions[QUESTIONS[query]]})", QUESTIONS[query]))
+
+
+def test_answers_are_computed_once_per_data_version():
+    bot = FakeBot()
+    quick = QuickAnswers(bot, QUESTIONS)
+
+    assert quick.refresh() == 2
+    assert quick.get("Can I keep pets?") == "Can I keep pets? (v1)"
+    assert quick.refresh() == 0
+
+    # A new knowledge base recomputes only the questions answered from it
+    bot.versions[IR] = "v2"
+    bot.asked.clear()
+    assert quick.refresh() == 1
+    assert bot.asked == [("Can I keep pets?", None)]
+    assert quick.get("Can I keep pets?") == "Can I keep pets? (v2)"
+    assert quick.get("Average rent in Bishan?") == "Average rent in Bishan? (csv1)"
+
+
+def test_replies_from_another_route_are_not_stored():
+    bot = FakeBot()
+    # e.g. the classifier timed out and the general model answered, or the QA chain failed
+    bot.replies = {"Can I keep pets?": ("Pets are lovely companions.", "general_support"),
+                   "Average rent in Bishan?": ("I'm having trouble accessing the property data analysis", None)}
+    quick = QuickAnswers(bot, QUESTIONS)
+
+    quick.refresh()
+    assert quick.get("Can I keep pets?") is None
+    assert quick.ready() == 0
+
+    bot.replies = {}
+    assert quick.refresh() == 2
+    assert quick.get("Can I keep pets?") == "Can I keep pets? (v1)"
+
+
+def test_failed_recompute_keeps_serving_the_previous_answer():
+    bot = FakeBot()
+    quick = QuickAnswers(bot, QUESTIONS)
+    quick.refresh()
+
+    bot.versions[IR] = "v2"
+    bot.replies = {"Can I keep pets?": ("I apologize, but I encountered an error", None)}
+    quick.refresh()
+
+    assert quick.get("Can I keep pets?") == "Can I keep pets? (v1)"
+    bot.replies = {}
+    assert quick.refresh() == 1
+    assert quick.get("Can I keep pets?") == "Can I keep pets? (v2)"
+
+
+def test_new_tenants_get_their_own_answers():
+    bot = FakeBot()
+    quick = QuickAnswers(bot, QUESTIONS, tenants=())
+
+    assert quick.get("Can I keep pets?", "SPPL/2023/0007") is None
+    assert quick.refresh() == 2
+    assert quick.ready("SPPL/2023/0007") == 2
+    assert ("Can I keep pets?", "SPPL/2023/0007") in bot.asked
@@ -0,0 +1,121 @@
+import retrieval_cache
+from conftest import FakeEmbeddings
+from retrieval_cache import QUERY_BATCH_MAX, CachedRetriever, LRUCache, RetrievalCache
+from retrievers import NumpyRetriever, NumpyVectorIndex
+
+TEXTS = ["the landlord replaces the light bulbs", "pets need the landlord's consent", "rent is due monthly"]
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    """FakeEmbeddings that also count single queries"""
+
+    def __init__(self):
+        super().__init__()
+        self.queries = 0
+
+    def embed_query(self, text):
+        self.queries += 1
+        return super().embed_query(text)
+
+
+class CountingRetriever:
+    def __init__(self, retriever):
+        self.retriever = retriever
+        self.calls = 0
+
+    def invoke(self, query):
+        self.calls += 1
+        return self.retriever.invoke(query)
+
+
+def cached_retriever(tmp_path, cache, embeddings, scope="numpy:3"):
+    """A NumpyRetriever over TEXTS behind a CachedRetriever, both embedding through the cache"""
+    index = NumpyVectorIndex.build(str(tmp_path / "index"), [f"c{i}" for i in range(len(TEXTS))], TEXTS,
+                                   [{} for _ in TEXTS], embeddings.embed_documents(TEXTS))
+    embeddings = cache.wrap(embeddings)
+    search = CountingRetriever(NumpyRetriever(index=index, embeddings=embeddings, k=2))
+    return CachedRetriever(retriever=search, cache=cache, embeddings=embeddings, scope=scope), search
+
+
+def test_repeated_queries_skip_the_embedding_and_the_search(tmp_path):
+    embeddings = CountingEmbeddings()
+    cache = RetrievalCache(version="v1")
+    retriever, search = cached_retriever(tmp_path, cache, embeddings)
+    # Not counting the chunks embedded for the index
+    embeddings.queries = 0
+
+    first = retriever.invoke("Who replaces the light bulbs?")
+    repeated = retriever.invoke("who replaces the  light bulbs?")
+
+    # The cached chunks are the ones the search returned, and the query was embedded once
+    assert [(doc.page_content, doc.metadata) for doc in repeated] == [(doc.page_content, doc.metadata)
+                                                                     for doc in first]
+    assert first[0].page_content == TEXTS[0]
+    assert search.calls == 1
+    assert embeddings.queries == 1
+    assert cache.stats()["results"]["hits"] == 1
+
+    # Document batches (knowledge base builds) are not cached
+    retriever.embeddings.embed_documents(TEXTS * QUERY_BATCH_MAX)
+    assert len(cache.queries) == 1
+
+
+def test_a_new_knowledge_base_version_drops_the_results(tmp_path):
+    cache = RetrievalCache(version="v1")
+    retriever, search = cached_retriever(tmp_path, cache, CountingEmbeddings())
+    retriever.invoke("are pets allowed")
+
+    cache.set_version("v1")
+    retriever.invoke("are pets allowed")
+    assert search.calls == 1
+
+    cache.set_version("v2")
+    assert len(cache.results) == 0
+    retriever.invoke("are pets allowed")
+    assert search.calls == 2
+    # Query embeddings do not depend on the version and are kept
+    assert cache.stats()["queries"]["hits"] >= 2
+
+
+def test_retrievers_with_different_scopes_do_not_share_results(tmp_path):
+    cache = RetrievalCache(version="v1")
+    retriever, search = cached_retriever(tmp_path, cache, CountingEmbeddings())
+    other = CachedRetriever(retriever=search, cache=cache, embeddings=retriever.embeddings, scope="tenant:0007")
+
+    retriever.invoke("are pets allowed")
+    other.invoke("are pets allowed")
+
+    assert search.calls == 2
+
+
+def test_lru_cache_evicts_and_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(retrieval_cache.time, "time", lambda: now[0])
+    cache = LRUCache("results", max_entries=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    # "b" was the least recently used
+    assert cache.get("b") is None
+    now[0] += 61
+    assert cache.get("a") is None
+    assert cache.stats()["evictions"] == 1 and cache.stats()["expired"] == 1
+
+
+def test_persisted_cache_starts_warm_for_its_version(tmp_path):
+    path = str(tmp_path / "cache" / "retrieval.sqlite3")
+    cache = RetrievalCache(version="v1", persist_path=path)
+    retriever, _ = cached_retriever(tmp_path, cache, CountingEmbeddings())
+    retriever.invoke("are pets allowed")
+
+    restarted = RetrievalCache(version="v1", persist_path=path)
+    retriever, search = cached_retriever(tmp_path, restarted, CountingEmbeddings())
+    assert retriever.invoke("are pets allowed")[0].page_content == TEXTS[1]
+    assert search.calls == 0
+
+    # A bot starting on another version keeps the query embeddings only
+    upgraded = RetrievalCache(version="v2", persist_path=path)
+    assert len(upgraded.results) == 0
+    assert len(upgraded.queries) == 1
@@ -0,0 +1,380 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from conftest import agreement, write_records
+from knowledge_base import sync_knowledge_base, tenant_index_path
+from partitions import partition_metadata, query_filter
+from retrievers import (
+    HierarchicalIndex, HierarchicalRetriever, MMRRetriever, NumpyRetriever, NumpyVectorIndex, PartitionedRetriever,
+    QuantizedVectorIndex, TenantRetriever, mmr_select, normalize_rows, tenant_index_exists
+)
+
+
+def random_chunks(n=200, dim=32, seed=0):
+    """IDs, texts, metadatas and vectors of n random chunks"""
+    rng = np.random.default_rng(seed)
+    ids = [f"chunk-{i}" for i in range(n)]
+    texts = [f"text {i}" for i in range(n)]
+    metadatas = [{"source": f"doc-{i % 10}.pdf", "page": i % 4} for i in range(n)]
+    return ids, texts, metadatas, rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def exact_top_k(vectors, query_vectors, k):
+    """Reference top-k by sorting every cosine similarity"""
+    scores = normalize_rows(np.atleast_2d(query_vectors)) @ normalize_rows(vectors).T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def low_rank_chunks(n=500, dim=64, rank=8, seed=0):
+    """Random chunks whose vectors lie near a low-dimensional subspace, as text embeddings do"""
+    rng = np.random.default_rng(seed)
+    ids, texts, metadatas, _ = random_chunks(n, dim, seed)
+    vectors = rng.standard_normal((n, rank)) @ rng.standard_normal((rank, dim)) + 0.05 * rng.standard_normal((n, dim))
+    queries = rng.standard_normal((50, rank)) @ rng.standard_normal((rank, dim))
+    return ids, texts, metadatas, vectors.astype(np.float32), vectors[:50] + 0.1 * queries
+
+
+def recall(approximate, exact):
+    return np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approximate, exact)])
+
+
+def test_numpy_index_returns_the_exact_top_k(tmp_path):
+    ids, texts, metadatas, vectors = random_chunks()
+    index = NumpyVectorIndex.build(str(tmp_path / "index"), ids, texts, metadatas, vectors)
+    queries = np.random.default_rng(1).standard_normal((20, vectors.shape[1]))
+
+    indices, scores = index.search(queries, k=5)
+
+    assert (indices == exact_top_k(vectors, queries, 5)).all()
+    assert (np.diff(scores, axis=1) <= 0).all()
+    # A single query vector is a batch of one
+    single, _ = index.search(queries[0], k=5)
+    assert (single[0] == indices[0]).all()
+
+
+def test_numpy_index_round_trips_through_disk(tmp_path):
+    ids, texts, metadatas, vectors = random_chunks(n=10)
+    NumpyVectorIndex.build(str(tmp_path / "index"), ids, texts, metadatas, vectors)
+
+    index = NumpyVectorIndex.load(str(tmp_path / "index"))
+    doc = index.document(3, score=0.5)
+
+    assert isinstance(index.vectors, np.memmap)
+    assert len(index) == 10
+    assert doc.page_content == "text 3"
+    assert doc.metadata == {"source": "doc-3.pdf", "page": 3, "id": "chunk-3", "score": 0.5}
+
+
+def test_numpy_index_follows_the_chroma_collection(tmp_path, open_store):
+    store = open_store(tmp_path / "db")
+    store.add_texts(["rent is due monthly", "pets need consent"], ids=["a", "b"])
+    index_path = str(tmp_path / "db" / "numpy_index")
+
+    index = NumpyVectorIndex.from_chroma(store)
+    assert sorted(index.ids) == ["a", "b"]
+    assert NumpyVectorIndex.from_chroma(store).digest == index.digest
+
+    store.add_texts(["aircon servicing every quarter"], ids=["c"])
+    assert sorted(NumpyVectorIndex.from_chroma(store, index_path).ids) == ["a", "b", "c"]
+
+    retriever = NumpyRetriever(index=NumpyVectorIndex.load(index_path), embeddings=store.embeddings, k=1)
+    assert retriever.invoke("are pets allowed? pets need consent")[0].metadata["id"] == "b"
+
+
+def test_numpy_index_edge_cases(tmp_path):
+    empty = NumpyVectorIndex.build(str(tmp_path / "empty"), [], [], [], [])
+    indices, scores = empty.search(np.ones(8), k=3)
+    assert indices.shape == scores.shape == (1, 0)
+
+    ids, texts, metadatas, vectors = random_chunks(n=2)
+    small = NumpyVectorIndex.build(str(tmp_path / "small"), ids, texts, metadatas, vectors)
+    assert small.search(vectors[0], k=5)[0].shape == (1, 2)
+
+    with pytest.raises(FileNotFoundError):
+        NumpyVectorIndex.load(str(tmp_path / "missing"))
+    # Temp files from the build are all renamed into place
+    assert sorted(os.listdir(tmp_path / "small")) == [NumpyVectorIndex.CHUNKS_FILE, NumpyVectorIndex.VECTORS_FILE]
+
+
+PARTITIONED_CHUNKS = [
+    ("condo-pets", "condo", "whole", "pets may be kept in the condo with management corporation approval"),
+    ("condo-pool", "condo", "whole", "the condo pool and gym are shared facilities"),
+    ("hdb-pets", "hdb", "whole", "pets may be kept in the hdb flat only if approved by hdb"),
+    ("hdb-room", "hdb", "bedroom", "the tenant renting a bedroom shares the kitchen"),
+    ("standard-rent", "standard", None, "rent is paid monthly in advance and pets need consent"),
+]
+
+
+def partitioned_store(open_store, db_path):
+    store = open_store(db_path)
+    store.add_texts(
+        [text for *_, text in PARTITIONED_CHUNKS],
+        metadatas=[partition_metadata([{"property_types": [property_type], "rental_type": rental_type}])
+                   for _, property_type, rental_type, _ in PARTITIONED_CHUNKS],
+        ids=[chunk_id for chunk_id, *_ in PARTITIONED_CHUNKS],
+    )
+    return store
+
+
+def brute_force_ids(embeddings, query, chunk_ids, k):
+    """Chunks ranked by exact cosine similarity to the query"""
+    texts = {chunk_id: text for chunk_id, *_, text in PARTITIONED_CHUNKS}
+    query_vector = np.asarray(embeddings.embed_query(query))
+    scores = {chunk_id: float(np.dot(query_vector, embeddings.embed_query(texts[chunk_id]))) for chunk_id in chunk_ids}
+    return sorted(scores, key=scores.get, reverse=True)[:k]
+
+
+def test_partitioned_search_is_the_exact_top_k_within_the_named_partitions(tmp_path, open_store, embeddings):
+    store = partitioned_store(open_store, tmp_path / "db")
+    # Unfiltered, the HDB pets clause would rank first
+    query = "pets may be kept in my condo only if approved"
+
+    docs = PartitionedRetriever(vectorstore=store, k=2).invoke(query)
+
+    allowed = ["condo-pets", "condo-pool", "standard-rent"]
+    assert [doc.metadata["id"] for doc in docs] == brute_force_ids(embeddings, query, allowed, 2)
+    assert brute_force_ids(embeddings, query, [chunk_id for chunk_id, *_ in PARTITIONED_CHUNKS], 1) == ["hdb-pets"]
+    assert all(doc.metadata["pt_condo"] or doc.metadata["pt_standard"] for doc in docs)
+
+
+def test_partitioned_search_falls_back_to_the_whole_collection(tmp_path, open_store, embeddings):
+    store = partitioned_store(open_store, tmp_path / "db")
+    retriever = PartitionedRetriever(vectorstore=store, k=3)
+
+    # Only one chunk is about renting a bedroom; a query naming no partition searches everything
+    for query in ["renting a bedroom with pets", "are pets allowed"]:
+        docs = retriever.invoke(query)
+        all_ids = [chunk_id for chunk_id, *_ in PARTITIONED_CHUNKS]
+        assert [doc.metadata["id"] for doc in docs] == brute_force_ids(embeddings, query, all_ids, 3)
+    assert query_filter("are pets allowed") is None
+    assert PartitionedRetriever(vectorstore=open_store(tmp_path / "empty"), k=3).invoke("condo pets") == []
+
+
+TENANT = "SPPL/2023/0007"
+
+
+def tenant_store(tmp_path, open_store):
+    """Shared clauses at 10% arrears interest plus one tenant's lease at 12%"""
+    folder, db_path = str(tmp_path / "docs"), str(tmp_path / "db")
+    write_records(folder, "shared.clauses.json", agreement())
+    write_records(folder, "lease.clauses.json", agreement(rate=12, ref_no=TENANT))
+    store = open_store(db_path)
+    sync_knowledge_base(folder, store, db_path)
+    return store
+
+
+def test_tenant_search_merges_the_exact_lease_top_k_with_the_shared_retriever(tmp_path, open_store, embeddings):
+    store = tenant_store(tmp_path, open_store)
+    shared = PartitionedRetriever(vectorstore=store, k=3)
+    query = "interest on rent arrears"
+    lease = NumpyVectorIndex.load(tenant_index_path(str(tmp_path / "db"), TENANT))
+
+    docs = TenantRetriever(vectorstore=store, retriever=shared, tenant_key="7", k=3).invoke(query)
+
+    # The lease index is searched exactly
+    assert [lease.texts[i] for i in lease.search(embeddings.embed_query(query), 1)[0][0]] == [docs[0].page_content]
+    assert "12 per cent" in docs[0].page_content
+    # Shared chunks fill the rest, without repeating text the lease already contains
+    texts = [doc.page_content for doc in docs]
+    assert len(set(texts)) == len(texts) == 3
+    assert any("10 per cent" in text for text in texts)
+
+
+def test_tenant_without_an_agreement_gets_the_shared_results(tmp_path, open_store):
+    store = tenant_store(tmp_path, open_store)
+    shared = PartitionedRetriever(vectorstore=store, k=3)
+    query = "interest on rent arrears"
+
+    assert tenant_index_exists(store, TENANT)
+    assert not tenant_index_exists(store, "DSS5105")
+    assert not tenant_index_exists(store, None)
+    docs = TenantRetriever(vectorstore=store, retriever=shared, tenant_key="DSS5105", k=3).invoke(query)
+    assert [doc.page_content for doc in docs] == [doc.page_content for doc in shared.invoke(query)]
+
+
+def test_bot_uses_the_shared_chain_for_tenants_without_an_agreement(tmp_path, open_store, monkeypatch):
+    import model
+    from model import PropertySupportBot
+
+    monkeypatch.setattr(model, "create_pdf_qa_system", lambda vectorstore, llm, retriever: retriever)
+    bot = object.__new__(PropertySupportBot)
+    bot.vectorstore = tenant_store(tmp_path, open_store)
+    bot.llm = None
+    bot.retriever_backend, bot.retriever_k, bot.clause_lookup = "partitioned", 3, True
+    bot.retrieval_cache, bot.context_packer = None, None
+    bot._search_retriever, bot._qa_chain, bot._tenant_qa_chains = None, None, {}
+    bot._lazy_lock = threading.Lock()
+
+    assert bot.qa_chain_for("DSS5105") is bot.qa_chain
+    tenant_chain = bot.qa_chain_for("0007")
+    assert isinstance(tenant_chain, TenantRetriever)
+    # Clause lookup and the configured backend apply to the tenant's chain too
+    assert tenant_chain.retriever is bot.qa_chain
+
+
+# PCA keeps the subspace the vectors lie in; a random projection of the same size loses more
+@pytest.mark.parametrize("reduction,dtype,dim,min_recall", [
+    ("pca", "int8", 16, 0.99), ("pca", "float16", 16, 0.99), ("random", "int8", 32, 0.85), ("none", "int8", 16, 0.99),
+])
+def test_quantized_index_recalls_the_exact_top_k(tmp_path, reduction, dtype, dim, min_recall):
+    ids, texts, metadatas, vectors, queries = low_rank_chunks()
+    exact = NumpyVectorIndex.build(str(tmp_path / "exact"), ids, texts, metadatas, vectors)
+    quantized = QuantizedVectorIndex.build(str(tmp_path / "quantized"), ids, texts, metadatas, vectors, dim=dim,
+                                           reduction=reduction, dtype=dtype)
+
+    exact_indices, _ = exact.search(queries, k=5)
+    indices, scores = quantized.search(queries, k=5)
+
+    assert recall(indices, exact_indices) >= min_recall
+    # Returned chunks are rescored with their full float32 vectors
+    assert np.allclose(scores, np.take_along_axis(normalize_rows(queries) @ exact.vectors.T, indices, axis=1),
+                       atol=1e-5)
+    assert quantized.codes.dtype == np.dtype(dtype)
+
+
+def test_quantized_index_round_trips_and_rejects_unknown_options(tmp_path):
+    ids, texts, metadatas, vectors, queries = low_rank_chunks(n=100)
+    built = QuantizedVectorIndex.build(str(tmp_path / "index"), ids, texts, metadatas, vectors, dim=16)
+    loaded = QuantizedVectorIndex.load(str(tmp_path / "index"))
+
+    assert (loaded.search(queries, k=3)[0] == built.search(queries, k=3)[0]).all()
+    assert sorted(os.listdir(tmp_path / "index")) == sorted([
+        NumpyVectorIndex.CHUNKS_FILE, NumpyVectorIndex.VECTORS_FILE, QuantizedVectorIndex.CODES_FILE,
+        QuantizedVectorIndex.PROJECTION_FILE])
+    with pytest.raises(ValueError):
+        QuantizedVectorIndex.build(str(tmp_path / "bad"), ids, texts, metadatas, vectors, dtype="int4")
+    with pytest.raises(ValueError):
+        QuantizedVectorIndex.build(str(tmp_path / "bad"), ids, texts, metadatas, vectors, reduction="lsh")
+    empty = QuantizedVectorIndex.build(str(tmp_path / "empty"), [], [], [], [])
+    assert empty.search(queries[0], k=3)[0].shape == (1, 0)
+
+
+def sectioned_chunks(n_sections=20, per_section=10, dim=32, seed=0):
+    """Chunks grouped into numbered sections whose vectors cluster around a section centre.
+
+    Even sections are condominium clauses, odd ones HDB clauses.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_sections, dim))
+    ids, texts, metadatas, vectors = [], [], [], []
+    for section in range(n_sections):
+        property_type = "condo" if section % 2 == 0 else "hdb"
+        for part in range(per_section):
+            ids.append(f"chunk-{section}-{part}")
+            texts.append(f"section {section} part {part}")
+            metadatas.append({"source": f"doc-{section // 5}.pdf", "section": f"{section}. clause",
+                              f"pt_{property_type}": True})
+            vectors.append(centres[section] + 0.3 * rng.standard_normal(dim))
+    return ids, texts, metadatas, np.asarray(vectors, dtype=np.float32)
+
+
+def test_hierarchical_index_recalls_the_exact_top_k(tmp_path):
+    ids, texts, metadatas, vectors = sectioned_chunks()
+    chunks = NumpyVectorIndex.build(str(tmp_path / "chunks"), ids, texts, metadatas, vectors)
+    index = HierarchicalIndex.build(str(tmp_path / "sections"), chunks, n_sections=3)
+    queries = vectors[::7] + 0.3 * np.random.default_rng(1).standard_normal((len(vectors[::7]), vectors.shape[1]))
+
+    exact_indices, _ = chunks.search(queries, k=5)
+    indices, scores = index.search(queries, k=5)
+
+    assert len(index.sections) == 20
+    assert recall(indices, exact_indices) >= 0.95
+    # Chunks within the searched sections are scored exactly
+    assert np.allclose(scores, np.take_along_axis(normalize_rows(queries) @ chunks.vectors.T, indices, axis=1),
+                       atol=1e-5)
+    # Only chunks of the selected sections are scored
+    assert len(index.candidate_rows(normalize_rows(queries)[0], k=5)) == 30
+
+
+def test_hierarchical_index_includes_every_named_property_type(tmp_path):
+    ids, texts, metadatas, vectors = sectioned_chunks()
+    chunks = NumpyVectorIndex.build(str(tmp_path / "chunks"), ids, texts, metadatas, vectors)
+    index = HierarchicalIndex.build(str(tmp_path / "sections"), chunks, n_sections=1)
+    # A query close to one condo section
+    query = vectors[ids.index("chunk-4-0")]
+
+    indices, _ = index.search(query, k=3)
+    assert all("pt_condo" in chunks.metadatas[i] for i in indices[0])
+
+    indices, scores = index.search(query, k=3, property_types=["condo", "hdb"])
+    assert any("pt_hdb" in chunks.metadatas[i] for i in indices[0])
+    assert len(indices[0]) == 3
+    assert (np.diff(scores[0]) <= 0).all()
+
+
+def test_hierarchical_index_is_rebuilt_when_the_chunks_change(tmp_path, open_store, capsys):
+    store = open_store(tmp_path / "db")
+    store.add_texts(["rent is due monthly", "pets need consent"], ids=["a", "b"],
+                    metadatas=[{"source": "a.pdf", "section": "1. rent"}, {"source": "a.pdf", "section": "2. pets"}])
+    section_path = str(tmp_path / "db" / "section_index")
+
+    index = HierarchicalIndex.from_chunks(NumpyVectorIndex.from_chroma(store), section_path)
+    assert len(index.sections) == 2
+    capsys.readouterr()
+    HierarchicalIndex.from_chunks(NumpyVectorIndex.from_chroma(store), section_path)
+    assert "Building section index" not in capsys.readouterr().out
+
+    store.add_texts(["aircon servicing every quarter"], ids=["c"], metadatas=[{"source": "b.pdf", "page": 0}])
+    index = HierarchicalIndex.from_chunks(NumpyVectorIndex.from_chroma(store), section_path)
+    assert sorted(index.sections.ids) == ["a.pdf#1. rent", "a.pdf#2. pets", "b.pdf#page 0"]
+
+    retriever = HierarchicalRetriever(index=index, embeddings=store.embeddings, k=1)
+    assert retriever.invoke("are pets allowed? pets need consent")[0].metadata["id"] == "b"
+
+
+def test_hierarchical_index_edge_cases(tmp_path):
+    empty_chunks = NumpyVectorIndex.build(str(tmp_path / "empty"), [], [], [], [])
+    empty = HierarchicalIndex.build(str(tmp_path / "empty_sections"), empty_chunks)
+    indices, scores = empty.search(np.ones(8), k=3)
+    assert indices.shape == scores.shape == (1, 0)
+
+    # More results asked for than the selected sections hold: further sections are searched
+    ids, texts, metadatas, vectors = sectioned_chunks(n_sections=4, per_section=2)
+    chunks = NumpyVectorIndex.build(str(tmp_path / "chunks"), ids, texts, metadatas, vectors)
+    index = HierarchicalIndex.build(str(tmp_path / "sections"), chunks, n_sections=1)
+    assert sorted(index.search(vectors[0], k=8)[0][0]) == list(range(8))
+    # A property type no section is tagged with adds nothing
+    assert (index.search(vectors[0], k=2, property_types=["landed"])[0] == index.search(vectors[0], k=2)[0]).all()
+
+
+def test_mmr_without_diversity_is_the_exact_top_k():
+    _, _, _, vectors = random_chunks(n=50)
+    query = np.random.default_rng(1).standard_normal(vectors.shape[1])
+
+    picked, scores = mmr_select(query, vectors, k=5, lambda_mult=1.0)
+
+    assert picked == list(exact_top_k(vectors, query, 5)[0])
+    assert np.allclose(scores, normalize_rows(vectors)[picked] @ normalize_rows([query])[0])
+
+
+def test_mmr_picks_one_of_several_duplicates():
+    rng = np.random.default_rng(0)
+    query = rng.standard_normal(16)
+    duplicate = query + 0.1 * rng.standard_normal(16)
+    others = [query + 0.6 * rng.standard_normal(16) for _ in range(3)]
+    vectors = np.stack([duplicate, duplicate, duplicate] + others)
+
+    assert sorted(mmr_select(query, vectors, k=3, lambda_mult=1.0)[0]) == [0, 1, 2]
+    picked, _ = mmr_select(query, vectors, k=3, lambda_mult=0.5)
+    assert picked[0] == 0
+    assert not set(picked[1:]) & {1, 2}
+    assert mmr_select(query, vectors[:0], k=3)[0] == []
+
+
+def test_mmr_retriever_fills_the_results_with_distinct_clauses(tmp_path, open_store):
+    store = open_store(tmp_path / "db")
+    repeated = "the tenant shall pay the rent monthly in advance"
+    store.add_texts([repeated, repeated, repeated, "the tenant shall pay the rent by giro",
+                     "the tenant shall not keep pets"], ids=["a1", "a2", "a3", "giro", "pets"])
+    query = "when shall the tenant pay the rent"
+
+    plain = MMRRetriever(vectorstore=store, k=2, lambda_mult=1.0).invoke(query)
+    diverse = MMRRetriever(vectorstore=store, k=2).invoke(query)
+
+    assert [doc.page_content for doc in plain] == [repeated, repeated]
+    assert [doc.page_content for doc in diverse] == [repeated, "the tenant shall pay the rent by giro"]
+    assert diverse[0].metadata["score"] >= diverse[1].metadata["score"]
+    assert MMRRetriever(vectorstore=open_store(tmp_path / "empty"), k=2).invoke(query) == []